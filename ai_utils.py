@@ -5,47 +5,292 @@
 
 from __future__ import annotations
 
+import asyncio
 import base64
+import hashlib
+import json
 import os
+import threading
 import time
-from dataclasses import dataclass
-from typing import List, Dict, Any
+import unicodedata
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Tuple
 
+import aiohttp
 import requests
 from requests import Response
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+from cache_utils import PersistentCache, SharedTokenCache, TTLCache
+from image_cache import ImageFingerprint, ImageResultCache
+from image_prep import decode_image_base64, open_image, prepare_for_ocr
+from rate_limit import backoff_delay
+from stock_extract import MIN_CONFIDENCE, extract_stocks
+from stock_index import normalize_code, symbol_index
+
 load_dotenv()  # 允许用 .env 文件保存 key
 
 
 # --------------------------------------------------------------------------- #
 # DeepSeek Client
 # --------------------------------------------------------------------------- #
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RetryableError(RuntimeError):
+    """可重试的上游错误，retry_after 为服务端建议的等待秒数"""
+
+    def __init__(self, msg: str, retry_after: float | None = None):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+def _retry_after(value: str | None) -> float | None:
+    try:
+        return max(float(value), 0.0) if value else None
+    except ValueError:
+        return None
+
+
+class LatencyStats:
+    """调用耗时统计（保留最近 1024 次样本）"""
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            self.count += 1
+            self.errors += 0 if ok else 1
+            self.total += seconds
+            self._samples.append(seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            samples = sorted(self._samples)
+            count, errors, total = self.count, self.errors, self.total
+        pick = lambda q: samples[min(int(q * len(samples)), len(samples) - 1)] * 1000 if samples else 0.0  # noqa: E731
+        return {
+            "count": count,
+            "errors": errors,
+            "avg_ms": total / count * 1000 if count else 0.0,
+            "p50_ms": pick(0.5),
+            "p95_ms": pick(0.95),
+            "max_ms": samples[-1] * 1000 if samples else 0.0,
+        }
+
+
+def _news_prompt(news_text: str) -> str:
+    return (
+        "你是一个金融分析师，请根据以下新闻判断其对市场的影响，"
+        "结论应为【利好】、【利空】或【中性】，并简要说明理由。"
+        "\n\n新闻内容：\n"
+        f"{news_text}\n\n"
+        "请严格按照格式回答：\n"
+        "结论：【利好/利空/中性】\n"
+        "理由：XXX"
+    )
+
+
+def _parse_news_reply(reply: str) -> Dict[str, str]:
+    # 简易解析
+    conclusion_map = {"利好": "利好", "利空": "利空", "中性": "中性"}
+    conclusion = next((c for c in conclusion_map if f"【{c}】" in reply), "未知")
+    reason = reply.split("理由：")[-1].strip()
+    return {"conclusion": conclusion, "reason": reason}
+
+
+NEWS_CONCLUSIONS = ("利好", "利空", "中性")
+
+
+def _news_batch_prompt(texts: List[str]) -> str:
+    numbered = "\n\n".join(f"【新闻{i}】\n{text}" for i, text in enumerate(texts, 1))
+    return (
+        "你是一个金融分析师，请逐条判断以下新闻对市场的影响，"
+        "结论只能是 利好、利空 或 中性，并简要说明理由。\n\n"
+        f"{numbered}\n\n"
+        "请只输出 JSON，不要输出其他内容，格式：\n"
+        '{"results": [{"id": 1, "conclusion": "利好", "reason": "XXX"}]}\n'
+        f"必须覆盖全部 {len(texts)} 条新闻，id 与新闻编号一致。"
+    )
+
+
+def _parse_news_batch_reply(reply: str | None, n: int) -> Dict[int, Dict[str, str]]:
+    """解析批量回复，返回 {下标: 结果}；格式不合法的条目不出现在返回值中"""
+    if not reply:
+        return {}
+    start, end = reply.find("{"), reply.rfind("}")
+    try:
+        data = json.loads(reply[start:end + 1])
+    except ValueError:
+        return {}
+    items = data.get("results") if isinstance(data, dict) else None
+    parsed = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        idx = item.get("id")
+        conclusion = str(item.get("conclusion", "")).strip("【】 ")
+        reason = item.get("reason")
+        if isinstance(idx, int) and 1 <= idx <= n and conclusion in NEWS_CONCLUSIONS and isinstance(reason, str):
+            parsed[idx - 1] = {"conclusion": conclusion, "reason": reason.strip()}
+    return parsed
+
+
+# --------------------------------------------------------------------------- #
+# LLM 结果缓存
+# --------------------------------------------------------------------------- #
+NEWS_MODEL = "deepseek-reasoner"
+NEWS_PROMPT_VERSION = "news-v1"  # 修改新闻 prompt 或解析逻辑时递增，旧缓存随之失效
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "llm_cache.sqlite3"),
+)
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 200000))
+NEWS_BATCH_SIZE = int(os.getenv("NEWS_BATCH_SIZE", 10))  # 每次调用打包的新闻条数
+NEWS_BATCH_ROUNDS = 3  # 解析失败条目的最多尝试轮数
+
+
+def normalize_news_text(text: str) -> str:
+    """全半角统一、空白折叠，使排版不同的同一条新闻命中同一缓存"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class LLMResultCache:
+    """两级缓存：进程内 LRU（微秒级）+ 本地 SQLite（同机多进程共享、重启不丢）"""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES, local_size: int = 4096):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.local = TTLCache(maxsize=local_size, ttl=ttl)
+        self._persistent: PersistentCache | None = None
+
+    @property
+    def persistent(self) -> PersistentCache:
+        # 首次使用时才建库，避免 import 时写盘
+        if self._persistent is None:
+            self._persistent = PersistentCache(self.path, self.max_entries, self.ttl)
+        return self._persistent
+
+    @staticmethod
+    def key(text: str, model: str, prompt_version: str) -> str:
+        digest = hashlib.md5(normalize_news_text(text).encode()).hexdigest()
+        return f"{model}:{prompt_version}:{digest}"
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        value = self.local.get(key)
+        if value is None:
+            raw = self.persistent.get(key)
+            if raw is None:
+                return None
+            value = json.loads(raw)
+            self.local.set(key, value)
+        return dict(value)
+
+    def set(self, key: str, value: Dict[str, str]) -> None:
+        self.local.set(key, dict(value))
+        self.persistent.set(key, json.dumps(value, ensure_ascii=False))
+
+
+class _NewsBatchJob:
+    """批量判断的公共流程：查缓存、去重、分组、逐条校验回填，未通过的条目留待下一轮"""
+
+    def __init__(self, texts: List[str], cache: Optional[LLMResultCache], batch_size: int):
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.keys = [LLMResultCache.key(t, NEWS_MODEL, NEWS_PROMPT_VERSION) for t in texts]
+        self.done: Dict[str, Dict[str, str]] = {}
+        self.pending: Dict[str, str] = {}  # key -> text，相同内容只判断一次
+        for key, text in zip(self.keys, texts):
+            if key in self.done or key in self.pending:
+                continue
+            cached = cache.get(key) if cache is not None else None
+            if cached:
+                self.done[key] = cached
+            else:
+                self.pending[key] = text
+
+    def chunks(self) -> List[List[tuple]]:
+        items = list(self.pending.items())
+        return [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+
+    def accept(self, chunk: List[tuple], reply: str | None) -> None:
+        parsed = _parse_news_batch_reply(reply, len(chunk))
+        for idx, (key, _) in enumerate(chunk):
+            if idx in parsed:
+                self.done[key] = parsed[idx]
+                self.pending.pop(key, None)
+                if self.cache is not None:
+                    self.cache.set(key, parsed[idx])
+
+    def results(self) -> List[Dict[str, str]]:
+        unknown = {"conclusion": "未知", "reason": ""}
+        return [dict(self.done.get(key, unknown)) for key in self.keys]
+
+
 @dataclass
 class DeepSeekClient:
+    """同步客户端：连接池复用 + 并发上限 + 抖动指数退避"""
     api_key: str = os.getenv("DEEPSEEK_API_KEY")
     api_url: str = "https://api.deepseek.com/chat/completions"
     default_model: str = "deepseek-chat"
     timeout: int = 30
     retries: int = 3
-    cooldown: float = 1.0  # seconds
+    cooldown: float = 1.0  # 退避基准时长（秒）
+    max_concurrency: int = int(os.getenv("DEEPSEEK_MAX_CONCURRENCY", 8))
+    stats: LatencyStats = field(default_factory=LatencyStats, repr=False)
+    result_cache: Optional[LLMResultCache] = field(default=None, repr=False)
 
-    def _post(self, payload: Dict[str, Any]) -> Response:
-        headers = {
+    def __post_init__(self):
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_maxsize=self.max_concurrency))
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    @property
+    def _headers(self) -> Dict[str, str]:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
-        last_exc = None
-        for _ in range(self.retries):
+
+    def _post_once(self, payload: Dict[str, Any]) -> Response:
+        with self._slots:
+            start = time.perf_counter()
             try:
-                resp = requests.post(
-                    self.api_url, headers=headers, json=payload, timeout=self.timeout
+                resp = self._session.post(
+                    self.api_url, headers=self._headers, json=payload, timeout=self.timeout
                 )
-                resp.raise_for_status()
-                return resp
-            except Exception as exc:  # noqa: BLE001
+            except requests.RequestException as exc:
+                self.stats.record(time.perf_counter() - start, ok=False)
+                raise RetryableError(str(exc)) from exc
+            self.stats.record(time.perf_counter() - start, ok=resp.ok)
+        if resp.status_code in RETRY_STATUS:
+            raise RetryableError(f"HTTP {resp.status_code}", _retry_after(resp.headers.get("Retry-After")))
+        resp.raise_for_status()
+        return resp
+
+    def _post(self, payload: Dict[str, Any]) -> Response:
+        last_exc = None
+        for attempt in range(self.retries):
+            try:
+                return self._post_once(payload)
+            except RetryableError as exc:
+                last_exc = exc
+                if attempt + 1 < self.retries:
+                    time.sleep(exc.retry_after or backoff_delay(attempt, base=self.cooldown))
+            except Exception as exc:  # noqa: BLE001  # 4xx 等不可重试错误
                 last_exc = exc
-                time.sleep(self.cooldown)
+                break
         raise RuntimeError(f"[DeepSeek] 请求失败: {last_exc!s}") from last_exc
 
     # ---- 公共调用 ---------------------------------------------------------- #
@@ -61,92 +306,252 @@ class DeepSeekClient:
 
     # ---- 业务封装 1：金融新闻判断 ------------------------------------------ #
     def analyze_financial_news(self, news_text: str) -> Dict[str, str]:
-        """返回 {'conclusion': '利好|利空|中性', 'reason': '...'}"""
-        prompt = (
-            "你是一个金融分析师，请根据以下新闻判断其对市场的影响，"
-            "结论应为【利好】、【利空】或【中性】，并简要说明理由。"
-            "\n\n新闻内容：\n"
-            f"{news_text}\n\n"
-            "请严格按照格式回答：\n"
-            "结论：【利好/利空/中性】\n"
-            "理由：XXX"
-        )
-        reply = self.chat([{"role": "user", "content": prompt}], model="deepseek-reasoner")
-        # 简易解析
-        conclusion_map = {"利好": "利好", "利空": "利空", "中性": "中性"}
-        conclusion = next((c for c in conclusion_map if f"【{c}】" in reply), "未知")
-        reason = reply.split("理由：")[-1].strip()
-        return {"conclusion": conclusion, "reason": reason}
+        """返回 {'conclusion': '利好|利空|中性', 'reason': '...'}，同一内容命中缓存时不再调用模型"""
+        key = LLMResultCache.key(news_text, NEWS_MODEL, NEWS_PROMPT_VERSION)
+        if self.result_cache is not None and (cached := self.result_cache.get(key)):
+            return cached
+        reply = self.chat([{"role": "user", "content": _news_prompt(news_text)}], model=NEWS_MODEL)
+        result = _parse_news_reply(reply)
+        if self.result_cache is not None and result["conclusion"] != "未知":
+            self.result_cache.set(key, result)
+        return result
+
+    def _ask_batch(self, chunk: List[tuple]) -> str | None:
+        try:
+            prompt = _news_batch_prompt([text for _, text in chunk])
+            return self.chat([{"role": "user", "content": prompt}], model=NEWS_MODEL)
+        except Exception:  # noqa: BLE001  # 整组失败，下一轮重试
+            return None
+
+    def analyze_financial_news_batch(self, texts: List[str],
+                                     batch_size: int = NEWS_BATCH_SIZE) -> List[Dict[str, str]]:
+        """每次调用打包 batch_size 条新闻，返回与 texts 一一对应的结果
+
+        只有解析失败的条目会在下一轮重新打包，多轮后仍失败的记为「未知」。
+        """
+        job = _NewsBatchJob(texts, self.result_cache, batch_size)
+        for _ in range(NEWS_BATCH_ROUNDS):
+            chunks = job.chunks()
+            if not chunks:
+                break
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(chunks))) as pool:
+                for chunk, reply in zip(chunks, pool.map(self._ask_batch, chunks)):
+                    job.accept(chunk, reply)
+        return job.results()
+
+
+@dataclass
+class AsyncDeepSeekClient:
+    """异步客户端（aiohttp）：单进程内可同时挂起大量 LLM 调用
+
+    ClientSession 在首次调用时于当前事件循环中创建，用完需 await close()。
+    """
+    api_key: str = os.getenv("DEEPSEEK_API_KEY")
+    api_url: str = "https://api.deepseek.com/chat/completions"
+    default_model: str = "deepseek-chat"
+    timeout: int = 30
+    retries: int = 3
+    cooldown: float = 1.0  # 退避基准时长（秒）
+    max_concurrency: int = int(os.getenv("DEEPSEEK_MAX_CONCURRENCY", 8))
+    stats: LatencyStats = field(default_factory=LatencyStats, repr=False)
+    result_cache: Optional[LLMResultCache] = field(default=None, repr=False)
+
+    def __post_init__(self):
+        self._session: aiohttp.ClientSession | None = None
+        self._slots: asyncio.Semaphore | None = None
+
+    async def _ensure_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            )
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self) -> "AsyncDeepSeekClient":
+        await self._ensure_session()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def _post_once(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        session = await self._ensure_session()
+        async with self._slots:
+            start = time.perf_counter()
+            try:
+                async with session.post(self.api_url, json=payload) as resp:
+                    if resp.status in RETRY_STATUS:
+                        self.stats.record(time.perf_counter() - start, ok=False)
+                        raise RetryableError(f"HTTP {resp.status}", _retry_after(resp.headers.get("Retry-After")))
+                    resp.raise_for_status()
+                    data = await resp.json()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+                self.stats.record(time.perf_counter() - start, ok=False)
+                raise RetryableError(str(exc)) from exc
+            self.stats.record(time.perf_counter() - start)
+            return data
+
+    async def _post(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        last_exc = None
+        for attempt in range(self.retries):
+            try:
+                return await self._post_once(payload)
+            except RetryableError as exc:
+                last_exc = exc
+                if attempt + 1 < self.retries:
+                    await asyncio.sleep(exc.retry_after or backoff_delay(attempt, base=self.cooldown))
+            except Exception as exc:  # noqa: BLE001  # 4xx 等不可重试错误
+                last_exc = exc
+                break
+        raise RuntimeError(f"[DeepSeek] 请求失败: {last_exc!s}") from last_exc
+
+    async def chat(self, messages: List[Dict[str, str]], model: str | None = None,
+                   temperature: float = 0.3) -> str:
+        payload = {
+            "model": model or self.default_model,
+            "messages": messages,
+            "temperature": temperature,
+        }
+        resp = await self._post(payload)
+        return resp["choices"][0]["message"]["content"].strip()
+
+    async def analyze_financial_news(self, news_text: str) -> Dict[str, str]:
+        """返回 {'conclusion': '利好|利空|中性', 'reason': '...'}，同一内容命中缓存时不再调用模型"""
+        key = LLMResultCache.key(news_text, NEWS_MODEL, NEWS_PROMPT_VERSION)
+        if self.result_cache is not None and (cached := self.result_cache.get(key)):
+            return cached
+        reply = await self.chat([{"role": "user", "content": _news_prompt(news_text)}], model=NEWS_MODEL)
+        result = _parse_news_reply(reply)
+        if self.result_cache is not None and result["conclusion"] != "未知":
+            self.result_cache.set(key, result)
+        return result
+
+    async def _ask_batch(self, chunk: List[tuple]) -> str | None:
+        try:
+            prompt = _news_batch_prompt([text for _, text in chunk])
+            return await self.chat([{"role": "user", "content": prompt}], model=NEWS_MODEL)
+        except Exception:  # noqa: BLE001  # 整组失败，下一轮重试
+            return None
+
+    async def analyze_financial_news_batch(self, texts: List[str],
+                                           batch_size: int = NEWS_BATCH_SIZE) -> List[Dict[str, str]]:
+        """同 DeepSeekClient.analyze_financial_news_batch，各组并发执行"""
+        job = _NewsBatchJob(texts, self.result_cache, batch_size)
+        for _ in range(NEWS_BATCH_ROUNDS):
+            chunks = job.chunks()
+            if not chunks:
+                break
+            replies = await asyncio.gather(*(self._ask_batch(chunk) for chunk in chunks))
+            for chunk, reply in zip(chunks, replies):
+                job.accept(chunk, reply)
+        return job.results()
 
 
 # --------------------------------------------------------------------------- #
 # Baidu OCR Client
 # --------------------------------------------------------------------------- #
+BAIDU_TOKEN_URL = "https://aip.baidubce.com/oauth/2.0/token"
+BAIDU_OCR_URL = "https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic"
+BAIDU_TOKEN_INVALID = {110, 111}  # token 无效 / 已过期
+BAIDU_TOKEN_REFRESH_AHEAD = 24 * 3600  # token 有效期 30 天，提前一天刷新
+
+
+class BaiduTokenCache(SharedTokenCache):
+    """百度 access_token，各 worker 共用一份"""
+
+    def __init__(self, api_key: str, secret_key: str, session: requests.Session, timeout: int):
+        key_id = hashlib.md5((api_key or "").encode()).hexdigest()[:8]
+        super().__init__(f"baidu_ocr:access_token:{key_id}", refresh_ahead=BAIDU_TOKEN_REFRESH_AHEAD)
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.session = session
+        self.timeout = timeout
+
+    def _request(self) -> Tuple[str, int]:
+        res = self.session.post(BAIDU_TOKEN_URL, params={
+            "grant_type": "client_credentials",
+            "client_id": self.api_key,
+            "client_secret": self.secret_key,
+        }, timeout=self.timeout).json()
+        token = res.get("access_token")
+        if not token:
+            raise RuntimeError(f"[BaiduOCR] 获取 access_token 失败: {res}")
+        return token, int(res.get("expires_in", 30 * 24 * 3600))
+
+
 @dataclass
 class BaiduOCRClient:
     api_key: str = os.getenv("BAIDU_API_KEY")
     secret_key: str = os.getenv("BAIDU_SECRET_KEY")
-    _token: str | None = None
     timeout: int = 30
+    pool_size: int = int(os.getenv("BAIDU_OCR_POOL_SIZE", 8))
+
+    def __post_init__(self):
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_maxsize=self.pool_size))
+        self._tokens = BaiduTokenCache(self.api_key, self.secret_key, self._session, self.timeout)
 
     @property
     def token(self) -> str:
-        if self._token:
-            return self._token
-        url = "https://aip.baidubce.com/oauth/2.0/token"
-        params = {
-            "grant_type": "client_credentials",
-            "client_id": self.api_key,
-            "client_secret": self.secret_key,
-        }
-        self._token = requests.post(url, params=params, timeout=self.timeout).json()[
-            "access_token"
-        ]
-        return self._token
+        return self._tokens.get()
 
     @staticmethod
     def _image_to_base64(image_path: str) -> str:
         with open(image_path, "rb") as f:
             return base64.b64encode(f.read()).decode()
 
+    def _ocr(self, image_base64: str) -> List[str]:
+        """调用通用文字识别；token 被判无效时换新 token 重试一次"""
+        for attempt in range(2):
+            token = self.token
+            resp = self._session.post(
+                BAIDU_OCR_URL,
+                params={"access_token": token},
+                data={"image": image_base64},
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                timeout=self.timeout,
+            )
+            resp.raise_for_status()
+            res = resp.json()
+            if res.get("error_code") in BAIDU_TOKEN_INVALID and attempt == 0:
+                self._tokens.invalidate(token)
+                continue
+            if "error_code" in res:
+                raise RuntimeError(f"[BaiduOCR] 识别失败: {res.get('error_code')} {res.get('error_msg')}")
+            return [item["words"] for item in res.get("words_result", [])]
+        return []
+
     def recognize(self, image_path: str) -> List[str]:
         """返回识别到的行文本 list[str]"""
-        url = (
-            "https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic"
-            f"?access_token={self.token}"
-        )
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        data = {"image": self._image_to_base64(image_path)}
-        resp = requests.post(url, data=data, headers=headers, timeout=self.timeout)
-        resp.raise_for_status()
-        words_result = resp.json().get("words_result", [])
-        return [item["words"] for item in words_result]
-        
+        return self._ocr(self._image_to_base64(image_path))
+
+    def recognize_bytes(self, data: bytes) -> List[str]:
+        """从图片字节识别文本"""
+        return self._ocr(base64.b64encode(data).decode())
+
     def recognize_base64(self, image_base64: str) -> List[str]:
         """从Base64图片识别文本，返回识别到的行文本 list[str]"""
-        url = (
-            "https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic"
-            f"?access_token={self.token}"
-        )
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        
         # 如果base64包含前缀(如data:image/jpeg;base64,)，需要去除
         if "," in image_base64:
             image_base64 = image_base64.split(",", 1)[1]
-            
-        data = {"image": image_base64}
-        resp = requests.post(url, data=data, headers=headers, timeout=self.timeout)
-        resp.raise_for_status()
-        words_result = resp.json().get("words_result", [])
-        return [item["words"] for item in words_result]
+        return self._ocr(image_base64)
 
 
 # --------------------------------------------------------------------------- #
 # 公共对外函数
 # --------------------------------------------------------------------------- #
 # 保持单例，避免频繁刷新 Token / 建立连接
-_deepseek = DeepSeekClient()
+_llm_cache = LLMResultCache()
+_deepseek = DeepSeekClient(result_cache=_llm_cache)
 _baidu_ocr = BaiduOCRClient()
+_image_cache = ImageResultCache()
 
 
 def analyze_financial_news(text: str) -> Dict[str, str]:
@@ -154,20 +559,81 @@ def analyze_financial_news(text: str) -> Dict[str, str]:
     return _deepseek.analyze_financial_news(text)
 
 
+def analyze_financial_news_batch(texts: List[str], batch_size: int = NEWS_BATCH_SIZE) -> List[Dict[str, str]]:
+    """批量判断新闻利好/利空/中性，每 batch_size 条只调用一次模型"""
+    return _deepseek.analyze_financial_news_batch(texts, batch_size)
+
+
 def extract_stocks_from_image(image_path: str) -> List[str]:
     """从截图中提取 A 股"股票名称 代码"（通过文件路径，保持兼容）"""
-    text_lines = _baidu_ocr.recognize(image_path)
-    return _extract_stocks_from_text_lines(text_lines)
+    with open(image_path, "rb") as f:
+        return extract_stocks_from_bytes(f.read())
 
 
 def extract_stocks_from_base64(image_base64: str) -> List[str]:
     """从Base64图片中提取A股股票（名称和代码）"""
-    text_lines = _baidu_ocr.recognize_base64(image_base64)
-    return _extract_stocks_from_text_lines(text_lines)
+    return extract_stocks_from_bytes(decode_image_base64(image_base64))
+
+
+def extract_stocks_from_bytes(data: bytes) -> List[str]:
+    """从图片字节中提取A股股票；同一张截图重复上传直接返回缓存结果"""
+    cached, fingerprint, data = prepare_image(data)
+    return cached if cached is not None else extract_stocks_from_prepared(fingerprint, data)
+
+
+def prepare_image(data: bytes) -> Tuple[Optional[List[str]], ImageFingerprint, bytes]:
+    """查识别结果缓存并做 OCR 预处理，返回 (缓存结果或 None, 图片指纹, 待识别的图片字节)
+
+    图片只解码一次，感知缓存比对和 OCR 预处理共用解码结果。
+    """
+    cached, fingerprint = _image_cache.lookup(data)
+    if cached is not None:
+        return cached, fingerprint, data
+    decoded = open_image(data)
+    if decoded is not None:
+        cached = _image_cache.lookup_similar(fingerprint, decoded)
+        if cached is not None:
+            return cached, fingerprint, data
+        data = prepare_for_ocr(decoded[0])
+    return None, fingerprint, data
+
+
+def extract_stocks_from_prepared(fingerprint: ImageFingerprint, data: bytes) -> List[str]:
+    """对 prepare_image() 预处理过的图片做 OCR 和股票提取，结果按原图指纹写回缓存"""
+    text_lines = _baidu_ocr.recognize_bytes(data)
+    stocks = _extract_stocks_from_text_lines(text_lines)
+    if stocks:  # 空结果可能是识别失败，不缓存
+        _image_cache.store_result(fingerprint, stocks)
+    return stocks
 
 
 def _extract_stocks_from_text_lines(text_lines: List[str]) -> List[str]:
-    """提取文本中的股票，内部辅助函数"""
+    """提取文本中的股票，内部辅助函数
+
+    先用本地代码表匹配，置信度足够时直接返回；否则交给 DeepSeek，
+    并用代码表校验其输出（丢弃不存在的代码、名称以代码表为准）。
+    """
+    local = extract_stocks(text_lines)
+    if local.stocks and local.confidence >= MIN_CONFIDENCE:
+        return local.lines()
+
+    seen = set()
+    result = []
+    for line in _llm_extract_stocks(text_lines) + local.lines():
+        parts = line.split()
+        code = normalize_code(parts[-1]) if parts else ""
+        if symbol_index.ready:
+            sym = symbol_index.get(code)
+            if sym is None:
+                continue
+            line = f"{sym.name} {sym.code}"
+        if code not in seen:
+            seen.add(code)
+            result.append(line)
+    return result
+
+
+def _llm_extract_stocks(text_lines: List[str]) -> List[str]:
     prompt = (
         "以下是股票软件截图中的所有识别行，请你提取其中所有 A 股股票信息（股票名称和6位代码）：\n"
         "- 忽略不含股票的行；\n"
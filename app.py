@@ -2,9 +2,10 @@
 from flask import Flask, jsonify
 from flask_jwt_extended import JWTManager
 from celery import Celery
+from celery.schedules import crontab
 import os
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # --------------------------------------------------------------------
 # 1) 读取 .env（必须放在任何用到 os.getenv 之前）
@@ -31,6 +32,7 @@ app.config.update(
 # --------------------------------------------------------------------
 from models import db
 db.init_app(app)
+from market_snapshot import MARKET_TZ_NAME
 
 jwt = JWTManager(app)
 
@@ -38,8 +40,49 @@ jwt = JWTManager(app)
 celery = Celery(
     app.import_name,
     broker=os.getenv("REDIS_BROKER_URL"),
+    backend=os.getenv("REDIS_BACKEND_URL") or os.getenv("REDIS_BROKER_URL"),  # chord 汇总需要结果后端
 )
 celery.conf.update(app.config)   # 如果你想让 Celery 也能拿到 app.config
+# beat 的 crontab 按交易所时区解释（默认 UTC），定时任务都按 A 股交易时间设定
+celery.conf.timezone = MARKET_TZ_NAME
+# K 线存储在本地文件：worker 分布在多台机器时，写存储的任务只投递到存储所在机器的队列
+if os.getenv('KLINE_QUEUE'):
+    celery.conf.task_routes = {
+        'app.sync_kline_codes': {'queue': os.getenv('KLINE_QUEUE')},
+        'app.update_indicators': {'queue': os.getenv('KLINE_QUEUE')},
+    }
+app.extensions['celery'] = celery
+
+QUOTE_POLL_SECONDS = float(os.getenv('QUOTE_POLL_SECONDS', '5'))
+
+# 交易时段内定时增量抓取新闻（依赖水位线，每轮只处理新增新闻）
+# crontab 只能按整点圈定范围，任务内再按 9:15-11:30 / 13:00-15:00 精确判断
+celery.conf.beat_schedule = {
+    'incremental-news-ingest': {
+        'task': 'app.run_news_ingest',
+        'schedule': crontab(
+            minute=f"*/{os.getenv('NEWS_INGEST_INTERVAL_MINUTES', '5')}",
+            hour='9-11,13-15',
+            day_of_week='mon-fri',
+        ),
+    },
+    # 补扫多轮重试后仍无情感结论的新闻
+    'sentiment-rescore': {
+        'task': 'app.rescore_news_sentiment',
+        'schedule': crontab(minute=f"*/{os.getenv('SENTIMENT_RESCORE_INTERVAL_MINUTES', '30')}"),
+    },
+    # 收盘后增量同步自选股 K 线（只追加最后一根之后的数据）
+    'kline-sync': {
+        'task': 'app.sync_kline',
+        'schedule': crontab(minute=30, hour=15, day_of_week='mon-fri'),
+    },
+    # 全市场行情快照：单一上游调用，所有用户共享；过期的投递直接丢弃，不堆积
+    'market-snapshot-refresh': {
+        'task': 'app.refresh_market_snapshot',
+        'schedule': timedelta(seconds=QUOTE_POLL_SECONDS),
+        'options': {'expires': QUOTE_POLL_SECONDS},
+    },
+}
 
 # 注册所有路由
 from routes import init_routes
@@ -47,6 +90,12 @@ init_routes(app)
 
 # 注册Celery任务
 from routes.news import daily_news_job
+from news_ingest import ingest_news
+import news_sentiment
+import image_import
+import market_snapshot
+import kline_store
+import indicators
 
 @celery.task
 def run_daily_news_job():
@@ -54,6 +103,61 @@ def run_daily_news_job():
     with app.app_context():
         daily_news_job()
 
+@celery.task(name='app.run_news_ingest')
+def run_news_ingest():
+    """增量抓取新闻（不触发推送），交易时段外跳过"""
+    if not market_snapshot.is_trading_time():
+        return
+    with app.app_context():
+        ingest_news()
+
+# 情感分析：每个任务内部已按批调用 LLM，这里再按 worker 限速，控制整体并发
+@celery.task(name='app.score_news_sentiment', rate_limit=os.getenv('SENTIMENT_TASK_RATE', '30/m'),
+             autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def score_news_sentiment(news_ids):
+    with app.app_context():
+        return news_sentiment.score_news(news_ids)
+
+@celery.task(name='app.finish_news_sentiment')
+def finish_news_sentiment(results):
+    """chord 回调：汇总本轮情感分析结果，并统一失效新闻响应缓存"""
+    with app.app_context():
+        return news_sentiment.finish_scoring(results)
+
+@celery.task(name='app.rescore_news_sentiment', ignore_result=True)
+def rescore_news_sentiment():
+    """定时补扫仍无结论的新闻，重新扇出情感分析"""
+    with app.app_context():
+        news_sentiment.rescore_unscored()
+
+# 图片导入：OCR 和 LLM 都是外部调用，放到 worker 中执行，不占用 Web 进程
+@celery.task(name='app.run_image_import')
+def run_image_import(job_id):
+    with app.app_context():
+        image_import.run_job(job_id)
+
+# 行情快照：任务内部判断是否过期（非交易时段降频），并用锁保证只有一个刷新
+@celery.task(name='app.refresh_market_snapshot', ignore_result=True)
+def refresh_market_snapshot():
+    market_snapshot.refresh()
+
+@celery.task(name='app.sync_kline')
+def sync_kline():
+    """按代码分片扇出 K 线同步任务"""
+    with app.app_context():
+        kline_store.sync_kline()
+
+@celery.task(name='app.sync_kline_codes', autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def sync_kline_codes(codes):
+    with app.app_context():
+        return kline_store.sync_codes(codes)
+
+@celery.task(name='app.update_indicators')
+def update_indicators(results=None):
+    """chord 回调：K 线同步完成后增量更新技术指标"""
+    with app.app_context():
+        return indicators.update_indicators()
+
 # 根目录
 @app.route('/', methods=['GET'])
 def server_info():
@@ -69,6 +173,7 @@ def api_status():
     return jsonify({'status': 'running'})
 
 if __name__ == '__main__':
+    from migrations import upgrade
     with app.app_context():
-        db.create_all()
+        upgrade()
     app.run(host='0.0.0.0', port=9999, debug=True)
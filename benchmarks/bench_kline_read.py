@@ -0,0 +1,68 @@
+# benchmarks/bench_kline_read.py
+"""
+K 线本地存储的区间读取耗时基准
+
+在临时目录写入模拟日线，随机代码、随机区间调用 KLineStore.read()，
+分别给出首次读取（建立映射）与映射已缓存时的耗时中位数 / P99。
+
+用法：
+    python benchmarks/bench_kline_read.py --codes 5000 --bars 2500
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from kline_store import COLUMNS, DAILY, KLineStore  # noqa: E402
+
+DAY = 86400
+
+
+def _report(name: str, samples: list) -> None:
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name}: {len(samples)} 次, 中位数 {statistics.median(samples) * 1e6:.1f}us, P99 {p99 * 1e6:.1f}us")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--codes", type=int, default=1000, help="股票数")
+    parser.add_argument("--bars", type=int, default=2500, help="每只股票的日线根数")
+    parser.add_argument("--reads", type=int, default=5000)
+    parser.add_argument("--span", type=int, default=250, help="每次读取的区间长度（根）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        store = KLineStore(root=root, mapped=args.codes)
+        codes = [f"{600000 + i:06d}" for i in range(args.codes)]
+        t = 1_400_000_000 // DAY * DAY + np.arange(args.bars) * DAY
+        values = {c: np.random.rand(args.bars) for c in COLUMNS}
+        for code in codes:
+            store.append(DAILY, code, t, values)
+
+        def one_read(code: str) -> float:
+            lo = random.randrange(args.bars - args.span)
+            started = time.perf_counter()
+            bars = store.read(DAILY, code, int(t[lo]), int(t[lo + args.span - 1]))
+            elapsed = time.perf_counter() - started
+            assert len(bars) == args.span
+            return elapsed
+
+        # 每只股票的第一次读取会建立映射，之后映射命中
+        _report("首次读取（含建立映射）", [one_read(code) for code in codes])
+        _report("映射已缓存", [one_read(random.choice(codes)) for _ in range(args.reads)])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
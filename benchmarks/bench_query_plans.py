@@ -0,0 +1,139 @@
+# benchmarks/bench_query_plans.py
+"""
+热点查询的执行计划检查 + 耗时基准
+
+用迁移脚本建出的表结构灌入模拟数据，对业务代码实际使用的查询语句做
+EXPLAIN QUERY PLAN，断言：
+- 不出现任何全表 / 全索引扫描（SCAN），只允许按索引定位（SEARCH）
+- 不出现临时 B 树排序 / 去重（USE TEMP B-TREE），排序必须由索引顺序完成
+- 标注 covering 的查询只读索引、不回表（USING COVERING INDEX）
+并给出每个查询的耗时中位数。
+
+用法（SQLite）：
+    python benchmarks/bench_query_plans.py --rows 10000000
+执行计划不满足要求时以非零状态退出，可接入 CI。
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlalchemy as sa  # noqa: E402
+
+from migrations import upgrade  # noqa: E402
+from models import NewsCache, UserStock  # noqa: E402
+from news_feed import FEED_SIZE, latest_ids_stmt, watchlist_codes_stmt  # noqa: E402
+
+
+def load(path: str, rows: int, codes: int, users: int, per_user: int) -> list:
+    engine = sa.create_engine(f"sqlite:///{path}")
+    upgrade(engine)
+    engine.dispose()
+
+    all_codes = [f"{600000 + i:06d}" for i in range(codes)]
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    start = datetime.now() - timedelta(days=365)
+    step = 365 * 86400 / rows
+    batch = 200_000
+    t = time.perf_counter()
+    for lo in range(0, rows, batch):
+        conn.executemany(
+            "INSERT INTO news_cache (stock_code, title, content_hash, publish_time) VALUES (?, ?, ?, ?)",
+            ((random.choice(all_codes), f"news {i}", f"{i:032x}",
+              (start + timedelta(seconds=i * step)).strftime("%Y-%m-%d %H:%M:%S.%f"))
+             for i in range(lo, min(lo + batch, rows))),
+        )
+        conn.commit()
+        print(f"\r写入新闻 {min(lo + batch, rows):,}/{rows:,}", end="", flush=True)
+    conn.executemany("INSERT INTO users (id, openid) VALUES (?, ?)", ((u, f"o{u}") for u in range(1, users + 1)))
+    conn.executemany(
+        "INSERT INTO user_stocks (user_id, code) VALUES (?, ?)",
+        ((u, c) for u in range(1, users + 1) for c in random.sample(all_codes, per_user)),
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    print(f"\n数据准备完成，耗时 {time.perf_counter() - t:.1f}秒")
+    return all_codes
+
+
+def compile_sql(stmt, dialect) -> str:
+    return str(stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="news_cache 行数")
+    parser.add_argument("--codes", type=int, default=5000, help="股票数")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--per-user", type=int, default=50, help="每个用户的自选股数")
+    parser.add_argument("--db", help="SQLite 文件路径（默认临时文件，已存在则直接复用）")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.gettempdir(), f"stocklink_bench_{args.rows}.db")
+    if os.path.exists(path):
+        with sqlite3.connect(path) as c:
+            all_codes = [r[0] for r in c.execute("SELECT DISTINCT code FROM user_stocks")]
+        print(f"复用已有数据库 {path}")
+    else:
+        all_codes = load(path, args.rows, args.codes, args.users, args.per_user)
+
+    engine = sa.create_engine(f"sqlite:///{path}")
+    dialect = engine.dialect
+    with engine.connect() as conn:
+        watchlist = conn.execute(watchlist_codes_stmt(1)).scalars().all()
+        day_ago = datetime.now() - timedelta(days=1)
+        cursor = (datetime.now() - timedelta(days=30), 1 << 40)
+
+        # (名称, 语句, 是否要求覆盖索引)
+        checks = [
+            ("自选代码（按用户）", watchlist_codes_stmt(1), True),
+            ("新闻流 id（按代码取最新 N 条）", latest_ids_stmt(watchlist, FEED_SIZE), True),
+            ("新闻流翻页（游标之前）", latest_ids_stmt(watchlist, 20, before=cursor), True),
+            ("订阅用户（按代码）",
+             sa.select(UserStock.user_id, UserStock.code).where(UserStock.code.in_(all_codes[:1000])), True),
+            ("推送时间窗口", sa.select(NewsCache).where(NewsCache.publish_time > day_ago)
+             .order_by(NewsCache.publish_time.desc()), False),
+        ]
+
+        tables = set(sa.inspect(conn).get_table_names())
+        failed = False
+        for name, stmt, covering in checks:
+            sql = compile_sql(stmt, dialect)
+            plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+            # 只检查落在实际表上的步骤；SCAN 子查询（UNION ALL 的各分支结果）不读表
+            table_steps = [p for p in plan if p.startswith(("SCAN", "SEARCH")) and p.split()[1] in tables]
+            ok = all(p.startswith("SEARCH") for p in table_steps)
+            ok = ok and not any("TEMP B-TREE" in p for p in plan)
+            if covering:
+                ok = ok and all("COVERING INDEX" in p for p in table_steps)
+
+            timings = []
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                n = len(conn.exec_driver_sql(sql).all())
+                timings.append(time.perf_counter() - t)
+            failed |= not ok
+            print(f"[{'OK ' if ok else 'BAD'}] {name}: {n} 行, 中位数 {statistics.median(timings) * 1000:.2f}ms")
+            for p in plan:
+                print(f"       {p}")
+
+    print(f"\nnews_cache {args.rows:,} 行：" + ("执行计划检查未通过" if failed else "全部查询均走索引"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
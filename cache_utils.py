@@ -0,0 +1,353 @@
+# cache_utils.py
+"""
+缓存工具
+
+- TTLCache：进程内 LRU + TTL 缓存，线程安全
+- SharedStore：跨进程共享的键值存储。配置了 Redis（REDIS_CACHE_URL，
+  缺省复用 REDIS_BROKER_URL）时使用 Redis，否则退化为进程内 TTLCache
+  （单进程 / 测试环境）
+- PersistentCache：基于本地 SQLite 文件的持久缓存，同机多进程共享、重启不丢，
+  支持 TTL 与条目数上限
+- SharedTokenCache：第三方 access_token 的跨进程共享缓存，提前刷新，
+  同一时刻只有一个进程去换取新 token
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+# --------------------------------------------------------------------------- #
+# 进程内缓存
+# --------------------------------------------------------------------------- #
+class TTLCache:
+    """LRU + TTL 缓存：超过 maxsize 淘汰最久未使用的条目，过期条目读取时清除"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[Any, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def _put(self, key: Hashable, value: Any, ttl: Optional[float]) -> None:
+        """调用方需持有锁"""
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._put(key, value, ttl)
+
+    def add(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        """键不存在（或已过期）时写入，返回是否写入成功"""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and (item[1] is None or item[1] > time.monotonic()):
+                return False
+            self._put(key, value, ttl)
+            return True
+
+    def incr(self, key: Hashable) -> int:
+        """计数器自增（保留原有过期时间），值以字符串保存，与 Redis 一致"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] is not None and item[1] <= time.monotonic():
+                item = None
+            value = int(item[0]) + 1 if item else 1
+            self._data[key] = (str(value), item[1] if item else None)
+            self._data.move_to_end(key)
+            return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        value = self.get(key, _MISSING)
+        with self._lock:
+            self._data.pop(key, None)
+        return default if value is _MISSING else value
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def items(self) -> list:
+        """未过期条目的快照 [(key, value)]，不影响 LRU 顺序"""
+        now = time.monotonic()
+        with self._lock:
+            return [(k, v) for k, (v, exp) in self._data.items() if exp is None or exp > now]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# --------------------------------------------------------------------------- #
+# 跨进程共享存储
+# --------------------------------------------------------------------------- #
+class SharedStore:
+    """字符串键值存储，接口是 Redis 命令的最小子集"""
+
+    def __init__(self, url: Optional[str] = None, prefix: str = "stocklink:",
+                 fallback_size: int = 10000):
+        self.url = url
+        self.prefix = prefix
+        self._redis = None
+        if url and redis is not None:
+            self._redis = redis.Redis.from_url(url, decode_responses=True)
+        elif url:
+            logger.warning("未安装 redis，共享存储退化为进程内缓存")
+        self._local = TTLCache(maxsize=fallback_size)
+        self._update_lock = threading.Lock()  # 进程内退化时 update() 的读改写互斥
+
+    @property
+    def is_shared(self) -> bool:
+        return self._redis is not None
+
+    def _k(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def get(self, key: str) -> Optional[str]:
+        if self._redis is not None:
+            return self._redis.get(self._k(key))
+        return self._local.get(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        if self._redis is not None:
+            self._redis.set(self._k(key), value, px=int(ttl * 1000) if ttl else None)
+        else:
+            self._local.set(key, value, ttl)
+
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        """SET NX：键不存在时写入，可用作跨进程锁"""
+        if self._redis is not None:
+            return bool(self._redis.set(self._k(key), value, nx=True, px=int(ttl * 1000) if ttl else None))
+        return self._local.add(key, value, ttl)
+
+    def pop(self, key: str) -> Optional[str]:
+        """原子地取出并删除"""
+        if self._redis is not None:
+            return self._redis.getdel(self._k(key))
+        return self._local.pop(key)
+
+    def delete(self, *keys: str) -> None:
+        if not keys:
+            return
+        if self._redis is not None:
+            self._redis.delete(*(self._k(k) for k in keys))
+        else:
+            for k in keys:
+                self._local.delete(k)
+
+    def incr(self, key: str) -> int:
+        if self._redis is not None:
+            return int(self._redis.incr(self._k(key)))
+        return self._local.incr(key)
+
+    def update(self, key: str, fn: Callable[[Optional[str]], Optional[str]], ttl: Optional[float] = None) -> Optional[str]:
+        """原子的读 - 改 - 写：fn(当前值) 返回新值，返回 None 表示不写
+
+        Redis 上用 WATCH / MULTI，期间键被其他进程改写则重新读取再调用 fn，
+        因此 fn 可能被调用多次，不能有副作用。返回最终写入的值。
+        """
+        if self._redis is not None:
+            k = self._k(key)
+
+            def txn(pipe):
+                value = fn(pipe.get(k))
+                if value is not None:
+                    pipe.multi()
+                    pipe.set(k, value, px=int(ttl * 1000) if ttl else None)
+                return value
+            return self._redis.transaction(txn, k, value_from_callable=True)
+        with self._update_lock:
+            value = fn(self._local.get(key))
+            if value is not None:
+                self._local.set(key, value, ttl)
+            return value
+
+    # ---- JSON 便捷方法 ----------------------------------------------------- #
+    def get_json(self, key: str) -> Any:
+        raw = self.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set_json(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.set(key, json.dumps(value, ensure_ascii=False), ttl)
+
+    def pop_json(self, key: str) -> Any:
+        raw = self.pop(key)
+        return json.loads(raw) if raw is not None else None
+
+
+# --------------------------------------------------------------------------- #
+# 持久缓存
+# --------------------------------------------------------------------------- #
+class PersistentCache:
+    """SQLite 持久缓存：按 TTL 过期，超过 max_entries 时淘汰最久未访问的条目"""
+
+    TOUCH_INTERVAL = 3600  # 访问时间最多每小时回写一次，避免读路径频繁写盘
+    PRUNE_EVERY = 256  # 每写入这么多次检查一次容量
+
+    def __init__(self, path: str, max_entries: int = 100000, ttl: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # 每个线程、每个进程各自一个连接（fork 后不复用父进程连接）
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at, accessed_at = row
+            if expires_at is not None and expires_at <= now:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            if now - accessed_at > self.TOUCH_INTERVAL:
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+        except sqlite3.Error as exc:
+            logger.warning(f"读取持久缓存失败: {exc}")
+            return None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl if ttl else None, now),
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self.prune()
+        except sqlite3.Error as exc:
+            logger.warning(f"写入持久缓存失败: {exc}")
+
+    def prune(self) -> None:
+        """清除过期条目，并把条目数压回 max_entries 以内"""
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        excess = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (excess,),
+            )
+
+
+def _redis_url() -> Optional[str]:
+    url = os.getenv("REDIS_CACHE_URL") or os.getenv("REDIS_BROKER_URL")
+    return url if url and url.startswith(("redis://", "rediss://", "unix://")) else None
+
+
+# 进程内单例
+shared_store = SharedStore(_redis_url())
+
+
+# --------------------------------------------------------------------------- #
+# 共享 access_token
+# --------------------------------------------------------------------------- #
+class SharedTokenCache:
+    """子类实现 _request() -> (token, expires_in 秒)"""
+
+    def __init__(self, key: str, refresh_ahead: int = 300, store: SharedStore = shared_store):
+        self.key = key
+        self.lock_key = f"{key}:lock"
+        self.refresh_ahead = refresh_ahead
+        self.store = store
+        self._lock = threading.Lock()
+
+    def _request(self) -> Tuple[str, int]:
+        raise NotImplementedError
+
+    def _cached(self) -> Optional[str]:
+        data = self.store.get_json(self.key)
+        if data and data.get("expires_at", 0) - self.refresh_ahead > time.time():
+            return data["access_token"]
+        return None
+
+    def _fetch(self) -> str:
+        token, expires_in = self._request()
+        self.store.set_json(self.key, {"access_token": token, "expires_at": time.time() + expires_in},
+                            ttl=expires_in)
+        return token
+
+    def get(self, force: bool = False) -> str:
+        if not force and (token := self._cached()):
+            return token
+        with self._lock:  # 进程内 single-flight
+            if not force and (token := self._cached()):
+                return token
+            # 跨进程 single-flight：拿到锁的进程去换 token，其余进程等待结果
+            for _ in range(50):
+                if self.store.add(self.lock_key, "1", ttl=10):
+                    try:
+                        return self._fetch()
+                    finally:
+                        self.store.delete(self.lock_key)
+                time.sleep(0.1)
+                if token := self._cached():
+                    return token
+            return self._fetch()
+
+    def invalidate(self, token: str) -> None:
+        """token 被服务端判定无效时清除（只清除仍是这个 token 的缓存）"""
+        data = self.store.get_json(self.key)
+        if data and data.get("access_token") == token:
+            self.store.delete(self.key)
@@ -0,0 +1,162 @@
+# image_cache.py
+"""
+截图识别结果缓存
+
+用户反复上传同一张自选股截图时，直接返回上次的识别结果，不再调用 OCR 和 LLM：
+- 精确层：解码后图片字节的 SHA-256
+- 感知层：64 位 dHash 按汉明距离找候选，命中被重新压缩过的同一张截图
+两层都放在 SharedStore 里跨进程共享，都有 TTL；精确层另有进程内 LRU。
+
+感知层刻意从严：只差一位代码的两张自选截图 dHash 几乎相同，哈希只用来
+缩小候选范围；候选还要尺寸相同、且灰度缩略图中没有明显差异像素才算命中。
+缩略图压缩后只有一两 KB，随结果一起共享。拿不准时宁可回落到 OCR，
+也不能返回另一份股票列表。
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cache_utils import TTLCache, shared_store
+from image_prep import Image
+
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL_SECONDS", 24 * 3600))
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", 512))
+HASH_INDEX_SIZE = int(os.getenv("IMAGE_HASH_INDEX_SIZE", 256))  # 每种尺寸保留最近的条数
+
+THUMB_WIDTH = 180  # 高度按原图比例
+PIXEL_TOLERANCE = 32  # 灰度差超过此值视为不同像素（JPEG 压缩噪声远小于此）
+MAX_DIFF_PIXELS = 0
+HASH_MAX_DISTANCE = 6  # dHash 汉明距离不超过此值才做缩略图比对
+
+
+def thumbnail(img: "Image.Image") -> np.ndarray:
+    """灰度缩略图，宽 THUMB_WIDTH，高度按原图比例"""
+    height = max(1, round(THUMB_WIDTH * img.height / img.width))
+    return np.asarray(img.convert("L").resize((THUMB_WIDTH, height), Image.BOX), dtype=np.int16)
+
+
+def dhash(img: "Image.Image") -> int:
+    """64 位差值哈希：缩成 9x8 灰度，逐行比较左右相邻像素"""
+    px = np.asarray(img.convert("L").resize((9, 8), Image.BOX), dtype=np.int16)
+    bits = (px[:, 1:] > px[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _pack_thumb(thumb: np.ndarray) -> str:
+    return base64.b64encode(zlib.compress(thumb.astype(np.uint8).tobytes())).decode("ascii")
+
+
+def _unpack_thumb(raw: str, width: int) -> Optional[np.ndarray]:
+    try:
+        px = np.frombuffer(zlib.decompress(base64.b64decode(raw)), dtype=np.uint8)
+    except (ValueError, zlib.error):
+        return None
+    return px.reshape(-1, width).astype(np.int16) if px.size % width == 0 else None
+
+
+@dataclass
+class ImageFingerprint:
+    sha256: str
+    size: Optional[Tuple[int, int]] = None
+    dhash: Optional[int] = None
+    thumb: Optional[np.ndarray] = None
+
+    def dump(self) -> Dict[str, Any]:
+        """转为可 JSON 序列化的 dict，随异步任务暂存，worker 用它回写缓存"""
+        return {
+            "sha256": self.sha256,
+            "size": list(self.size) if self.size else None,
+            "dhash": f"{self.dhash:016x}" if self.dhash is not None else None,
+            "thumb": _pack_thumb(self.thumb) if self.thumb is not None else None,
+        }
+
+    @classmethod
+    def load(cls, raw: Dict[str, Any]) -> "ImageFingerprint":
+        return cls(
+            sha256=raw["sha256"],
+            size=tuple(raw["size"]) if raw.get("size") else None,
+            dhash=int(raw["dhash"], 16) if raw.get("dhash") else None,
+            thumb=_unpack_thumb(raw["thumb"], THUMB_WIDTH) if raw.get("thumb") else None,
+        )
+
+
+class ImageResultCache:
+    def __init__(self, ttl: int = IMAGE_CACHE_TTL, maxsize: int = IMAGE_CACHE_SIZE,
+                 index_size: int = HASH_INDEX_SIZE, store=shared_store):
+        self.ttl = ttl
+        self.store = store
+        self.index_size = index_size
+        self._exact = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def _key(sha: str) -> str:
+        return f"image_result:{sha}"
+
+    @staticmethod
+    def _thumb_key(sha: str) -> str:
+        return f"image_thumb:{sha}"
+
+    @staticmethod
+    def _index_key(size: Tuple[int, int]) -> str:
+        return f"image_dhash:{size[0]}x{size[1]}"
+
+    def lookup(self, data: bytes) -> Tuple[Optional[List[str]], ImageFingerprint]:
+        """精确层查询，返回 (缓存结果或 None, 图片指纹)；指纹用于后续查询和回写"""
+        fp = ImageFingerprint(sha256=hashlib.sha256(data).hexdigest())
+        hit = self._exact.get(fp.sha256)
+        if hit is None:
+            hit = self.store.get_json(self._key(fp.sha256))
+            if hit is not None:
+                self._exact.set(fp.sha256, hit)
+        return (list(hit) if hit is not None else None), fp
+
+    def lookup_similar(self, fp: ImageFingerprint, decoded: Tuple["Image.Image", Tuple[int, int]]
+                       ) -> Optional[List[str]]:
+        """感知层查询，decoded 为 image_prep.open_image() 的结果
+
+        同尺寸索引里按汉明距离由近到远取候选，逐个做缩略图比对。
+        """
+        img, fp.size = decoded
+        fp.dhash, fp.thumb = dhash(img), thumbnail(img)
+        entries = self.store.get_json(self._index_key(fp.size)) or []
+        candidates = sorted((hamming(fp.dhash, int(h, 16)), sha) for h, sha in entries)
+        for distance, sha in candidates:
+            if distance > HASH_MAX_DISTANCE:
+                break
+            raw = self.store.get(self._thumb_key(sha))
+            other = _unpack_thumb(raw, THUMB_WIDTH) if raw else None
+            if other is None or other.shape != fp.thumb.shape:
+                continue
+            if np.count_nonzero(np.abs(other - fp.thumb) > PIXEL_TOLERANCE) <= MAX_DIFF_PIXELS:
+                result = self.store.get_json(self._key(sha))
+                if result is not None:
+                    return list(result)
+        return None
+
+    def store_result(self, fp: ImageFingerprint, result: List[str]) -> None:
+        self._exact.set(fp.sha256, list(result))
+        self.store.set_json(self._key(fp.sha256), list(result), ttl=self.ttl)
+        if fp.dhash is None or fp.thumb is None:
+            return
+        self.store.set(self._thumb_key(fp.sha256), _pack_thumb(fp.thumb), ttl=self.ttl)
+        entry = [f"{fp.dhash:016x}", fp.sha256]
+
+        def prepend(raw: Optional[str]) -> str:
+            entries = json.loads(raw) if raw else []
+            entries = [entry] + [e for e in entries if e[1] != fp.sha256]
+            return json.dumps(entries[:self.index_size])
+
+        self.store.update(self._index_key(fp.size), prepend, ttl=self.ttl)
@@ -0,0 +1,177 @@
+# image_import.py
+"""
+截图导入自选股
+
+- recognize()：OCR + 股票提取 + 解析为待确认列表（同步接口和异步任务共用）
+- 异步任务：接口先查识别结果缓存，命中时任务直接完成；否则在请求内做完 OCR 预处理，
+  只把裁剪缩放后的 JPEG（通常一两百 KB，而不是数 MB 的原始 base64）和图片指纹暂存到
+  共享存储，登记任务并投递到 Celery（消息里只有 job_id），立即返回 202；worker 完成 OCR
+  后把结果写回共享存储，客户端按 Retry-After 轮询任务状态。服务端不等待 OCR，不占用同步 worker
+- 待确认列表：识别结果按用户暂存在共享存储中（带 TTL），确认时原子取出，
+  确认请求落在哪个 worker 都能取到
+"""
+
+from __future__ import annotations
+
+import base64
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from flask import current_app as app
+
+from ai_utils import extract_stocks_from_base64, extract_stocks_from_prepared, prepare_image
+from cache_utils import shared_store
+from image_cache import ImageFingerprint
+from image_prep import decode_image_base64
+
+JOB_TTL = 600  # 任务状态与预处理后图片的保留时间（秒）
+RETRY_AFTER = 1  # 建议客户端的轮询间隔（秒）
+PENDING_TTL = int(os.getenv("PENDING_IMPORT_TTL_SECONDS", 1800))  # 待确认列表保留时间
+PENDING_MAX_STOCKS = 500  # 单条待确认列表的股票数上限
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+class ImageImportError(ValueError):
+    """图片中没有可导入的股票（客户端错误，对应 400）"""
+
+    def __init__(self, msg: str, detail: Optional[List[Dict[str, str]]] = None):
+        super().__init__(msg)
+        self.detail = detail
+
+
+def parse_stock_items(stock_items: List[str]) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """解析 "股票名称 股票代码" 行，返回 (待添加, 被拒绝)"""
+    stocks_to_add, rejected_items = [], []
+    for item in stock_items:
+        parts = item.strip().split()
+        if len(parts) < 2:  # 确保至少有名称和代码两部分
+            rejected_items.append({'item': item, 'reason': '格式不符合"名称 代码"'})
+            continue
+        # 取最后一项作为代码，其余的合并为名称
+        code, name = parts[-1], ' '.join(parts[:-1])
+        if code.isdigit() and len(code) == 6:
+            stocks_to_add.append({'code': code, 'name': name})
+        else:
+            rejected_items.append({'item': item, 'reason': '无效股票代码格式'})
+    return stocks_to_add, rejected_items
+
+
+def recognize(image_base64: str) -> Dict[str, Any]:
+    """识别截图中的股票，返回 {'stocks', 'total', 'rejected'}"""
+    return _to_result(extract_stocks_from_base64(image_base64))
+
+
+def _to_result(stock_items: List[str]) -> Dict[str, Any]:
+    if not stock_items:
+        raise ImageImportError('未从图片中识别出任何股票信息')
+    app.logger.info(f"从图片中识别出 {len(stock_items)} 只股票: {stock_items}")
+
+    stocks_to_add, rejected_items = parse_stock_items(stock_items)
+    if not stocks_to_add:
+        raise ImageImportError('未能正确解析出股票信息，请确保图片清晰', rejected_items)
+    return {
+        'stocks': stocks_to_add,
+        'total': len(stocks_to_add),
+        'rejected': rejected_items or None,
+    }
+
+
+# --------------------------------------------------------------------------- #
+# 待确认列表
+# --------------------------------------------------------------------------- #
+def _pending_key(user_id) -> str:
+    return f"pending_import:{user_id}"
+
+
+def save_pending(user_id, stocks: List[Dict[str, str]]) -> None:
+    """暂存识别结果等待确认；同一用户只保留最近一次"""
+    shared_store.set_json(_pending_key(user_id), {'stocks': stocks[:PENDING_MAX_STOCKS]}, ttl=PENDING_TTL)
+
+
+def pop_pending(user_id) -> Optional[Dict[str, Any]]:
+    """取出并删除待确认列表，不存在或已过期时返回 None"""
+    return shared_store.pop_json(_pending_key(user_id))
+
+
+# --------------------------------------------------------------------------- #
+# 异步任务
+# --------------------------------------------------------------------------- #
+def _key(job_id: str) -> str:
+    return f"image_job:{job_id}"
+
+
+def _image_key(job_id: str) -> str:
+    return f"image_job:{job_id}:image"
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return shared_store.get_json(_key(job_id))
+
+
+def _save_job(job: Dict[str, Any]) -> None:
+    shared_store.set_json(_key(job['job_id']), job, ttl=JOB_TTL)
+
+
+def _finish(job: Dict[str, Any], recognize_fn: Callable[[], Dict[str, Any]]) -> None:
+    """执行识别并把任务状态（结果或失败原因）写回共享存储"""
+    try:
+        job['result'] = recognize_fn()
+        job['status'] = DONE
+        save_pending(job['user_id'], job['result']['stocks'])
+    except ImageImportError as e:
+        job.update(status=FAILED, msg=str(e), detail=e.detail)
+    except Exception as e:  # noqa: BLE001
+        app.logger.exception(e)
+        job.update(status=FAILED, msg=f'图片处理失败: {str(e)}')
+    job['finished_at'] = time.time()
+    _save_job(job)
+
+
+def run_job(job_id: str) -> None:
+    """在 Celery worker 中执行识别（需在 app context 中调用）"""
+    job = get_job(job_id)
+    image = shared_store.pop_json(_image_key(job_id))
+    if job is None or image is None:
+        app.logger.warning(f"图片识别任务已过期: {job_id}")
+        return
+    job['status'] = RUNNING
+    _save_job(job)
+    fingerprint = ImageFingerprint.load(image['fingerprint'])
+    _finish(job, lambda: _to_result(extract_stocks_from_prepared(fingerprint, base64.b64decode(image['data']))))
+
+
+def submit_job(user_id, image_base64: str) -> Dict[str, Any]:
+    """登记任务并投递到 Celery；未配置 broker 时在当前进程内直接执行
+
+    缓存命中或图片无法解码时任务当场结束；否则共享存储里只放预处理后的 JPEG，
+    不经过 broker 消息传递。
+    """
+    job = {'job_id': uuid.uuid4().hex, 'user_id': str(user_id), 'status': PENDING,
+           'created_at': time.time()}
+    try:
+        cached, fingerprint, data = prepare_image(decode_image_base64(image_base64))
+    except ValueError as e:  # base64 无效，与 worker 中的失败一样记在任务上
+        job.update(status=FAILED, msg=f'图片处理失败: {str(e)}', finished_at=time.time())
+        _save_job(job)
+        return job
+    if cached is not None:
+        _finish(job, lambda: _to_result(cached))
+        return job
+
+    image = {'fingerprint': fingerprint.dump(), 'data': base64.b64encode(data).decode('ascii')}
+    shared_store.set_json(_image_key(job['job_id']), image, ttl=JOB_TTL)
+    _save_job(job)
+    celery = app.extensions.get('celery')
+    if celery is None or not celery.conf.broker_url:
+        run_job(job['job_id'])
+    else:
+        celery.signature('app.run_image_import', args=(job['job_id'],)).apply_async()
+    return get_job(job['job_id']) or job
+
+
+def is_finished(job: Dict[str, Any]) -> bool:
+    return job['status'] in (DONE, FAILED)
+
@@ -0,0 +1,95 @@
+# image_prep.py
+"""
+OCR 上传前的图片预处理
+
+手机截图原图动辄数 MB，而文字识别只需要每个字十几像素高。这里：
+1. 只解码一次（JPEG 直接按目标尺寸降采样解码为灰度），结果供缓存比对和 OCR 共用
+2. 竖屏截图裁掉顶部状态栏、底部导航栏，再裁掉四周纯色边
+3. 缩放到 OCR_MAX_WIDTH 宽，重新编码为 JPEG，超过 OCR_MAX_BYTES 时逐级降质量 / 缩小
+"""
+
+from __future__ import annotations
+
+import binascii
+import io
+import os
+from typing import Optional, Tuple
+
+try:  # 预处理依赖 Pillow，缺失时原样上传
+    from PIL import Image, ImageChops, ImageOps
+except ImportError:  # pragma: no cover
+    Image = None
+
+OCR_MAX_WIDTH = int(os.getenv("OCR_MAX_WIDTH", 800))
+OCR_MAX_BYTES = int(os.getenv("OCR_MAX_BYTES", 1024 * 1024))
+OCR_MAX_SIDE = 4096  # 百度 OCR 最长边上限
+JPEG_QUALITIES = (85, 70, 55)
+
+PORTRAIT_RATIO = 1.7  # 高宽比超过此值视为手机竖屏截图
+STATUS_BAR_RATIO = 0.04
+NAV_BAR_RATIO = 0.06
+BORDER_THRESHOLD = 16  # 与边框底色的灰度差超过此值才算内容
+BORDER_PADDING = 8
+
+
+def decode_image_base64(image_base64: str) -> bytes:
+    """解码 base64 图片（兼容 data:image/...;base64, 前缀）"""
+    start = image_base64.find(",", 0, 100) + 1  # 只在开头找前缀
+    try:
+        # str 转 bytes 的那次拷贝省不掉；前缀用 memoryview 偏移跳过，不再切片拷贝整段数据
+        return binascii.a2b_base64(memoryview(image_base64.encode("ascii"))[start:])
+    except (binascii.Error, ValueError) as exc:
+        raise ValueError(f"图片 base64 数据无效: {exc}") from exc
+
+
+def open_image(data: bytes) -> Optional[Tuple["Image.Image", Tuple[int, int]]]:
+    """解码为灰度图，返回 (图片, 原始尺寸)；无法解析时返回 None"""
+    if Image is None:
+        return None
+    try:
+        img = Image.open(io.BytesIO(data))
+        size = img.size
+        img.draft("L", (OCR_MAX_WIDTH, OCR_MAX_WIDTH))  # JPEG 按 1/2、1/4 直接降采样解码
+        img = ImageOps.exif_transpose(img).convert("L")
+    except Exception:  # noqa: BLE001
+        return None
+    return img, size
+
+
+def _crop_chrome(img: "Image.Image") -> "Image.Image":
+    w, h = img.size
+    if h / w >= PORTRAIT_RATIO:
+        img = img.crop((0, int(h * STATUS_BAR_RATIO), w, int(h * (1 - NAV_BAR_RATIO))))
+    background = Image.new("L", img.size, img.getpixel((0, 0)))
+    mask = ImageChops.difference(img, background).point(lambda p: 255 if p > BORDER_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return img
+    left, top, right, bottom = bbox
+    return img.crop((
+        max(left - BORDER_PADDING, 0), max(top - BORDER_PADDING, 0),
+        min(right + BORDER_PADDING, img.width), min(bottom + BORDER_PADDING, img.height),
+    ))
+
+
+def _scale(img: "Image.Image", factor: float) -> "Image.Image":
+    size = (max(1, round(img.width * factor)), max(1, round(img.height * factor)))
+    return img.resize(size, Image.LANCZOS)
+
+
+def prepare_for_ocr(img: "Image.Image") -> bytes:
+    """裁剪、缩放并编码为不超过 OCR_MAX_BYTES 的 JPEG"""
+    img = _crop_chrome(img)
+    factor = min(1.0, OCR_MAX_WIDTH / img.width, OCR_MAX_SIDE / max(img.size))
+    if factor < 1.0:
+        img = _scale(img, factor)
+
+    while True:
+        for quality in JPEG_QUALITIES:
+            buf = io.BytesIO()
+            img.save(buf, "JPEG", quality=quality, optimize=True)
+            if buf.tell() <= OCR_MAX_BYTES:
+                return buf.getvalue()
+        if img.width <= 200:
+            return buf.getvalue()
+        img = _scale(img, 0.8)
@@ -0,0 +1,325 @@
+# indicators.py
+"""
+技术指标引擎（日线）
+
+所有自选股排成一个 [代码数, K 线数] 的矩阵（右对齐，K 线不足的左侧补 NaN），
+指标按整列向量化计算，没有逐只股票的 pandas 循环：
+- 窗口类（MA、布林带、量比）：只需最近 TAIL 根收盘价 / 成交量，直接在矩阵尾部求值
+- 递推类（EMA、MACD、RSI）：按时间逐列推进，每一步是对全部代码的一次向量运算
+
+引擎状态（尾部矩阵 + 递推量 + 每只股票最后一根的时间与 K 线行数）保存在本地文件中。
+K 线同步完成后 update_indicators() 只把新增的 K 线推进一步，新关注的代码才做全量计算；
+结果按交易日发布到共享存储，/api/stocks/indicators 按自选代码切片。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, fields
+from typing import Dict, List, Optional
+
+import numpy as np
+from flask import current_app as app
+
+from cache_utils import shared_store
+from kline_store import DAILY, STORE_PATH, KLineStore, from_epoch, kline_store
+from models import db, UserStock
+
+MA_WINDOWS = (5, 10, 20, 60)
+EMA_FAST, EMA_SLOW, DEA_SPAN = 12, 26, 9
+RSI_WINDOWS = (6, 12, 24)
+BOLL_WINDOW, BOLL_K = 20, 2.0
+VOL_RATIO_WINDOW = 5  # 量比：当日成交量 / 前 5 日平均
+TAIL = max(MA_WINDOWS + (BOLL_WINDOW, VOL_RATIO_WINDOW + 1))
+WARMUP = 250  # 全量计算读取的 K 线数，递推指标在此长度内收敛
+STATE_PATH = os.path.join(STORE_PATH, "indicators_state.npz")
+RESULT_TTL = 7 * 24 * 3600
+
+RESULT_KEY = "indicators:daily"
+VERSION_KEY = "indicators:daily:date"
+
+_RSI_FIELDS = ("gain", "loss")  # 按 [RSI 周期, 代码] 排列的字段
+
+
+def _alpha(span: int) -> float:
+    return 2.0 / (span + 1)
+
+
+# --------------------------------------------------------------------------- #
+# 状态
+# --------------------------------------------------------------------------- #
+@dataclass
+class IndicatorState:
+    codes: np.ndarray  # [N] 代码
+    t: np.ndarray  # [N] 最后一根 K 线的时间戳
+    bars: np.ndarray  # [N] 已推进的 K 线数
+    length: np.ndarray  # [N] 上次推进时存储中的 K 线总数，与当前总数之差即新增根数
+    close: np.ndarray  # [N, TAIL] 最近的收盘价
+    volume: np.ndarray  # [N, TAIL] 最近的成交量
+    ema_fast: np.ndarray  # [N]
+    ema_slow: np.ndarray  # [N]
+    dea: np.ndarray  # [N]
+    gain: np.ndarray  # [len(RSI_WINDOWS), N] Wilder 平均涨幅
+    loss: np.ndarray  # [len(RSI_WINDOWS), N] Wilder 平均跌幅
+
+    @classmethod
+    def empty(cls, codes: List[str]) -> "IndicatorState":
+        n, r = len(codes), len(RSI_WINDOWS)
+        nan = np.full(n, np.nan)
+        return cls(np.asarray(codes, dtype="U6"), np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64),
+                   np.zeros(n, dtype=np.int64),
+                   np.full((n, TAIL), np.nan), np.full((n, TAIL), np.nan),
+                   nan.copy(), nan.copy(), nan.copy(), np.zeros((r, n)), np.zeros((r, n)))
+
+    def take(self, idx: np.ndarray) -> "IndicatorState":
+        return IndicatorState(*(
+            getattr(self, f.name)[:, idx] if f.name in _RSI_FIELDS else getattr(self, f.name)[idx]
+            for f in fields(self)
+        ))
+
+    @staticmethod
+    def concat(states: List["IndicatorState"]) -> "IndicatorState":
+        return IndicatorState(*(
+            np.concatenate([getattr(s, f.name) for s in states], axis=1 if f.name in _RSI_FIELDS else 0)
+            for f in fields(IndicatorState)
+        ))
+
+    def save(self, path: str = STATE_PATH) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, **{f.name: getattr(self, f.name) for f in fields(self)})
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = STATE_PATH) -> Optional["IndicatorState"]:
+        try:
+            with np.load(path) as data:
+                return cls(*(data[f.name] for f in fields(cls)))
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+# --------------------------------------------------------------------------- #
+# 向量化内核
+# --------------------------------------------------------------------------- #
+def _step(s: IndicatorState, close: np.ndarray, volume: np.ndarray, prev: Optional[np.ndarray] = None) -> None:
+    """所有 close 非 NaN 的代码推进一根 K 线（原地更新，全部是整列向量运算）
+
+    prev 为空时（增量推进）取状态尾部的最后一根收盘价，并把新 K 线滚入尾部；
+    全量计算时传入矩阵的前一列，尾部在最后一次性写入。
+    """
+    m = ~np.isnan(close)
+    if not m.any():
+        return
+    roll_tail = prev is None
+    if roll_tail:
+        prev = s.close[:, -1]
+    first = m & (s.bars == 0)
+    cont = m & ~first
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for attr, span in (("ema_fast", EMA_FAST), ("ema_slow", EMA_SLOW)):
+            e = getattr(s, attr)
+            e[:] = np.where(first, close, np.where(cont, e + _alpha(span) * (close - e), e))
+        dif = s.ema_fast - s.ema_slow
+        s.dea[:] = np.where(first, dif, np.where(cont, s.dea + _alpha(DEA_SPAN) * (dif - s.dea), s.dea))
+
+        # Wilder 平滑；前 n 根用递推形式的简单平均作为初值
+        diff = close - prev
+        up, down = np.maximum(diff, 0.0), np.maximum(-diff, 0.0)
+        for i, n in enumerate(RSI_WINDOWS):
+            k = np.minimum(s.bars, n)  # 此前已有的 K 线数，即含本根在内的涨跌幅个数
+            s.gain[i] = np.where(cont, s.gain[i] + (up - s.gain[i]) / k, s.gain[i])
+            s.loss[i] = np.where(cont, s.loss[i] + (down - s.loss[i]) / k, s.loss[i])
+
+    if roll_tail:
+        s.close[m, :-1] = s.close[m, 1:]
+        s.volume[m, :-1] = s.volume[m, 1:]
+        s.close[m, -1] = close[m]
+        s.volume[m, -1] = volume[m]
+    s.bars += m
+
+
+def _lengths(codes, store: KLineStore) -> np.ndarray:
+    return np.fromiter((store.length(DAILY, c) for c in codes), dtype=np.int64, count=len(codes))
+
+
+def load_panel(codes: List[str], store: KLineStore = kline_store, warmup: int = WARMUP,
+               length: Optional[np.ndarray] = None):
+    """读取每只股票最近 warmup 根日线，返回右对齐的 (最后时间 [N], 收盘价 [N, warmup], 成交量 [N, warmup])
+
+    length 给出时只读到各代码的第 length 行为止。
+    """
+    last_t = np.zeros(len(codes), dtype=np.int64)
+    close = np.full((len(codes), warmup), np.nan)
+    volume = np.full((len(codes), warmup), np.nan)
+    for i, code in enumerate(codes):
+        cols = store.tail(DAILY, code, warmup, ("t", "close", "volume"),
+                          None if length is None else int(length[i]))
+        if cols is None:
+            continue
+        n = len(cols["t"])
+        close[i, warmup - n:] = cols["close"]
+        volume[i, warmup - n:] = cols["volume"]
+        last_t[i] = cols["t"][-1]
+    return last_t, close, volume
+
+
+def compute_panel(codes: List[str], last_t: np.ndarray, close: np.ndarray, volume: np.ndarray) -> IndicatorState:
+    """全量计算：对整个矩阵逐列推进"""
+    s = IndicatorState.empty(codes)
+    s.t[:] = last_t
+    for j in range(close.shape[1]):
+        _step(s, close[:, j], volume[:, j], prev=close[:, j - 1] if j else np.full(len(codes), np.nan))
+    s.close[:] = _right(close, TAIL)
+    s.volume[:] = _right(volume, TAIL)
+    return s
+
+
+def compute_state(codes: List[str], store: KLineStore = kline_store, warmup: int = WARMUP) -> IndicatorState:
+    length = _lengths(codes, store)
+    s = compute_panel(codes, *load_panel(codes, store, warmup, length))
+    s.length[:] = length
+    return s
+
+
+def _right(panel: np.ndarray, width: int) -> np.ndarray:
+    """取矩阵最右侧 width 列，不足时左侧补 NaN"""
+    if panel.shape[1] >= width:
+        return panel[:, -width:]
+    out = np.full((panel.shape[0], width), np.nan)
+    out[:, width - panel.shape[1]:] = panel
+    return out
+
+
+def advance(s: IndicatorState, store: KLineStore = kline_store, warmup: int = WARMUP) -> IndicatorState:
+    """把状态推进到存储中的最新 K 线
+
+    存储只追加，当前行数减去状态里记下的行数就是新增根数：每只股票只取一次文件大小，
+    只有新增的几根才读数据。此前没有数据、缺口超过 warmup（长期停牌后复牌等）
+    或行数变少（存储被重建）的代码改为全量计算。
+    """
+    length = _lengths(s.codes.tolist(), store)
+    added = length - s.length
+    refresh = np.flatnonzero((added != 0) & ((s.bars == 0) | (added < 0) | (added > warmup))).tolist()
+    pending = {i: store.tail(DAILY, s.codes[i], int(added[i]), ("t", "close", "volume"), int(length[i]))
+               for i in np.flatnonzero((added > 0) & (added <= warmup) & (s.bars > 0)).tolist()}
+
+    if pending:
+        width = max(len(b["t"]) for b in pending.values())
+        close = np.full((len(s.codes), width), np.nan)
+        volume = np.full((len(s.codes), width), np.nan)
+        for i, b in pending.items():
+            n = len(b["t"])
+            close[i, width - n:] = b["close"]
+            volume[i, width - n:] = b["volume"]
+            s.t[i] = b["t"][-1]
+            s.length[i] = length[i]
+        for j in range(width):
+            _step(s, close[:, j], volume[:, j])
+    if refresh:
+        s = _replace(s, refresh, compute_state([s.codes[i] for i in refresh], store, warmup))
+    return s
+
+
+def _replace(s: IndicatorState, rows: List[int], fresh: IndicatorState) -> IndicatorState:
+    keep = np.setdiff1d(np.arange(len(s.codes)), rows)
+    return IndicatorState.concat([s.take(keep), fresh])
+
+
+def evaluate(s: IndicatorState) -> Dict[str, np.ndarray]:
+    """由状态求各指标的最新值，返回 {指标: [N]}"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = {f"ma{w}": s.close[:, -w:].mean(axis=1) for w in MA_WINDOWS}
+        out["ema12"], out["ema26"] = s.ema_fast.copy(), s.ema_slow.copy()
+        out["macd_dif"] = s.ema_fast - s.ema_slow
+        out["macd_dea"] = s.dea.copy()
+        out["macd_hist"] = 2 * (out["macd_dif"] - out["macd_dea"])
+        for i, n in enumerate(RSI_WINDOWS):
+            total = s.gain[i] + s.loss[i]
+            rsi = np.where(total > 0, 100 * s.gain[i] / total, 50.0)
+            out[f"rsi{n}"] = np.where(s.bars > n, rsi, np.nan)
+        window = s.close[:, -BOLL_WINDOW:]
+        mid, std = window.mean(axis=1), window.std(axis=1)
+        out["boll_mid"], out["boll_upper"], out["boll_lower"] = mid, mid + BOLL_K * std, mid - BOLL_K * std
+        base = s.volume[:, -VOL_RATIO_WINDOW - 1:-1].mean(axis=1)
+        out["vol_ratio"] = np.where(base > 0, s.volume[:, -1] / base, np.nan)
+    return out
+
+
+def to_records(s: IndicatorState, values: Dict[str, np.ndarray]) -> Dict[str, Dict]:
+    """{代码: {'date', 'close', 指标...}}，NaN 输出为 null"""
+    columns = {"close": s.close[:, -1], **values}
+    rounded = {k: np.round(v, 4).astype(object) for k, v in columns.items()}
+    for v in rounded.values():
+        v[np.isnan(v.astype(float))] = None
+    dates = [from_epoch(t).strftime("%Y-%m-%d") if b else None for t, b in zip(s.t, s.bars)]
+    names = list(rounded)
+    rows = zip(*(rounded[k].tolist() for k in names))
+    return {code: {"date": d, **dict(zip(names, row))} for code, d, row in zip(s.codes.tolist(), dates, rows)}
+
+
+# --------------------------------------------------------------------------- #
+# 更新与发布
+# --------------------------------------------------------------------------- #
+def update_indicators(codes: Optional[List[str]] = None, store: KLineStore = kline_store) -> Dict[str, int]:
+    """K 线同步后调用：增量推进已有代码，新代码全量计算，发布本交易日结果（需在 app context 中调用）"""
+    started = time.perf_counter()
+    if codes is None:
+        codes = db.session.scalars(db.select(UserStock.code).distinct()).all()
+    # 首次运行没有状态文件；没有任何自选股时同样保存、发布空结果
+    s = IndicatorState.load() or IndicatorState.empty([])
+    known = set(s.codes.tolist())
+    wanted = set(codes)
+    s = advance(s.take(np.flatnonzero([c in wanted for c in s.codes.tolist()])), store)
+    fresh = [c for c in codes if c not in known]
+    if fresh:
+        s = IndicatorState.concat([s, compute_state(fresh, store)])
+    s.save()
+
+    date = from_epoch(int(s.t.max())).strftime("%Y-%m-%d") if s.bars.any() else None
+    shared_store.set(RESULT_KEY, json.dumps({"date": date, "values": to_records(s, evaluate(s))}, ensure_ascii=False),
+                     ttl=RESULT_TTL)
+    shared_store.set(VERSION_KEY, f"{date}:{time.time()!r}", ttl=RESULT_TTL)
+    app.logger.info(f"技术指标更新完成: {len(s.codes)} 只股票（全量 {len(fresh)}），"
+                    f"交易日 {date}，耗时 {time.perf_counter() - started:.2f}秒")
+    return {"codes": len(s.codes), "computed": len(fresh)}
+
+
+class _LocalResult:
+    """进程内缓存已解析的发布结果，版本号不变时不重复解析"""
+
+    def __init__(self):
+        self._version: Optional[str] = None
+        self._data: Optional[Dict] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[Dict]:
+        version = shared_store.get(VERSION_KEY)
+        if version is None:
+            return None
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    raw = shared_store.get(RESULT_KEY)
+                    if raw is None:
+                        return None
+                    self._data, self._version = json.loads(raw), version
+        return self._data
+
+
+_published = _LocalResult()
+
+
+def get_indicators(codes: List[str], store: KLineStore = kline_store) -> Dict:
+    """读取自选股的最新指标；尚未发布的代码（刚添加等）从本地 K 线即时计算"""
+    published = _published.get() or {"date": None, "values": {}}
+    values = published["values"]
+    missing = [c for c in codes if c not in values]
+    if missing:
+        s = compute_state(missing, store)
+        values = {**values, **to_records(s, evaluate(s))}
+    return {"date": published["date"], "values": {c: values[c] for c in codes}}
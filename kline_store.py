@@ -0,0 +1,302 @@
+# kline_store.py
+"""
+本地 K 线列式存储
+
+目录结构：{KLINE_STORE_PATH}/{周期}/{代码}/{列}.bin，每列一个定长数组文件
+（t 为 int64 秒级时间戳，其余为 float64），按时间递增只追加。
+- 读取：np.memmap 映射整列，np.searchsorted 在 t 上二分定位区间，
+  返回的各列都是映射上的切片视图，不复制数据，也不访问上游
+- 写入：先追加数值列，最后追加 t；读方以 t 的长度为准，
+  写到一半失败不会读到残缺的行，下次追加前按 t 的长度截齐；
+  同一代码的追加由该代码目录上的 flock 串行化，跨线程、跨进程都不会交错写入
+- 同步：sync_kline() 对所有自选股代码并发增量抓取（只取最后一根之后的 K 线），
+  由 Celery 每日收盘后执行，多个 worker 按代码分片；
+  全部分片完成后触发技术指标增量更新（indicators.py）
+
+存储是本地文件：Web 进程（/api/stocks/kline、/api/stocks/indicators）、
+执行 app.sync_kline_codes / app.update_indicators 的 worker 必须看到同一个
+KLINE_STORE_PATH —— 部署在同一台机器，或挂载同一个共享卷（flock 需要共享卷支持，
+如本地盘、NFSv4）。worker 分布在多台机器时，设置 KLINE_QUEUE 把这两个任务路由到
+存储所在机器上的专用队列（celery -A app.celery worker -Q $KLINE_QUEUE）。
+
+K 线为不复权价格：前复权会在除权后改写历史，不适合只追加的存储。
+"""
+
+from __future__ import annotations
+
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Union
+
+import akshare as ak
+import numpy as np
+import pandas as pd
+from celery import chord
+from flask import current_app as app
+
+from cache_utils import TTLCache
+from models import db, UserStock
+from rate_limit import backoff_delay, get_rate_limiter
+
+STORE_PATH = os.getenv(
+    "KLINE_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "kline"),
+)
+HISTORY_START = os.getenv("KLINE_HISTORY_START", "20150101")  # 日线首次回填的起始日期
+SYNC_WORKERS = int(os.getenv("KLINE_SYNC_WORKERS", 4))
+SYNC_RATE = float(os.getenv("KLINE_SYNC_RATE", 5))  # 每秒请求数
+SYNC_RETRIES = 3
+TASK_SIZE = 200  # 每个 Celery 任务同步的代码数
+MAPPED_CODES = 512  # 进程内保持映射的 (周期, 代码) 数
+
+DAILY, MINUTE = "daily", "1min"
+PERIODS = (DAILY, MINUTE)
+COLUMNS = ("open", "high", "low", "close", "volume", "amount")
+# 上游列名 -> 存储列名
+UPSTREAM_COLUMNS = {"开盘": "open", "最高": "high", "最低": "low", "收盘": "close",
+                    "成交量": "volume", "成交额": "amount"}
+
+TimeLike = Union[str, datetime, np.datetime64, int, None]
+
+
+def to_epoch(value: TimeLike) -> Optional[int]:
+    """'2024-01-02' / '2024-01-02 09:31' / datetime -> 秒级时间戳（按交易所本地时间，不做时区换算）"""
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    return int(np.datetime64(value, "s").astype(np.int64))
+
+
+def from_epoch(ts: int) -> datetime:
+    return np.datetime64(int(ts), "s").astype(datetime)
+
+
+@dataclass
+class Bars:
+    """一段 K 线：各列均为 memmap 上的只读视图"""
+    t: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+    amount: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    def slice(self, lo: int, hi: int) -> "Bars":
+        return Bars(*(getattr(self, name)[lo:hi] for name in ("t",) + COLUMNS))
+
+    def to_dict(self, time_format: str) -> Dict[str, list]:
+        times = self.t.astype("datetime64[s]").astype(object)
+        data = {"time": [t.strftime(time_format) for t in times]}
+        data.update({name: getattr(self, name).tolist() for name in COLUMNS})
+        return data
+
+
+# --------------------------------------------------------------------------- #
+# 存储
+# --------------------------------------------------------------------------- #
+class KLineStore:
+    def __init__(self, root: str = STORE_PATH, mapped: int = MAPPED_CODES):
+        self.root = root
+        self._maps = TTLCache(maxsize=mapped)  # (周期, 代码) -> Bars（整列映射）
+
+    def _dir(self, period: str, code: str) -> str:
+        if period not in PERIODS:
+            raise ValueError(f"不支持的周期: {period}")
+        if not code.isalnum():
+            raise ValueError(f"无效的股票代码: {code}")
+        return os.path.join(self.root, period, code)
+
+    def _path(self, period: str, code: str, column: str) -> str:
+        return os.path.join(self._dir(period, code), f"{column}.bin")
+
+    def length(self, period: str, code: str) -> int:
+        try:
+            return os.path.getsize(self._path(period, code, "t")) // 8
+        except OSError:
+            return 0
+
+    def _mapped(self, period: str, code: str) -> Optional[Bars]:
+        """整列映射；文件变长（有追加）时重新映射"""
+        n = self.length(period, code)
+        if n == 0:
+            return None
+        key = (period, code)
+        bars = self._maps.get(key)
+        if bars is None or len(bars) != n:
+            cols = [np.memmap(self._path(period, code, "t"), dtype=np.int64, mode="r", shape=(n,))]
+            cols += [np.memmap(self._path(period, code, c), dtype=np.float64, mode="r", shape=(n,))
+                     for c in COLUMNS]
+            bars = Bars(*cols)
+            self._maps.set(key, bars)
+        return bars
+
+    def last_time(self, period: str, code: str) -> Optional[int]:
+        bars = self._mapped(period, code)
+        return int(bars.t[-1]) if bars is not None else None
+
+    def read(self, period: str, code: str, start: TimeLike = None, end: TimeLike = None) -> Optional[Bars]:
+        """[start, end] 区间内的 K 线（两端均含），不存在时返回 None"""
+        bars = self._mapped(period, code)
+        if bars is None:
+            return None
+        start, end = to_epoch(start), to_epoch(end)
+        lo = 0 if start is None else int(np.searchsorted(bars.t, start, side="left"))
+        hi = len(bars) if end is None else int(np.searchsorted(bars.t, end, side="right"))
+        return bars.slice(lo, max(lo, hi))
+
+    def tail(self, period: str, code: str, count: int, columns=("t",) + COLUMNS,
+             length: Optional[int] = None) -> Optional[Dict[str, np.ndarray]]:
+        """最近 count 根 K 线的指定列（直接按偏移读文件，批量扫描大量代码时不建立映射）
+
+        length 为调用方此前取得的行数时，读取截至该行为止的数据，不受其后的追加影响。
+        """
+        n = self.length(period, code) if length is None else length
+        if n == 0:
+            return None
+        count = min(count, n)
+        return {c: np.frombuffer(self._pread(self._path(period, code, c), count * 8, (n - count) * 8),
+                                 dtype=np.int64 if c == "t" else np.float64)
+                for c in columns}
+
+    @staticmethod
+    def _pread(path: str, size: int, offset: int) -> bytes:
+        """单次 pread 读取一段；比 np.fromfile 少了 Python 文件对象的开销，扫描几千个代码时差别明显"""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            return os.pread(fd, size, offset)
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def _write_lock(self, period: str, code: str):
+        """该代码目录上的排他 flock；每次单独打开，同进程的不同线程之间同样互斥"""
+        path = self._dir(period, code)
+        os.makedirs(path, exist_ok=True)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # 关闭即释放锁
+
+    def append(self, period: str, code: str, t: np.ndarray, values: Dict[str, np.ndarray]) -> int:
+        """追加晚于已有最后一根的 K 线（t 需递增），返回追加的行数"""
+        t = np.asarray(t, dtype=np.int64)
+        with self._write_lock(period, code):
+            n = self.length(period, code)
+            keep = np.ones(len(t), dtype=bool)
+            if n:
+                with open(self._path(period, code, "t"), "rb") as f:
+                    f.seek((n - 1) * 8)
+                    keep = t > np.frombuffer(f.read(8), dtype=np.int64)[0]
+            if not keep.any():
+                return 0
+            for column in COLUMNS:
+                with open(self._path(period, code, column), "ab") as f:
+                    f.truncate(n * 8)  # 丢弃上次写入失败留下的多余行
+                    f.write(np.asarray(values[column], dtype=np.float64)[keep].tobytes())
+            with open(self._path(period, code, "t"), "ab") as f:
+                f.write(t[keep].tobytes())
+            return int(keep.sum())
+
+    def codes(self, period: str) -> List[str]:
+        try:
+            return sorted(os.listdir(os.path.join(self.root, period)))
+        except OSError:
+            return []
+
+
+kline_store = KLineStore()
+
+
+# --------------------------------------------------------------------------- #
+# 上游抓取
+# --------------------------------------------------------------------------- #
+def _fetch_daily(code: str, after: Optional[int]) -> pd.DataFrame:
+    start = HISTORY_START if after is None else (
+        from_epoch(after) + timedelta(days=1)).strftime("%Y%m%d")
+    df = ak.stock_zh_a_hist(symbol=code, period="daily", start_date=start,
+                            end_date=datetime.now().strftime("%Y%m%d"), adjust="")
+    return df.rename(columns={"日期": "time"})
+
+
+def _fetch_minute(code: str, after: Optional[int]) -> pd.DataFrame:
+    # 分钟线上游只保留最近几个交易日，首次同步时能取多少取多少
+    start = "1979-09-01 09:32:00" if after is None else (
+        from_epoch(after) + timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M:%S")
+    df = ak.stock_zh_a_hist_min_em(symbol=code, start_date=start,
+                                   end_date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), period="1", adjust="")
+    return df.rename(columns={"时间": "time"})
+
+
+FETCHERS: Dict[str, Callable[[str, Optional[int]], pd.DataFrame]] = {DAILY: _fetch_daily, MINUTE: _fetch_minute}
+
+
+def frame_to_columns(df: pd.DataFrame):
+    """上游 DataFrame -> (t, {列: 数组})，按时间排序"""
+    df = df.rename(columns=UPSTREAM_COLUMNS)
+    df = df.assign(time=pd.to_datetime(df["time"], errors="coerce")).dropna(subset=["time"]).sort_values("time")
+    t = df["time"].to_numpy(dtype="datetime64[s]").astype(np.int64)
+    return t, {c: df[c].to_numpy(dtype=np.float64) for c in COLUMNS}
+
+
+# --------------------------------------------------------------------------- #
+# 增量同步
+# --------------------------------------------------------------------------- #
+def sync_codes(codes: List[str], periods=PERIODS, store: KLineStore = kline_store) -> Dict[str, int]:
+    """并发抓取并追加每只股票最后一根之后的 K 线，返回 {'bars', 'failed'}"""
+    limiter = get_rate_limiter("eastmoney-kline", SYNC_RATE)
+    started = time.perf_counter()
+
+    def sync_one(period: str, code: str) -> int:
+        for attempt in range(SYNC_RETRIES):
+            limiter.acquire()
+            try:
+                df = FETCHERS[period](code, store.last_time(period, code))
+                if df is None or df.empty:
+                    return 0
+                t, values = frame_to_columns(df)
+                return store.append(period, code, t, values)
+            except Exception:  # noqa: BLE001
+                if attempt + 1 == SYNC_RETRIES:
+                    raise
+                time.sleep(backoff_delay(attempt))
+        return 0
+
+    bars = failed = 0
+    with ThreadPoolExecutor(max_workers=SYNC_WORKERS, thread_name_prefix="kline-sync") as pool:
+        futures = {pool.submit(sync_one, p, c): (p, c) for p in periods for c in codes}
+        for future in as_completed(futures):
+            try:
+                bars += future.result()
+            except Exception as exc:  # noqa: BLE001
+                failed += 1
+                app.logger.error(f"K 线同步失败 {futures[future]}: {exc}")
+    app.logger.info(f"K 线同步完成: {len(codes)} 只股票，新增 {bars} 根（失败 {failed}），"
+                    f"耗时 {time.perf_counter() - started:.2f}秒")
+    return {"bars": bars, "failed": failed}
+
+
+def sync_kline() -> None:
+    """同步所有自选股的 K 线：按 TASK_SIZE 分片扇出到 Celery，全部完成后更新技术指标；
+    未配置 broker 时在当前进程内执行"""
+    codes = db.session.scalars(db.select(UserStock.code).distinct()).all()
+    chunks = [codes[i:i + TASK_SIZE] for i in range(0, len(codes), TASK_SIZE)]
+    celery = app.extensions.get("celery")
+    if celery is None or not celery.conf.broker_url:
+        for chunk in chunks:
+            sync_codes(chunk)
+        import indicators  # 指标引擎依赖本模块，延迟导入
+        indicators.update_indicators(codes)
+        return
+    header = [celery.signature("app.sync_kline_codes", args=(chunk,)) for chunk in chunks]
+    chord(header)(celery.signature("app.update_indicators"))
+    app.logger.info(f"已提交 K 线同步任务: {len(codes)} 只股票，{len(chunks)} 个任务")
@@ -0,0 +1,187 @@
+# market_snapshot.py
+"""
+全市场行情快照
+
+由 Celery beat 每隔几秒触发一次 refresh()，调用一次 ak.stock_zh_a_spot_em
+拉取全市场行情，整理成 {代码: 行情} 写入共享存储；各 Web 进程按版本号
+（快照时间）缓存解析结果，请求只按代码切片，不访问上游。
+无论多少用户在看行情，每个周期只有一次上游调用。
+
+未配置 Celery broker（本地开发）时，读取方发现快照过期会在请求内刷新，
+跨进程锁保证同一时刻只有一个刷新。
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+import akshare as ak
+
+from cache_utils import shared_store
+from stock_index import normalize_code
+
+logger = logging.getLogger(__name__)
+
+# 交易所所在时区：交易时段判断与 Celery beat 的 crontab 都按此时区，与服务器本地时区无关
+MARKET_TZ_NAME = "Asia/Shanghai"
+MARKET_TZ = ZoneInfo(MARKET_TZ_NAME)
+
+POLL_INTERVAL = float(os.getenv("QUOTE_POLL_SECONDS", 5))  # 交易时段刷新间隔（秒）
+OFF_HOURS_INTERVAL = 1800  # 非交易时段刷新间隔（秒），收盘后的快照基本不变
+SNAPSHOT_TTL = 3 * 24 * 3600  # 保留到下个交易日，跨周末仍可返回收盘价
+LOCK_TTL = 30  # 单次拉取的最长耗时（秒）
+
+SNAPSHOT_KEY = "market:snapshot"
+VERSION_KEY = "market:snapshot:ts"
+LOCK_KEY = "market:snapshot:lock"
+
+# 输出字段 -> stock_zh_a_spot_em 列名
+COLUMNS = {
+    "price": "最新价",
+    "change_pct": "涨跌幅",
+    "change": "涨跌额",
+    "volume": "成交量",
+    "amount": "成交额",
+    "open": "今开",
+    "high": "最高",
+    "low": "最低",
+    "prev_close": "昨收",
+}
+FIELDS = list(COLUMNS)
+
+
+def market_now() -> datetime:
+    """交易所当地时间"""
+    return datetime.now(MARKET_TZ)
+
+
+def is_trading_time(now: Optional[datetime] = None) -> bool:
+    """A 股连续竞价时段（含集合竞价），不考虑节假日；now 为空时取交易所当地时间"""
+    now = now or market_now()
+    if now.weekday() >= 5:
+        return False
+    hm = now.hour * 100 + now.minute
+    return 915 <= hm <= 1130 or 1300 <= hm <= 1500
+
+
+def refresh_interval(now: Optional[datetime] = None) -> float:
+    """快照刷新间隔：按交易所当地时间判断交易时段，服务器时区（如 UTC）不影响"""
+    return POLL_INTERVAL if is_trading_time(now or market_now()) else OFF_HOURS_INTERVAL
+
+
+# --------------------------------------------------------------------------- #
+# 快照
+# --------------------------------------------------------------------------- #
+class Snapshot:
+    """一次全市场行情：rows 为 {代码: [名称, *FIELDS]}"""
+
+    __slots__ = ("ts", "rows")
+
+    def __init__(self, ts: float, rows: Dict[str, List[Any]]):
+        self.ts = ts
+        self.rows = rows
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.ts
+
+    def quote(self, code: str) -> Dict[str, Any]:
+        row = self.rows.get(code)
+        if row is None:
+            return {"code": code, "name": None, **dict.fromkeys(FIELDS)}
+        return {"code": code, "name": row[0], **dict(zip(FIELDS, row[1:]))}
+
+    def quotes(self, codes: List[str]) -> List[Dict[str, Any]]:
+        return [self.quote(c) for c in codes]
+
+
+def fetch_snapshot() -> Snapshot:
+    """调用一次上游，返回全市场快照"""
+    df = ak.stock_zh_a_spot_em()
+    df = df[["代码", "名称", *COLUMNS.values()]]
+    df = df.astype(object).where(df.notna(), None)  # 停牌股的 NaN -> null
+    rows = {normalize_code(r[0]): list(r[1:]) for r in df.itertuples(index=False, name=None)}
+    return Snapshot(time.time(), rows)
+
+
+def _publish(snap: Snapshot) -> None:
+    # 先写数据再写版本号，读方看到新版本时数据一定已就绪
+    shared_store.set(SNAPSHOT_KEY, json.dumps({"ts": snap.ts, "rows": snap.rows}, ensure_ascii=False),
+                     ttl=SNAPSHOT_TTL)
+    shared_store.set(VERSION_KEY, repr(snap.ts), ttl=SNAPSHOT_TTL)
+
+
+def refresh(force: bool = False) -> bool:
+    """快照已过期时拉取并发布新快照；返回是否实际刷新（Celery beat 定时调用）"""
+    if not force:
+        ts = shared_store.get(VERSION_KEY)
+        if ts is not None and time.time() - float(ts) < refresh_interval() - 0.5:
+            return False
+    if not shared_store.add(LOCK_KEY, "1", ttl=LOCK_TTL):
+        return False  # 其他进程正在刷新
+    try:
+        t = time.perf_counter()
+        snap = fetch_snapshot()
+        _publish(snap)
+        _local.put(snap)
+        logger.info(f"行情快照已刷新: {len(snap.rows)} 只, 耗时 {time.perf_counter() - t:.2f}秒")
+        return True
+    finally:
+        shared_store.delete(LOCK_KEY)
+
+
+class _LocalSnapshot:
+    """进程内缓存：版本号未变时复用已解析的快照，每次请求只读一个短键"""
+
+    def __init__(self):
+        self._snap: Optional[Snapshot] = None
+        self._lock = threading.Lock()
+
+    def put(self, snap: Snapshot) -> None:
+        with self._lock:
+            if self._snap is None or snap.ts >= self._snap.ts:
+                self._snap = snap
+
+    def get(self) -> Optional[Snapshot]:
+        ts = shared_store.get(VERSION_KEY)
+        if ts is None:
+            return None
+        snap = self._snap
+        if snap is not None and repr(snap.ts) == ts:
+            return snap
+        with self._lock:
+            if self._snap is not None and repr(self._snap.ts) == ts:
+                return self._snap
+            raw = shared_store.get(SNAPSHOT_KEY)
+            if raw is None:
+                return None
+            data = json.loads(raw)
+            self._snap = Snapshot(data["ts"], data["rows"])
+            return self._snap
+
+
+_local = _LocalSnapshot()
+
+
+def get_snapshot(refresh_inline: bool = False) -> Optional[Snapshot]:
+    """读取当前快照；refresh_inline 为真时，缺失或过期则在当前进程刷新一次"""
+    snap = _local.get()
+    if refresh_inline and (snap is None or snap.age >= refresh_interval()):
+        try:
+            if refresh(force=snap is None):
+                snap = _local.get()
+        except Exception as exc:  # noqa: BLE001
+            logger.warning(f"行情快照刷新失败: {exc}")
+        if snap is None:  # 其他进程正在首次拉取，稍等片刻
+            deadline = time.monotonic() + LOCK_TTL
+            while snap is None and shared_store.get(LOCK_KEY) is not None and time.monotonic() < deadline:
+                time.sleep(0.1)
+                snap = _local.get()
+    return snap
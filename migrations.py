@@ -0,0 +1,165 @@
+# migrations.py
+"""
+数据库结构版本管理
+
+schema_migrations 表记录已执行的版本号，upgrade() 按版本顺序执行尚未执行的迁移。
+每个迁移都先检查现状再变更（列 / 索引已存在则跳过），因此：
+- 全新数据库：基线迁移按当前模型建表（已含全部索引），后续迁移均为空操作
+- 旧数据库（只执行过 db.create_all()）：补齐新增的表、列、约束与索引
+
+用法：python migrations.py（start.sh 在启动 gunicorn 前执行）
+新增迁移：在文件末尾追加 @migration(下一个版本号, "说明") 函数，不要修改已发布的迁移。
+"""
+
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection, Engine
+
+from models import db, NewsCache, UserStock
+
+logger = logging.getLogger(__name__)
+
+_meta = sa.MetaData()
+schema_migrations = sa.Table(
+    "schema_migrations", _meta,
+    sa.Column("version", sa.Integer, primary_key=True, autoincrement=False),
+    sa.Column("name", sa.String(100), nullable=False),
+    sa.Column("applied_at", sa.DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str):
+    def register(fn: Callable[[Connection], None]):
+        assert not MIGRATIONS or MIGRATIONS[-1].version < version, "迁移版本号必须递增"
+        MIGRATIONS.append(Migration(version, name, fn))
+        return fn
+    return register
+
+
+# --------------------------------------------------------------------------- #
+# 结构检查辅助
+# --------------------------------------------------------------------------- #
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return column in {c["name"] for c in sa.inspect(conn).get_columns(table)}
+
+
+def _has_index(conn: Connection, table: str, name: str) -> bool:
+    insp = sa.inspect(conn)
+    names = {i["name"] for i in insp.get_indexes(table)}
+    names |= {u["name"] for u in insp.get_unique_constraints(table)}
+    return name in names
+
+
+def _add_column(conn: Connection, model, column: str) -> None:
+    table = model.__table__
+    if _has_column(conn, table.name, column):
+        return
+    col_type = table.c[column].type.compile(dialect=conn.dialect)
+    conn.execute(sa.text(f"ALTER TABLE {table.name} ADD COLUMN {column} {col_type}"))
+
+
+def _model_index(model, name: str) -> sa.Index:
+    return next(i for i in model.__table__.indexes if i.name == name)
+
+
+def _create_index(conn: Connection, index: sa.Index) -> None:
+    if not _has_index(conn, index.table.name, index.name):
+        index.create(conn)
+
+
+def _drop_index(conn: Connection, table: str, name: str) -> None:
+    if not _has_index(conn, table, name):
+        return
+    if conn.dialect.name == "mysql":
+        conn.execute(sa.text(f"DROP INDEX {name} ON {table}"))
+    else:
+        conn.execute(sa.text(f"DROP INDEX {name}"))
+
+
+# --------------------------------------------------------------------------- #
+# 迁移（只追加，不修改）
+# --------------------------------------------------------------------------- #
+@migration(1, "基线：创建缺失的表")
+def _baseline(conn: Connection) -> None:
+    db.metadata.create_all(conn, checkfirst=True)
+
+
+@migration(2, "news_cache 增加正文与情感分析字段")
+def _news_sentiment_columns(conn: Connection) -> None:
+    for column in ("content", "sentiment", "sentiment_reason"):
+        _add_column(conn, NewsCache, column)
+
+
+@migration(3, "user_stocks 去重并加 (user_id, code) 唯一约束")
+def _user_stocks_unique(conn: Connection) -> None:
+    if _has_index(conn, "user_stocks", "uq_user_stocks_user_code"):
+        return
+    # 外层再包一层派生表，兼容 MySQL 不允许在 DELETE 子查询中引用目标表
+    conn.execute(sa.text(
+        "DELETE FROM user_stocks WHERE id NOT IN ("
+        "SELECT id FROM (SELECT MIN(id) AS id FROM user_stocks GROUP BY user_id, code) AS keep_rows)"
+    ))
+    sa.Index("uq_user_stocks_user_code", UserStock.__table__.c.user_id, UserStock.__table__.c.code,
+             unique=True).create(conn)
+
+
+@migration(4, "热点查询复合索引，替换单列索引")
+def _hot_query_indexes(conn: Connection) -> None:
+    _create_index(conn, _model_index(UserStock, "ix_user_stocks_code_user"))
+    _create_index(conn, _model_index(NewsCache, "ix_news_cache_code_time"))
+    _create_index(conn, _model_index(NewsCache, "ix_news_cache_publish_time"))
+    # 已被复合索引的前缀覆盖
+    _drop_index(conn, "user_stocks", "ix_user_stocks_code")
+    _drop_index(conn, "news_cache", "ix_news_cache_stock_code")
+
+
+# --------------------------------------------------------------------------- #
+# 执行
+# --------------------------------------------------------------------------- #
+def current_version(engine: Engine) -> int:
+    with engine.connect() as conn:
+        if not sa.inspect(conn).has_table(schema_migrations.name):
+            return 0
+        return conn.execute(sa.select(sa.func.max(schema_migrations.c.version))).scalar() or 0
+
+
+def upgrade(engine: Optional[Engine] = None, target: Optional[int] = None) -> List[int]:
+    """执行到 target 版本（默认最新），返回本次执行的版本号"""
+    engine = engine or db.engine
+    _meta.create_all(engine, checkfirst=True)
+    done = current_version(engine)
+    applied = []
+    for m in MIGRATIONS:
+        if m.version <= done or (target is not None and m.version > target):
+            continue
+        logger.info(f"执行迁移 {m.version}: {m.name}")
+        with engine.begin() as conn:
+            m.apply(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=m.version, name=m.name, applied_at=datetime.now()))
+        applied.append(m.version)
+    return applied
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    from app import app
+
+    with app.app_context():
+        versions = upgrade()
+        print(f"数据库已是最新版本 {current_version(db.engine)}"
+              + (f"，本次执行: {versions}" if versions else ""))
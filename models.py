@@ -22,17 +22,53 @@ class User(db.Model):
 
 class UserStock(db.Model):
     __tablename__ = 'user_stocks'
+    __table_args__ = (
+        # 同一用户不重复添加；同时覆盖「按用户取自选代码」
+        db.UniqueConstraint('user_id', 'code', name='uq_user_stocks_user_code'),
+        # 覆盖「按代码找订阅用户」（新闻扇出 / 推送）
+        db.Index('ix_user_stocks_code_user', 'code', 'user_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    code = db.Column(db.String(10), index=True, nullable=False)  # 股票代码
+    code = db.Column(db.String(10), nullable=False)  # 股票代码
     name = db.Column(db.String(50), nullable=True)  # 股票名称
     added_at = db.Column(db.DateTime, default=datetime.now)
 
 class NewsCache(db.Model):
     __tablename__ = 'news_cache'
     id = db.Column(db.Integer, primary_key=True)
-    stock_code = db.Column(db.String(10), index=True, nullable=False)
+    stock_code = db.Column(db.String(10), nullable=False)
     title = db.Column(db.Text, nullable=False)
+    content = db.Column(db.Text, nullable=True)  # 正文（截断保存，供情感分析）
     content_hash = db.Column(db.String(32), unique=True, nullable=False)  # 内容哈希，防重复
     publish_time = db.Column(db.DateTime, nullable=False)
+    sentiment = db.Column(db.String(8), nullable=True)  # 利好/利空/中性，未分析时为空
+    sentiment_reason = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
+
+    # 按代码取最新新闻 / 时间窗口：等值 + 范围 + 排序都在索引内完成
+    __table_args__ = (
+        db.Index('ix_news_cache_code_time', stock_code, publish_time.desc(), id.desc()),
+        db.Index('ix_news_cache_publish_time', publish_time),  # 推送时间窗口（不限代码）
+    )
+
+class NewsWatermark(db.Model):
+    __tablename__ = 'news_watermarks'
+    stock_code = db.Column(db.String(10), primary_key=True)
+    last_publish_time = db.Column(db.DateTime, nullable=False)  # 已入库的最新发布时间
+    last_hash = db.Column(db.String(32), nullable=True)  # 该条新闻的内容哈希
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+# 批量写入辅助
+def insert_ignore(model):
+    """按当前数据库方言构造「插入，唯一键冲突则忽略」语句"""
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        return db.insert(model).prefix_with('IGNORE')
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(model).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(model).on_conflict_do_nothing()
+    raise NotImplementedError(f"不支持的数据库方言: {dialect}")
@@ -0,0 +1,195 @@
+# news_feed.py
+"""
+按用户物化的新闻流
+
+每个用户的最新 FEED_SIZE 条自选股新闻（按发布时间倒序）缓存在共享存储中：
+- GET /api/news 直接按键读取，未命中时一次查询重建
+- 新闻入库、情感分析完成时把新条目合并进订阅用户已缓存的 feed（同 id 覆盖）
+- 自选股增删时整体失效
+
+每个用户有一个修订号计数器，feed 中记下它对应的修订号，与当前修订号不符即视为失效：
+- 合并前先 INCR 修订号，再用 WATCH / MULTI 原子地改写 feed，且只在 feed 恰好是
+  上一个修订号时合并；并发的合并、重建交错时宁可放弃改写，由下次读取重建，不会丢新闻
+- 重建先取修订号再查库，查询期间有新的合并则写入的修订号已过期，下次读取再重建
+/api/news 的响应缓存由调用方在一轮入库 / 情感分析结束后统一失效（invalidate_responses）。
+"""
+
+from __future__ import annotations
+
+import heapq
+import json
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import response_cache
+from cache_utils import shared_store
+from models import db, UserStock, NewsCache
+
+FEED_SIZE = 200
+FEED_TTL = int(os.getenv("NEWS_FEED_TTL_SECONDS", 3600))
+LOOKUP_CHUNK = 1000
+UNION_CHUNK = 200  # 每条 UNION ALL 语句包含的代码数（SQLite 复合查询上限 500）
+
+
+def _key(user_id) -> str:
+    return f"news_feed:{user_id}"
+
+
+def _rev_key(user_id) -> str:
+    return f"news_feed:{user_id}:rev"
+
+
+def _rev(user_id) -> str:
+    return shared_store.get(_rev_key(user_id)) or "0"
+
+
+def _item(n) -> Dict:
+    return {
+        "id": n.id,
+        "title": n.title,
+        "code": n.stock_code,
+        "ts": n.publish_time.timestamp(),
+        "sentiment": n.sentiment,
+        "reason": n.sentiment_reason,
+    }
+
+
+def _sort_key(item: Dict) -> Tuple[float, int]:
+    return item["ts"], item["id"]
+
+
+# --------------------------------------------------------------------------- #
+# 游标：上一页最后一条的 (发布时间, id)
+# --------------------------------------------------------------------------- #
+def encode_cursor(item: Dict) -> str:
+    return f"{item['ts']!r}_{item['id']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    ts, news_id = cursor.split("_", 1)
+    return float(ts), int(news_id)
+
+
+# --------------------------------------------------------------------------- #
+# 读写
+# --------------------------------------------------------------------------- #
+def latest_ids_stmt(codes: List[str], limit: int, before: Optional[Tuple[datetime, int]] = None):
+    """每只股票按 (发布时间, id) 倒序各取前 limit 条的 (发布时间, id)，UNION ALL 合并
+
+    每个子查询都是 ix_news_cache_code_time 上的一次定位 + 顺序读 limit 条，只读索引、
+    不回表也不排序；不在 SQL 里做全局排序（那会对合并结果建临时 B 树），由调用方归并。
+    """
+    parts = []
+    for code in codes:
+        stmt = db.select(NewsCache.publish_time, NewsCache.id).where(NewsCache.stock_code == code)
+        if before is not None:
+            ts, news_id = before
+            stmt = stmt.where(db.or_(NewsCache.publish_time < ts,
+                                     db.and_(NewsCache.publish_time == ts, NewsCache.id < news_id)))
+        stmt = stmt.order_by(NewsCache.publish_time.desc(), NewsCache.id.desc()).limit(limit)
+        parts.append(db.select(stmt.subquery()))
+    return parts[0] if len(parts) == 1 else db.union_all(*parts)
+
+
+def latest_ids(codes: List[str], limit: int, before: Optional[Tuple[datetime, int]] = None) -> List[int]:
+    """多只股票合并后的最新 limit 条新闻 id（按发布时间、id 倒序）"""
+    rows = []
+    for i in range(0, len(codes), UNION_CHUNK):
+        rows.extend(db.session.execute(latest_ids_stmt(codes[i:i + UNION_CHUNK], limit, before)).all())
+    return [news_id for _, news_id in heapq.nlargest(limit, rows)]
+
+
+def _latest_items(codes: List[str], limit: int, before: Optional[Tuple[datetime, int]] = None) -> List[Dict]:
+    """先在索引上取 id，再按主键取这几行，避免为排序读出全部命中行"""
+    if not codes:
+        return []
+    ids = latest_ids(codes, limit, before)
+    if not ids:
+        return []
+    news = NewsCache.query.filter(NewsCache.id.in_(ids)).all()
+    news.sort(key=lambda n: (n.publish_time, n.id), reverse=True)
+    return [_item(n) for n in news]
+
+
+def watchlist_codes_stmt(user_id):
+    """用户的自选代码：只读 uq_user_stocks_user_code"""
+    return db.select(UserStock.code).where(UserStock.user_id == user_id)
+
+
+def build_feed(user_id, rev: Optional[str] = None) -> List[Dict]:
+    rev = rev or _rev(user_id)  # 先取修订号再查库
+    codes = db.session.scalars(watchlist_codes_stmt(user_id)).all()
+    items = _latest_items(codes, FEED_SIZE)
+    shared_store.set_json(_key(user_id), {"rev": rev, "items": items}, ttl=FEED_TTL)
+    return items
+
+
+def get_feed(user_id) -> List[Dict]:
+    rev = _rev(user_id)
+    feed = shared_store.get_json(_key(user_id))
+    if isinstance(feed, dict) and feed.get("rev") == rev:
+        return feed["items"]
+    return build_feed(user_id, rev)
+
+
+def page(user_id, limit: int, cursor: Optional[str] = None,
+         since: Optional[datetime] = None) -> List[Dict]:
+    """取一页新闻；游标越过物化范围时回源数据库"""
+    feed = items = get_feed(user_id)
+    if cursor:
+        ts, news_id = decode_cursor(cursor)
+        items = [i for i in feed if _sort_key(i) < (ts, news_id)]
+        if len(items) < limit and len(feed) >= FEED_SIZE:
+            return _page_from_db(user_id, limit, ts, news_id)
+    if since is not None:
+        items = [i for i in items if i["ts"] > since.timestamp()]
+    return items[:limit]
+
+
+def _page_from_db(user_id, limit: int, ts: float, news_id: int) -> List[Dict]:
+    codes = db.session.scalars(watchlist_codes_stmt(user_id)).all()
+    return _latest_items(codes, limit, before=(datetime.fromtimestamp(ts), news_id))
+
+
+def invalidate_feed(user_id) -> None:
+    shared_store.incr(_rev_key(user_id))
+
+
+def invalidate_responses(user_ids: Iterable) -> None:
+    """使这些用户的 /api/news 响应缓存失效；一轮入库 / 情感分析结束后调用一次"""
+    for user_id in set(user_ids):
+        response_cache.invalidate(user_id, response_cache.NEWS)
+
+
+def _merge(raw: Optional[str], fresh: Dict[int, Dict], rev: int) -> Optional[str]:
+    """feed 恰好是上一个修订号时合并并升到 rev；未缓存或期间有并发修改时不写"""
+    feed = json.loads(raw) if raw is not None else None
+    if not isinstance(feed, dict) or feed.get("rev") != str(rev - 1):
+        return None
+    items = [i for i in feed["items"] if i["id"] not in fresh] + list(fresh.values())
+    items.sort(key=_sort_key, reverse=True)
+    return json.dumps({"rev": str(rev), "items": items[:FEED_SIZE]}, ensure_ascii=False)
+
+
+def fan_out(news: List[NewsCache]) -> Set[int]:
+    """把新增或更新的新闻合并进订阅用户已缓存的 feed（同 id 覆盖），返回订阅了这些新闻的用户"""
+    new_by_code: Dict[str, List[Dict]] = defaultdict(list)
+    for n in news:
+        new_by_code[n.stock_code].append(_item(n))
+
+    codes = list(new_by_code)
+    user_codes: Dict[int, List[str]] = defaultdict(list)
+    for i in range(0, len(codes), LOOKUP_CHUNK):
+        rows = db.session.execute(
+            db.select(UserStock.user_id, UserStock.code).where(UserStock.code.in_(codes[i:i + LOOKUP_CHUNK]))
+        )
+        for user_id, code in rows:
+            user_codes[user_id].append(code)
+
+    for user_id, user_code_list in user_codes.items():
+        fresh = {n["id"]: n for c in user_code_list for n in new_by_code[c]}
+        rev = shared_store.incr(_rev_key(user_id))  # 先升修订号：此前开始的重建都会失效
+        shared_store.update(_key(user_id), lambda raw: _merge(raw, fresh, rev), ttl=FEED_TTL)
+    return set(user_codes)
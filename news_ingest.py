@@ -0,0 +1,300 @@
+# news_ingest.py
+"""
+新闻抓取引擎
+
+并发抓取多只股票的新闻：有界线程池 + 按数据源限流 + 单只超时 + 指数退避重试，
+每轮结束输出吞吐量（codes/s、rows/s）。入库在调用线程中完成（Session 非线程安全），
+按批整列计算哈希、一次 IN 查询去重、一条批量 INSERT 写入。
+每只股票记录已入库的最新发布时间（水位线），更早的新闻在哈希之前直接跳过。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import akshare as ak
+import pandas as pd
+from flask import current_app as app
+
+from models import db, insert_ignore, UserStock, NewsCache, NewsWatermark
+import news_feed
+import news_sentiment
+from rate_limit import backoff_delay, get_rate_limiter
+
+FETCH_WORKERS = int(os.getenv("NEWS_FETCH_WORKERS", 8))
+FETCH_RATE = float(os.getenv("NEWS_FETCH_RATE", 5))  # 每秒请求数（按数据源）
+FETCH_TIMEOUT = float(os.getenv("NEWS_FETCH_TIMEOUT", 15))  # 单次请求超时（秒）
+FETCH_RETRIES = int(os.getenv("NEWS_FETCH_RETRIES", 3))
+INSERT_BATCH = 2000  # 每批入库行数
+LOOKUP_CHUNK = 1000  # 每条 IN 查询的哈希个数
+CONTENT_MAX_CHARS = 1000  # 正文截断长度（只用于情感分析）
+
+
+# --------------------------------------------------------------------------- #
+# 数据结构
+# --------------------------------------------------------------------------- #
+@dataclass
+class FetchResult:
+    code: str
+    df: Optional[pd.DataFrame] = None
+    error: Optional[str] = None
+    attempts: int = 0
+
+
+@dataclass
+class IngestStats:
+    codes: int = 0
+    codes_failed: int = 0
+    rows_fetched: int = 0
+    rows_skipped: int = 0  # 早于水位线、未做哈希的行
+    rows_inserted: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    elapsed: float = 0.0
+
+    def finish(self) -> "IngestStats":
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def summary(self) -> str:
+        secs = max(self.elapsed, 1e-9)
+        return (
+            f"新闻抓取完成: {self.codes} 只股票（失败 {self.codes_failed}），"
+            f"抓取 {self.rows_fetched} 条（水位线跳过 {self.rows_skipped} 条），新增 {self.rows_inserted} 条，耗时 {self.elapsed:.2f}秒，"
+            f"{self.codes / secs:.1f} codes/s，{self.rows_fetched / secs:.1f} rows/s"
+        )
+
+
+def normalize_news_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """统一 stock_news_em 的列名（不同 akshare 版本列名不同）"""
+    columns = df.columns.tolist()
+    title_col = next((c for c in ["新闻标题", "标题"] if c in columns), None)
+    content_col = next((c for c in ["新闻内容", "内容"] if c in columns), None)
+    if title_col is None or content_col is None or "发布时间" not in columns:
+        raise ValueError(f"新闻数据列异常: {columns}")
+    return pd.DataFrame({
+        "title": df[title_col].astype(str),
+        "content": df[content_col].astype(str),
+        "publish_time": pd.to_datetime(df["发布时间"], errors="coerce"),
+    }).dropna(subset=["publish_time"])
+
+
+# --------------------------------------------------------------------------- #
+# 并发抓取
+# --------------------------------------------------------------------------- #
+class NewsFetcher:
+    """并发抓取器：同一数据源的所有线程共用一个令牌桶"""
+
+    def __init__(self, fetch: Optional[Callable[[str], pd.DataFrame]] = None,
+                 source: str = "eastmoney", workers: int = FETCH_WORKERS,
+                 rate: float = FETCH_RATE, timeout: float = FETCH_TIMEOUT,
+                 retries: int = FETCH_RETRIES):
+        self.fetch = fetch or ak.stock_news_em
+        self.source = source
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.limiter = get_rate_limiter(source, rate)
+
+    def _fetch_one(self, code: str, calls: ThreadPoolExecutor) -> FetchResult:
+        result = FetchResult(code=code)
+        for attempt in range(self.retries):
+            result.attempts = attempt + 1
+            self.limiter.acquire()
+            # 上游接口不支持超时参数，放到调用线程池中限时等待
+            future = calls.submit(self.fetch, code)
+            try:
+                result.df = normalize_news_frame(future.result(timeout=self.timeout))
+                result.error = None
+                return result
+            except FutureTimeout:
+                future.cancel()
+                result.error = f"超时（{self.timeout}秒）"
+            except Exception as exc:  # noqa: BLE001
+                result.error = str(exc)
+            if attempt + 1 < self.retries:
+                time.sleep(backoff_delay(attempt))
+        return result
+
+    def fetch_many(self, codes: Iterable[str]) -> Iterator[FetchResult]:
+        """并发抓取，按完成顺序逐个产出结果"""
+        # 超时的调用仍会占用调用线程，调用池留出余量，避免被个别卡死的请求拖住
+        calls = ThreadPoolExecutor(max_workers=self.workers * 2, thread_name_prefix=f"{self.source}-call")
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.source}-fetch") as pool:
+                futures = [pool.submit(self._fetch_one, code, calls) for code in codes]
+                for future in as_completed(futures):
+                    yield future.result()
+        finally:
+            calls.shutdown(wait=False, cancel_futures=True)
+
+
+# --------------------------------------------------------------------------- #
+# 入库
+# --------------------------------------------------------------------------- #
+def hash_news_frame(code: str, df: pd.DataFrame) -> pd.DataFrame:
+    """整列计算内容哈希，并补上股票代码列"""
+    contents = df["content"].to_numpy()
+    return df.assign(
+        stock_code=code,
+        content_hash=[hashlib.md5(c.encode()).hexdigest() for c in contents],
+    )
+
+
+def _existing_hashes(hashes: List[str]) -> Set[str]:
+    """分批 IN 查询已入库的哈希"""
+    found: Set[str] = set()
+    for i in range(0, len(hashes), LOOKUP_CHUNK):
+        chunk = hashes[i:i + LOOKUP_CHUNK]
+        found.update(db.session.scalars(
+            db.select(NewsCache.content_hash).where(NewsCache.content_hash.in_(chunk))
+        ))
+    return found
+
+
+def _after_insert(content_hashes: List[str], subscribers: Set[int]) -> List[int]:
+    """新闻入库后的下游更新（失败不影响入库），返回新入库新闻的 id；受影响的用户加入 subscribers"""
+    news = []
+    for i in range(0, len(content_hashes), LOOKUP_CHUNK):
+        news.extend(NewsCache.query.filter(NewsCache.content_hash.in_(content_hashes[i:i + LOOKUP_CHUNK])))
+    try:
+        subscribers |= news_feed.fan_out(news)
+    except Exception as exc:  # noqa: BLE001
+        app.logger.error(f"更新用户新闻流失败: {exc}")
+    return [n.id for n in news if n.sentiment is None]
+
+
+Watermark = Tuple[datetime, Optional[str]]
+
+
+def _load_watermarks(codes: List[str]) -> Dict[str, Watermark]:
+    marks: Dict[str, Watermark] = {}
+    for i in range(0, len(codes), LOOKUP_CHUNK):
+        rows = db.session.execute(
+            db.select(NewsWatermark.stock_code, NewsWatermark.last_publish_time, NewsWatermark.last_hash)
+            .where(NewsWatermark.stock_code.in_(codes[i:i + LOOKUP_CHUNK]))
+        )
+        marks.update({code: (ts, h) for code, ts, h in rows})
+    return marks
+
+
+def apply_watermark(code: str, df: pd.DataFrame, mark: Optional[Watermark]) -> pd.DataFrame:
+    """丢弃早于水位线的行后再计算哈希；与水位线同一时刻的行仍交给哈希去重"""
+    if mark is not None:
+        df = df[df["publish_time"] >= pd.Timestamp(mark[0])]
+    if df.empty:
+        return df
+    hashed = hash_news_frame(code, df)
+    if mark is not None and mark[1]:
+        hashed = hashed[hashed["content_hash"] != mark[1]]
+    return hashed
+
+
+def _save_watermarks(new_marks: Dict[str, Watermark], known: Dict[str, Watermark]) -> None:
+    rows = [{"stock_code": code, "last_publish_time": ts, "last_hash": h}
+            for code, (ts, h) in new_marks.items()]
+    updates = [r for r in rows if r["stock_code"] in known]
+    inserts = [r for r in rows if r["stock_code"] not in known]
+    if updates:
+        db.session.execute(db.update(NewsWatermark), updates)
+    if inserts:
+        db.session.execute(db.insert(NewsWatermark), inserts)
+
+
+def _store_news_batch(frames: List[pd.DataFrame], new_marks: Optional[Dict[str, Watermark]] = None,
+                      known_marks: Optional[Dict[str, Watermark]] = None) -> Tuple[int, List[str]]:
+    """批量去重 + 批量插入，返回 (新增条数, 待插入的哈希)；水位线与新闻在同一事务中推进"""
+    batch = pd.concat(frames, ignore_index=True).drop_duplicates("content_hash")
+    existing = _existing_hashes(batch["content_hash"].tolist())
+    if existing:
+        batch = batch[~batch["content_hash"].isin(existing)]
+    if batch.empty:
+        if new_marks:
+            _save_watermarks(new_marks, known_marks or {})
+            db.session.commit()
+        return 0, []
+
+    rows = [{
+        "stock_code": r.stock_code,
+        "title": r.title,
+        "content": r.content[:CONTENT_MAX_CHARS],
+        "content_hash": r.content_hash,
+        "publish_time": r.publish_time.to_pydatetime(),
+    } for r in batch.itertuples(index=False)]
+    # 并发任务可能在查询之后写入同一哈希，交给唯一索引兜底
+    result = db.session.connection().execute(insert_ignore(NewsCache), rows)
+    if new_marks:
+        _save_watermarks(new_marks, known_marks or {})
+    db.session.commit()
+    inserted = result.rowcount if result.rowcount >= 0 else len(rows)
+    return inserted, [r["content_hash"] for r in rows]
+
+
+def ingest_news(codes: Optional[List[str]] = None, fetcher: Optional[NewsFetcher] = None) -> IngestStats:
+    """抓取并入库新闻，默认覆盖所有用户自选股（需在 app context 中调用）"""
+    if codes is None:
+        codes = db.session.scalars(db.select(UserStock.code).distinct()).all()
+    fetcher = fetcher or NewsFetcher()
+    stats = IngestStats(codes=len(codes))
+
+    marks = _load_watermarks(codes)
+    new_ids: List[int] = []
+    subscribers: Set[int] = set()
+    pending: List[pd.DataFrame] = []
+    pending_marks: Dict[str, Watermark] = {}
+    pending_rows = 0
+
+    def flush():
+        nonlocal pending_rows
+        try:
+            inserted, hashes = _store_news_batch(pending, pending_marks, marks)
+            stats.rows_inserted += inserted
+            marks.update(pending_marks)
+        except Exception as exc:  # noqa: BLE001
+            db.session.rollback()
+            app.logger.error(f"新闻批量入库失败（{pending_rows} 条）: {exc}")
+            hashes = []
+        if hashes:
+            new_ids.extend(_after_insert(hashes, subscribers))
+        pending.clear()
+        pending_marks.clear()
+        pending_rows = 0
+
+    for result in fetcher.fetch_many(codes):
+        if result.df is None:
+            stats.codes_failed += 1
+            app.logger.error(f"抓取失败 {result.code}（尝试 {result.attempts} 次）: {result.error}")
+            continue
+        stats.rows_fetched += len(result.df)
+        fresh = apply_watermark(result.code, result.df, marks.get(result.code))
+        stats.rows_skipped += len(result.df) - len(fresh)
+        if fresh.empty:
+            continue
+        newest = fresh.loc[fresh["publish_time"].idxmax()]
+        pending_marks[result.code] = (newest["publish_time"].to_pydatetime(), newest["content_hash"])
+        pending.append(fresh)
+        pending_rows += len(fresh)
+        if pending_rows >= INSERT_BATCH:
+            flush()
+    if pending:
+        flush()
+
+    app.logger.info(stats.finish().summary())
+    # 整轮结束后统一失效一次 /api/news 响应缓存，而不是每个入库批次各失效一次
+    try:
+        news_feed.invalidate_responses(subscribers)
+    except Exception as exc:  # noqa: BLE001
+        app.logger.error(f"失效新闻响应缓存失败: {exc}")
+
+    # 新入库的新闻交给情感分析阶段（异步扇出，不阻塞抓取）
+    if new_ids:
+        try:
+            news_sentiment.dispatch_scoring(new_ids)
+        except Exception as exc:  # noqa: BLE001
+            app.logger.error(f"提交情感分析任务失败: {exc}")
+    return stats
@@ -0,0 +1,97 @@
+# news_sentiment.py
+"""
+新闻情感分析阶段
+
+新闻入库后按批扇出为 Celery 任务（group + chord 汇总），每个任务用批量模式
+调用 DeepSeek 并把结论写回 news_cache。接口和推送直接读取预先算好的结论，
+请求路径上没有 LLM 调用。
+
+多轮重试后仍为「未知」的新闻 sentiment 保持为空，由定时任务 rescore_unscored()
+补扫最近一段时间内的这些新闻，重新扇出分析。
+"""
+
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from celery import chord
+from flask import current_app as app
+
+import news_feed
+from ai_utils import NEWS_CONCLUSIONS, analyze_financial_news_batch
+from models import db, NewsCache
+
+TASK_SIZE = int(os.getenv("SENTIMENT_TASK_SIZE", 40))  # 每个任务处理的新闻条数
+RESCORE_HOURS = int(os.getenv("SENTIMENT_RESCORE_HOURS", 24))  # 只补扫最近这么久发布的新闻
+RESCORE_MIN_AGE = timedelta(minutes=10)  # 刚入库的新闻还在首轮分析中，不重复提交
+RESCORE_LIMIT = int(os.getenv("SENTIMENT_RESCORE_LIMIT", 400))  # 每轮最多补扫条数
+
+
+def news_text(n: NewsCache) -> str:
+    return f"{n.title}\n{n.content or ''}".strip()
+
+
+def score_news(news_ids: List[int]) -> Dict:
+    """分析尚无结论的新闻并写回（需在 app context 中调用）
+
+    结论合并进订阅用户的 feed；返回值中的 users 交给 finish_scoring 统一失效响应缓存。
+    """
+    rows = NewsCache.query.filter(NewsCache.id.in_(news_ids), NewsCache.sentiment.is_(None)).all()
+    if not rows:
+        return {"scored": 0, "failed": 0, "users": []}
+
+    verdicts = analyze_financial_news_batch([news_text(n) for n in rows])
+    scored = []
+    for n, verdict in zip(rows, verdicts):
+        if verdict["conclusion"] in NEWS_CONCLUSIONS:
+            n.sentiment = verdict["conclusion"]
+            n.sentiment_reason = verdict["reason"]
+            scored.append(n)
+    db.session.commit()
+
+    users = set()
+    try:
+        users = news_feed.fan_out(scored)
+    except Exception as exc:  # noqa: BLE001
+        app.logger.error(f"更新用户新闻流失败: {exc}")
+    return {"scored": len(scored), "failed": len(rows) - len(scored), "users": sorted(users)}
+
+
+def finish_scoring(results: List[Dict]) -> Dict[str, int]:
+    """一轮情感分析全部完成后：汇总结果，统一失效一次订阅用户的 /api/news 响应缓存"""
+    scored = sum(r["scored"] for r in results)
+    failed = sum(r["failed"] for r in results)
+    news_feed.invalidate_responses(u for r in results for u in r.get("users", ()))
+    app.logger.info(f"情感分析完成: 成功 {scored} 条，失败 {failed} 条")
+    return {"scored": scored, "failed": failed}
+
+
+def dispatch_scoring(news_ids: List[int]) -> None:
+    """按 TASK_SIZE 分组扇出到 Celery；未配置 broker 时在当前进程内顺序执行"""
+    chunks = [news_ids[i:i + TASK_SIZE] for i in range(0, len(news_ids), TASK_SIZE)]
+    celery = app.extensions.get("celery")
+    if celery is None or not celery.conf.broker_url:
+        finish_scoring([score_news(chunk) for chunk in chunks])
+        return
+    header = [celery.signature("app.score_news_sentiment", args=(chunk,)) for chunk in chunks]
+    chord(header)(celery.signature("app.finish_news_sentiment"))
+    app.logger.info(f"已提交情感分析任务: {len(news_ids)} 条新闻，{len(chunks)} 个任务")
+
+
+def rescore_unscored() -> int:
+    """补扫最近发布、入库已久却仍无结论的新闻（需在 app context 中调用），返回提交条数"""
+    now = datetime.now()
+    rows = (db.session.query(NewsCache.id)
+            .filter(NewsCache.sentiment.is_(None),
+                    NewsCache.publish_time >= now - timedelta(hours=RESCORE_HOURS),
+                    NewsCache.created_at <= now - RESCORE_MIN_AGE)
+            .order_by(NewsCache.publish_time.desc())
+            .limit(RESCORE_LIMIT)
+            .all())
+    news_ids = [news_id for (news_id,) in rows]
+    if news_ids:
+        app.logger.info(f"补扫无结论的新闻: {len(news_ids)} 条")
+        dispatch_scoring(news_ids)
+    return len(news_ids)
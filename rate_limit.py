@@ -0,0 +1,62 @@
+# rate_limit.py
+"""
+限流与退避工具
+
+- RateLimiter：线程安全的令牌桶，按数据源共享（同一进程内）
+- backoff_delay：带抖动的指数退避时长
+"""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from typing import Dict
+
+
+class RateLimiter:
+    """令牌桶限流器：平均 rate 次/秒，允许 burst 次突发"""
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """尝试取一个令牌，返回还需等待的秒数（0 表示已取到）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        """阻塞直到取得令牌"""
+        while True:
+            wait = self._take()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(source: str, rate: float, burst: int | None = None) -> RateLimiter:
+    """按数据源名称取进程内共享的限流器（首次调用时创建）"""
+    with _limiters_lock:
+        limiter = _limiters.get(source)
+        if limiter is None:
+            limiter = _limiters[source] = RateLimiter(rate, burst)
+        return limiter
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """第 attempt 次重试（从 0 开始）的等待时长：指数增长 + full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
@@ -0,0 +1,101 @@
+# response_cache.py
+"""
+按用户缓存只读接口的响应
+
+- 缓存键 = 接口 + 用户 + 查询参数 + 该接口依赖的数据版本号
+- 写操作调用 invalidate(user_id, scope) 更换版本号，旧缓存随之失效（无需逐条删除）
+- 响应带强 ETag，客户端带 If-None-Match 且内容未变时返回 304、不带响应体
+
+命中时既不查数据库也不重新序列化，304 只有响应头。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import uuid
+from functools import wraps
+from typing import Iterable, List
+
+from flask import Response, make_response, request
+from flask_jwt_extended import get_jwt_identity
+
+from cache_utils import shared_store
+
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 300))
+VERSION_TTL = 7 * 24 * 3600
+CACHED_HEADERS = ("Content-Type", "X-Next-Cursor")
+
+# 数据范围：写操作按范围失效
+STOCKS, NEWS, USER = "stocks", "news", "user"
+
+
+def _version_key(scope: str, user_id) -> str:
+    return f"resp_ver:{scope}:{user_id}"
+
+
+def _versions(user_id, scopes: Iterable[str]) -> List[str]:
+    """读取各范围的版本号；不存在时写入一个新的随机版本
+
+    版本号用随机值而不是从 0 开始的计数器：版本键过期或被淘汰后
+    不会回到某个旧值，命中此前缓存的过期响应。
+    """
+    versions = []
+    for scope in scopes:
+        key = _version_key(scope, user_id)
+        version = shared_store.get(key)
+        if version is None:
+            shared_store.add(key, uuid.uuid4().hex[:12], ttl=VERSION_TTL)
+            version = shared_store.get(key)
+        versions.append(version)
+    return versions
+
+
+def current_version(user_id, scope: str) -> str:
+    """该用户某个数据范围的当前版本号，供其他模块判断数据是否变更"""
+    return _versions(user_id, (scope,))[0]
+
+
+def invalidate(user_id, *scopes: str) -> None:
+    """数据变更后调用，使该用户依赖这些范围的缓存响应失效"""
+    for scope in scopes:
+        shared_store.set(_version_key(scope, user_id), uuid.uuid4().hex[:12], ttl=VERSION_TTL)
+
+
+def _not_modified(etag: str) -> Response:
+    resp = Response(status=304)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def cached_response(*scopes: str):
+    """缓存 200 响应；需放在 @jwt_required() 之后（内层）"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user_id = get_jwt_identity()
+            query = hashlib.md5(request.query_string).hexdigest()[:12]
+            key = f"resp:{view.__name__}:{user_id}:{query}:{'.'.join(_versions(user_id, scopes))}"
+
+            entry = shared_store.get_json(key)
+            if entry is None:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+                body = resp.get_data(as_text=True)
+                entry = {
+                    "etag": hashlib.sha256(body.encode()).hexdigest()[:32],
+                    "body": body,
+                    "headers": {h: resp.headers[h] for h in CACHED_HEADERS if h in resp.headers},
+                }
+                shared_store.set_json(key, entry, ttl=RESPONSE_CACHE_TTL)
+
+            if request.if_none_match.contains(entry["etag"]):
+                return _not_modified(entry["etag"])
+            resp = Response(entry["body"], headers=entry["headers"])
+            resp.set_etag(entry["etag"])
+            resp.headers["Cache-Control"] = "private, no-cache"
+            return resp
+        return wrapper
+    return decorator
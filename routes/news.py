@@ -1,11 +1,15 @@
-from flask import Blueprint, jsonify, current_app as app
+from flask import Blueprint, jsonify, request, current_app as app
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from collections import defaultdict
 from datetime import datetime, timedelta
-import hashlib
-import requests
-import akshare as ak
+import heapq
+import time
 
 from models import db, User, UserStock, NewsCache
+from news_ingest import ingest_news
+import news_feed
+from response_cache import NEWS, cached_response
+from wechat_push import PushDispatcher, PushMessage
 
 # 创建蓝图
 news_bp = Blueprint('news', __name__, url_prefix='/api')
@@ -13,86 +17,103 @@ news_bp = Blueprint('news', __name__, url_prefix='/api')
 # 新闻接口
 @news_bp.route('/news')
 @jwt_required()
+@cached_response(NEWS)
 def get_news():
     user_id = get_jwt_identity()
-    user_stocks = [s.code for s in UserStock.query.filter_by(user_id=user_id).all()]
+    cursor = request.args.get('cursor')
     
-    news = NewsCache.query.filter(
-        NewsCache.stock_code.in_(user_stocks),
-        NewsCache.publish_time > datetime.now() - timedelta(days=1)
-    ).order_by(NewsCache.publish_time.desc()).limit(20)
+    # 读取物化的用户新闻流；首页只看最近一天，带游标时继续向前翻
+    try:
+        news = news_feed.page(
+            user_id,
+            limit=20,
+            cursor=cursor,
+            since=None if cursor else datetime.now() - timedelta(days=1),
+        )
+    except ValueError:
+        return jsonify({'code': 400, 'msg': '无效的cursor参数'}), 400
     
-    return jsonify([{
-        'title': n.title,
-        'time': n.publish_time.strftime('%Y-%m-%d %H:%M'),
-        'code': n.stock_code
+    resp = jsonify([{
+        'id': n['id'],
+        'title': n['title'],
+        'time': datetime.fromtimestamp(n['ts']).strftime('%Y-%m-%d %H:%M'),
+        'code': n['code'],
+        'sentiment': n.get('sentiment'),
+        'reason': n.get('reason')
     } for n in news])
+    if len(news) == 20:
+        resp.headers['X-Next-Cursor'] = news_feed.encode_cursor(news[-1])
+    return resp
 
 # 抓取新闻任务（不是路由但与新闻相关）
 def daily_news_job():
     """每日新闻抓取任务"""
-    all_codes = db.session.query(UserStock.code).distinct().all()
-    
-    for code in all_codes:
-        try:
-            df = ak.stock_news_em(symbol=code)
-            for _, row in df.iterrows():
-                content_hash = hashlib.md5(row['内容'].encode()).hexdigest()
-                if NewsCache.query.filter_by(content_hash=content_hash).first():
-                    continue
-                
-                news = NewsCache(
-                    stock_code=code,
-                    title=row['标题'],
-                    content_hash=content_hash,
-                    publish_time=datetime.strptime(row['发布时间'], '%Y-%m-%d %H:%M:%S')
-                )
-                db.session.add(news)
-            db.session.commit()
-        except Exception as e:
-            app.logger.error(f"抓取失败 {code}: {str(e)}")
+    # 并发抓取所有自选股的新闻并入库
+    ingest_news()
     
     # 触发推送
     send_push_notifications()
 
 def send_push_notifications():
     """发送微信推送"""
-    users = User.query.all()
-    for user in users:
-        stocks = UserStock.query.filter_by(user_id=user.id).all()
-        if not stocks:
-            continue
-        
-        # 获取最新5条新闻
-        news = NewsCache.query.filter(
-            NewsCache.stock_code.in_([s.code for s in stocks]),
-            NewsCache.publish_time > datetime.now() - timedelta(hours=12)
-        ).order_by(NewsCache.publish_time.desc()).limit(5)
+    # 最近12小时的新闻只查一次，按股票分组，每只股票只保留最新5条
+    window = NewsCache.query.filter(
+        NewsCache.publish_time > datetime.now() - timedelta(hours=12)
+    ).order_by(NewsCache.publish_time.desc()).all()
+    news_by_code = defaultdict(list)
+    for n in window:
+        if len(news_by_code[n.stock_code]) < 5:
+            news_by_code[n.stock_code].append(n)
+    
+    # 股票 -> 订阅用户 倒排：只查有新闻的股票，分块 IN 查询
+    codes = list(news_by_code)
+    user_codes = defaultdict(list)
+    openids = {}
+    for i in range(0, len(codes), 1000):
+        rows = db.session.query(UserStock.user_id, User.openid, UserStock.code).join(
+            User, User.id == UserStock.user_id
+        ).filter(UserStock.code.in_(codes[i:i + 1000])).all()
+        for user_id, openid, code in rows:
+            user_codes[user_id].append(code)
+            openids[user_id] = openid
+    
+    messages = []
+    for user_id, user_code_list in user_codes.items():
+        # 在内存中合并该用户各自选股的新闻，取最新5条
+        news = heapq.nlargest(5, (n for c in user_code_list for n in news_by_code[c]),
+                              key=lambda n: n.publish_time)
         
         # 构造消息内容
-        content = "\n".join([f"▪️ {n.title}" for n in news])
-        
-        # 调用微信接口
-        access_token = get_wechat_token()
-        requests.post(
-            'https://api.weixin.qq.com/cgi-bin/message/subscribe/send',
-            json={
-                "touser": user.openid,
-                "template_id": app.config['WECHAT_TEMPLATE_ID'],
-                "data": {
-                    "thing1": {"value": "今日股票资讯更新"},
-                    "time2": {"value": datetime.now().strftime("%H:%M")},
-                    "thing3": {"value": content[:20] + "..."}
-                }
-            }
+        content = "\n".join([f"▪️ {f'【{n.sentiment}】' if n.sentiment else ''}{n.title}" for n in news])
+        messages.append(PushMessage(openid=openids[user_id], data={
+            "thing1": {"value": "今日股票资讯更新"},
+            "time2": {"value": datetime.now().strftime("%H:%M")},
+            "thing3": {"value": content[:20] + "..."}
+        }))
+    
+    # 复用 token 与连接，并发发送
+    start_time = time.perf_counter()
+    results = _get_dispatcher().send_many(messages)
+    failed = [r for r in results if not r.ok]
+    app.logger.info(f"微信推送完成: 共 {len(results)} 条，失败 {len(failed)} 条，"
+                    f"耗时 {time.perf_counter() - start_time:.2f}秒")
+    for r in failed[:20]:
+        app.logger.warning(f"推送失败 {r.openid[:5]}...: errcode={r.errcode}, errmsg={r.errmsg}")
+    return results
+
+_dispatcher = None
+
+def _get_dispatcher() -> PushDispatcher:
+    """进程内复用同一个推送器（连接池、token 缓存）"""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = PushDispatcher(
+            appid=app.config['WECHAT_APPID'],
+            secret=app.config['WECHAT_SECRET'],
+            template_id=app.config['WECHAT_TEMPLATE_ID'],
         )
+    return _dispatcher
 
 def get_wechat_token():
-    """获取微信 access_token"""
-    params = {
-        'grant_type': 'client_credential',
-        'appid': app.config['WECHAT_APPID'],
-        'secret': app.config['WECHAT_SECRET']
-    }
-    res = requests.get('https://api.weixin.qq.com/cgi-bin/token', params=params, timeout=5)
-    return res.json().get('access_token')
+    """获取微信 access_token（跨进程缓存，过期前自动刷新）"""
+    return _get_dispatcher().tokens.get()
@@ -1,17 +1,30 @@
 from flask import Blueprint, jsonify, request, current_app as app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import akshare as ak
 import time
+from datetime import datetime
 
-from models import db, UserStock
-from ai_utils import extract_stocks_from_base64
+from models import db, insert_ignore, User, UserStock
+from image_import import (
+    DONE, FAILED, RETRY_AFTER, ImageImportError, get_job, is_finished, pop_pending, recognize,
+    save_pending, submit_job,
+)
+import indicators
+from kline_store import DAILY, PERIODS, kline_store
+import market_snapshot
+from news_feed import invalidate_feed, watchlist_codes_stmt
+from response_cache import NEWS, STOCKS, USER, cached_response, invalidate
+from stock_index import normalize_code, symbol_index
 
 # 创建蓝图
 stock_bp = Blueprint('stock', __name__, url_prefix='/api')
 
+MAX_ADD_BATCH = 1000  # 单次添加上限（批量写入，一条语句完成）
+MAX_KLINE_BARS = 5000  # 单次返回的 K 线上限
+
 # 股票管理接口
 @stock_bp.route('/stocks/get', methods=['GET'])
 @jwt_required()
+@cached_response(STOCKS)
 def get_stocks():
     """获取当前用户的所有自选股票"""
     try:
@@ -33,6 +46,84 @@ def get_stocks():
         app.logger.error(f"获取股票失败: {str(e)}")
         return jsonify({'code': 500, 'msg': f'服务器内部错误: {str(e)}'}), 500
 
+@stock_bp.route('/stocks/quotes', methods=['GET'])
+@jwt_required()
+def get_quotes():
+    """获取自选股实时行情（从全市场快照中按代码切片，不访问上游）"""
+    try:
+        user_id = get_jwt_identity()
+        codes = db.session.execute(watchlist_codes_stmt(user_id)).scalars().all()
+
+        # 未配置 broker 时没有定时刷新，由请求方按需刷新
+        celery = app.extensions.get('celery')
+        snap = market_snapshot.get_snapshot(refresh_inline=celery is None or not celery.conf.broker_url)
+        if snap is None:
+            return jsonify({'code': 503, 'msg': '行情数据暂不可用，请稍后再试'}), 503
+
+        return jsonify({
+            'code': 0,
+            'data': {
+                'quotes': snap.quotes(codes),
+                'updated_at': datetime.fromtimestamp(snap.ts).strftime('%Y-%m-%d %H:%M:%S'),
+                'trading': market_snapshot.is_trading_time()
+            }
+        })
+    except Exception as e:
+        app.logger.error(f"获取行情失败: {str(e)}")
+        return jsonify({'code': 500, 'msg': f'服务器内部错误: {str(e)}'}), 500
+
+@stock_bp.route('/stocks/kline', methods=['GET'])
+@jwt_required()
+def get_kline():
+    """读取本地 K 线（列式存储，按时间区间切片，不访问上游）"""
+    try:
+        code = normalize_code(request.args.get('code', ''))
+        period = request.args.get('period', DAILY)
+        limit = min(int(request.args.get('limit', 500)), MAX_KLINE_BARS)
+        if not (code.isdigit() and len(code) == 6):
+            return jsonify({'code': 400, 'msg': '无效的股票代码'}), 400
+        if period not in PERIODS:
+            return jsonify({'code': 400, 'msg': f'period 只支持 {"/".join(PERIODS)}'}), 400
+        try:
+            bars = kline_store.read(period, code, request.args.get('start') or None, request.args.get('end') or None)
+        except ValueError:
+            return jsonify({'code': 400, 'msg': '无效的时间参数'}), 400
+        if bars is None:
+            return jsonify({'code': 404, 'msg': '暂无该股票的K线数据'}), 404
+
+        bars = bars.slice(max(0, len(bars) - limit), len(bars))  # 区间过长时取最近的 limit 根
+        return jsonify({
+            'code': 0,
+            'data': {
+                'code': code,
+                'period': period,
+                'count': len(bars),
+                'bars': bars.to_dict('%Y-%m-%d' if period == DAILY else '%Y-%m-%d %H:%M')
+            }
+        })
+    except Exception as e:
+        app.logger.error(f"获取K线失败: {str(e)}")
+        return jsonify({'code': 500, 'msg': f'服务器内部错误: {str(e)}'}), 500
+
+@stock_bp.route('/stocks/indicators', methods=['GET'])
+@jwt_required()
+def get_indicators():
+    """获取自选股的技术指标（最近一个交易日，日线）"""
+    try:
+        user_id = get_jwt_identity()
+        codes = db.session.execute(watchlist_codes_stmt(user_id)).scalars().all()
+        result = indicators.get_indicators(codes)
+        return jsonify({
+            'code': 0,
+            'data': {
+                'date': result['date'],
+                'indicators': [{'code': c, **v} for c, v in result['values'].items()]
+            }
+        })
+    except Exception as e:
+        app.logger.error(f"获取技术指标失败: {str(e)}")
+        return jsonify({'code': 500, 'msg': f'服务器内部错误: {str(e)}'}), 500
+
 @stock_bp.route('/stocks/add', methods=['POST'])
 @jwt_required()
 def add_stocks():
@@ -44,89 +135,47 @@ def add_stocks():
         if not data or 'stocks' not in data or not isinstance(data['stocks'], list):
             return jsonify({'code': 400, 'msg': '请求格式错误，需要提供stocks列表'}), 400
             
-        if len(data['stocks']) > 20:
-            return jsonify({'code': 400, 'msg': '单次最多添加20只股票'}), 400
-        
-        # 当前用户已有的股票代码集合
-        existing_codes = {s.code for s in UserStock.query.filter_by(user_id=user_id).all()}
+        if len(data['stocks']) > MAX_ADD_BATCH:
+            return jsonify({'code': 400, 'msg': f'单次最多添加{MAX_ADD_BATCH}只股票'}), 400
         
         added_stocks = []
         error_stocks = []
         
-        for stock in data['stocks']:
-            # 跳过已添加的股票
-            if stock['code'] in existing_codes:
-                error_stocks.append({
-                    'code': stock['code'],
-                    'reason': '已在自选列表中'
-                })
+        # 一次性批量校验代码并解析名称：只查本地代码表，
+        # 未知代码由代码表在后台刷新，本次请求不等待上游
+        requested_codes = [normalize_code(stock.get('code', '')) for stock in data['stocks']]
+        known_names = symbol_index.resolve_names(
+            [c for c in requested_codes if c.isdigit() and len(c) == 6])
+        
+        rows = {}
+        for stock, stock_code in zip(data['stocks'], requested_codes):
+            if not (stock_code.isdigit() and len(stock_code) == 6):
+                error_stocks.append({'code': stock_code, 'reason': '无效的股票代码'})
                 continue
-                
-            # 验证股票代码有效性并获取名称
-            try:
-                stock_name = stock.get('name', '')  # 优先使用传入的名称
-                stock_code = stock['code']
-                
-                # 如果没有传入名称，尝试从akshare获取
-                if not stock_name:
-                    app.logger.debug(f"尝试获取股票 {stock_code} 的信息")
-                    stock_info = ak.stock_individual_info_em(symbol=stock_code)
-                    
-                    # 调试输出数据结构
-                    app.logger.debug(f"股票信息类型: {type(stock_info)}")
-                    app.logger.debug(f"股票信息是否为空: {stock_info.empty}")
-                    
-                    if not stock_info.empty:
-                        # 输出列名以便调试
-                        app.logger.debug(f"股票信息列名: {stock_info.columns.tolist()}")
-                        
-                        # 安全地获取股票名称
-                        if '股票简称' in stock_info.columns:
-                            stock_name = stock_info.iloc[0]['股票简称']
-                        elif '证券简称' in stock_info.columns:
-                            stock_name = stock_info.iloc[0]['证券简称']
-                        elif '名称' in stock_info.columns:
-                            stock_name = stock_info.iloc[0]['名称']
-                        else:
-                            # 如果找不到名称，使用第一列的值
-                            first_col = stock_info.columns[0]
-                            app.logger.warning(f"未找到股票名称列，使用第一列 '{first_col}' 的值")
-                            stock_name = str(stock_info.iloc[0][first_col])
-                    else:
-                        error_stocks.append({
-                            'code': stock_code,
-                            'reason': '无效的股票代码'
-                        })
-                        continue
-                
-                # 如果仍然没有名称，使用代码作为名称
-                if not stock_name:
-                    app.logger.warning(f"无法获取股票 {stock_code} 的名称，使用代码作为名称")
-                    stock_name = f"股票{stock_code}"
-
-                # 添加自选股
-                app.logger.info(f"添加股票: 代码={stock_code}, 名称={stock_name}")
-                new_stock = UserStock(
-                    user_id=user_id,
-                    code=stock_code,
-                    name=stock_name
-                )
-                db.session.add(new_stock)
-                added_stocks.append({
-                    'code': stock_code,
-                    'name': stock_name
-                })
-                existing_codes.add(stock_code)  # 更新集合，防止本次请求中重复添加
-                
-            except Exception as e:
-                app.logger.error(f"添加股票 {stock['code']} 时发生错误: {str(e)}")
-                app.logger.exception(e)  # 记录完整堆栈
-                error_stocks.append({
-                    'code': stock['code'],
-                    'reason': f'处理异常: {str(e)}'
-                })
+            if stock_code in rows:
+                error_stocks.append({'code': stock_code, 'reason': '请求中重复'})
+                continue
+            # 优先使用传入的名称；代码表不可用时仅接受带名称的股票
+            stock_name = stock.get('name') or known_names.get(stock_code, '')
+            if stock_code not in known_names and (symbol_index.ready or not stock_name):
+                reason = '代码表更新中，请稍后重试' if symbol_index.refreshing else '无效的股票代码'
+                error_stocks.append({'code': stock_code, 'reason': reason})
+                continue
+            rows[stock_code] = {'user_id': user_id, 'code': stock_code, 'name': stock_name}
+        
+        # 一条多行 insert-or-ignore 写入，(user_id, code) 唯一约束保证并发添加也不会重复
+        inserted = _insert_user_stocks(user_id, list(rows.values()))
+        for stock_code, row in rows.items():
+            if stock_code in inserted:
+                added_stocks.append({'code': stock_code, 'name': row['name']})
+            else:
+                error_stocks.append({'code': stock_code, 'reason': '已在自选列表中'})
         
         db.session.commit()
+        if added_stocks:
+            app.logger.info(f"用户 {user_id} 添加 {len(added_stocks)} 只股票")
+            invalidate_feed(user_id)
+            invalidate(user_id, STOCKS, NEWS, USER)
         
         return jsonify({
             'code': 0,
@@ -142,6 +191,26 @@ def add_stocks():
         app.logger.exception(e)
         return jsonify({'code': 500, 'msg': f'服务器内部错误: {str(e)}'}), 500
 
+def _insert_user_stocks(user_id, rows):
+    """批量写入自选股，返回实际插入（此前不存在）的代码集合"""
+    if not rows:
+        return set()
+    stmt = insert_ignore(UserStock)
+    conn = db.session.connection()
+    if db.engine.dialect.insert_returning:
+        return set(conn.execute(stmt.returning(UserStock.code), rows).scalars())
+    # 不支持 RETURNING 的数据库（MySQL）：先查已存在的，其余视为本次插入。
+    # 先锁住用户行，同一用户的并发添加在此串行，查询与插入之间不会插进别的写入
+    db.session.execute(db.select(User.id).where(User.id == user_id).with_for_update())
+    existing = set(db.session.scalars(db.select(UserStock.code).where(
+        UserStock.user_id == user_id, UserStock.code.in_([r['code'] for r in rows])
+    )))
+    to_insert = [r for r in rows if r['code'] not in existing]
+    if not to_insert:
+        return set()  # 空参数列表会被编译成 INSERT ... () VALUES ()
+    conn.execute(stmt, to_insert)
+    return {r['code'] for r in to_insert}
+
 @stock_bp.route('/stocks/remove', methods=['POST'])
 @jwt_required()
 def remove_stocks():
@@ -170,6 +239,9 @@ def remove_stocks():
             db.session.delete(stock)
             
         db.session.commit()
+        if deleted_ids:
+            invalidate_feed(user_id)
+            invalidate(user_id, STOCKS, NEWS, USER)
         
         # 返回已删除的ID和数量
         return jsonify({
@@ -205,99 +277,71 @@ def add_stocks_from_image():
         # 获取base64图片数据
         image_base64 = data.get('image')
         app.logger.info(f"接收到图片数据，长度: {len(image_base64)}, 前20字符: {image_base64[:20]}...")
-        
-        # 检查base64格式
-        if "base64," in image_base64:
-            app.logger.debug(f"检测到Data URL格式，将提取纯base64部分")
-            prefix = image_base64.split("base64,")[0]
-            app.logger.debug(f"图片前缀: {prefix}")
-        
+
+        # 异步模式：登记任务后立即返回，OCR 和提取在 Celery worker 中进行
+        if data.get('async'):
+            job = submit_job(user_id, image_base64)
+            app.logger.info(f"已提交图片识别任务: {job['job_id']}")
+            return _job_response(job)
+
         try:
-            # 使用AI工具提取股票信息
-            app.logger.debug("开始调用OCR服务提取股票信息...")
-            stock_items = extract_stocks_from_base64(image_base64)
-            app.logger.debug(f"OCR服务返回原始结果: {stock_items}")
-            
-            if not stock_items:
-                app.logger.warning("OCR服务未能识别出任何股票信息")
-                return jsonify({'code': 400, 'msg': '未从图片中识别出任何股票信息'}), 400
-                
-            app.logger.info(f"从图片中识别出 {len(stock_items)} 只股票: {stock_items}")
-            
-            # 解析识别结果，格式为："股票名称 股票代码"
-            stocks_to_add = []
-            rejected_items = []
-            
-            app.logger.debug("开始解析股票信息...")
-            for i, item in enumerate(stock_items):
-                app.logger.debug(f"处理第{i+1}项: '{item}'")
-                parts = item.strip().split()
-                app.logger.debug(f"拆分后: {parts}")
-                
-                if len(parts) >= 2:  # 确保至少有名称和代码两部分
-                    # 取最后一项作为代码，其余的合并为名称
-                    code = parts[-1]
-                    name = ' '.join(parts[:-1])
-                    app.logger.debug(f"提取到名称: '{name}', 代码: '{code}'")
-                    
-                    # 验证代码格式（6位数字）
-                    if code.isdigit() and len(code) == 6:
-                        stocks_to_add.append({
-                            'code': code,
-                            'name': name
-                        })
-                        app.logger.debug(f"有效股票: {name} {code}")
-                    else:
-                        app.logger.warning(f"无效股票代码格式: {code}")
-                        rejected_items.append({
-                            'item': item,
-                            'reason': '无效股票代码格式'
-                        })
-                else:
-                    app.logger.warning(f"项目格式不正确: {item}")
-                    rejected_items.append({
-                        'item': item,
-                        'reason': '格式不符合"名称 代码"'
-                    })
-            
-            if not stocks_to_add:
-                app.logger.warning(f"未能解析出有效股票信息，被拒绝的项: {rejected_items}")
-                return jsonify({
-                    'code': 400, 
-                    'msg': '未能正确解析出股票信息，请确保图片清晰',
-                    'detail': rejected_items
-                }), 400
-                
-            # 构造批量添加请求，调用已有的add_stocks逻辑
-            add_request = {'stocks': stocks_to_add}
-            app.logger.info(f"准备添加 {len(stocks_to_add)} 只股票: {stocks_to_add}")
-            
-            # 将股票添加请求暂存到session中
-            session_key = f"pending_stocks_{user_id}"
-            app.config[session_key] = add_request
-            app.logger.debug(f"已将股票数据存入会话: {session_key}")
-            
-            # 返回预览信息，让用户确认
-            return jsonify({
-                'code': 0,
-                'msg': f'成功识别出{len(stocks_to_add)}只股票',
-                'data': {
-                    'stocks': stocks_to_add,
-                    'total': len(stocks_to_add),
-                    'rejected': rejected_items if rejected_items else None
-                }
-            })
-            
+            result = recognize(image_base64)
+        except ImageImportError as e:
+            app.logger.warning(f"图片识别无结果: {e}, 详情: {e.detail}")
+            resp = {'code': 400, 'msg': str(e)}
+            if e.detail:
+                resp['detail'] = e.detail
+            return jsonify(resp), 400
         except Exception as ocr_error:
             app.logger.error(f"图片识别处理失败: {str(ocr_error)}")
             app.logger.exception(ocr_error)  # 记录完整异常堆栈
             return jsonify({'code': 500, 'msg': f'图片处理失败: {str(ocr_error)}'}), 500
-            
+
+        save_pending(user_id, result['stocks'])
+        # 返回预览信息，让用户确认
+        return jsonify({
+            'code': 0,
+            'msg': f'成功识别出{result["total"]}只股票',
+            'data': result
+        })
+
     except Exception as e:
         app.logger.error(f"添加股票图片处理失败: {str(e)}")
         app.logger.exception(e)  # 记录完整异常堆栈
         return jsonify({'code': 500, 'msg': f'服务器内部错误: {str(e)}'}), 500
 
+# 图片识别任务
+def _job_payload(job):
+    payload = {'job_id': job['job_id'], 'status': job['status']}
+    if job['status'] == DONE:
+        payload.update(job['result'])
+    elif job['status'] == FAILED:
+        payload.update(msg=job.get('msg'), detail=job.get('detail'))
+    return payload
+
+def _job_response(job):
+    """任务未结束时返回 202 + Retry-After，由客户端稍后再查，服务端不阻塞等待"""
+    resp = jsonify({'code': 0, 'data': _job_payload(job)})
+    if not is_finished(job):
+        resp.status_code = 202
+        resp.headers['Retry-After'] = str(RETRY_AFTER)
+    return resp
+
+@stock_bp.route('/stocks/image_jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_image_job(job_id):
+    """查询图片识别任务状态"""
+    try:
+        user_id = get_jwt_identity()
+        job = get_job(job_id)
+        if job is None or job['user_id'] != str(user_id):
+            return jsonify({'code': 404, 'msg': '任务不存在或已过期'}), 404
+        return _job_response(job)
+
+    except Exception as e:
+        app.logger.error(f"查询图片识别任务失败: {str(e)}")
+        return jsonify({'code': 500, 'msg': f'服务器内部错误: {str(e)}'}), 500
+
 @stock_bp.route('/stocks/confirm_from_image', methods=['POST'])
 @jwt_required()
 def confirm_stocks_from_image():
@@ -306,17 +350,12 @@ def confirm_stocks_from_image():
         user_id = get_jwt_identity()
         app.logger.debug(f"用户 {user_id} 确认添加图片识别的股票")
         
-        # 从session获取暂存的股票数据
-        session_key = f"pending_stocks_{user_id}"
-        app.logger.debug(f"查找会话键: {session_key}")
-        
-        if session_key not in app.config:
-            app.logger.warning(f"未找到会话数据: {session_key}")
+        # 从共享存储中原子取出暂存的股票列表（任一 worker 均可取到）
+        add_request = pop_pending(user_id)
+        if add_request is None:
+            app.logger.warning(f"未找到用户 {user_id} 待确认的股票数据")
             return jsonify({'code': 400, 'msg': '没有待确认的股票数据，请重新上传图片'}), 400
-            
-        # 获取暂存的股票列表并清除session
-        add_request = app.config.pop(session_key)
-        app.logger.info(f"从会话中取出待添加股票: {add_request}")
+        app.logger.info(f"取出待添加股票: {add_request}")
         
         # 使用已有的批量添加接口处理
         app.logger.debug("修改请求体，准备调用添加股票接口")
@@ -348,117 +387,27 @@ def search_stocks():
             
         app.logger.info(f"搜索股票，关键词: {keyword}, 限制: {limit}")
         
-        try:
-            # 使用akshare获取A股列表
-            app.logger.debug("开始从akshare获取股票数据...")
-            start_time = time.time()
-            
-            # 尝试使用ak接口获取A股列表
-            try:
-                # 优先尝试使用股票列表接口
-                stock_list = ak.stock_zh_a_spot_em()
-                app.logger.debug(f"获取A股列表成功，数据量: {len(stock_list)}")
-                
-                # 检查返回的列
-                columns = stock_list.columns.tolist()
-                app.logger.debug(f"股票列表字段: {columns}")
-                
-                # 确定名称和代码的列名
-                name_col = next((col for col in ['名称', '股票名称', '证券名称'] if col in columns), '名称')
-                code_col = next((col for col in ['代码', '股票代码', '证券代码'] if col in columns), '代码')
-                
-                app.logger.debug(f"使用列: 名称={name_col}, 代码={code_col}")
-                
-            except Exception as ak_error:
-                app.logger.error(f"使用ak.stock_zh_a_spot_em失败: {str(ak_error)}")
-                app.logger.warning("尝试备用接口...")
-                
-                # 备用接口
-                try:
-                    stock_list = ak.stock_info_a_code_name()
-                    app.logger.debug(f"使用备用接口成功，数据量: {len(stock_list)}")
-                    
-                    # 检查返回的列
-                    columns = stock_list.columns.tolist()
-                    app.logger.debug(f"备用接口股票列表字段: {columns}")
-                    
-                    # 备用接口的列名可能不同
-                    name_col = columns[1] if len(columns) > 1 else '股票简称'
-                    code_col = columns[0] if len(columns) > 0 else '股票代码'
-                    
-                    app.logger.debug(f"使用备用列: 名称={name_col}, 代码={code_col}")
-                    
-                except Exception as backup_error:
-                    app.logger.error(f"备用接口也失败: {str(backup_error)}")
-                    return jsonify({
-                        'code': 500,
-                        'msg': '获取股票列表失败，请稍后再试'
-                    }), 500
-            
-            end_time = time.time()
-            app.logger.debug(f"获取股票列表耗时: {end_time - start_time:.2f}秒")
-            
-            # 确保列名存在
-            if name_col not in stock_list.columns or code_col not in stock_list.columns:
-                app.logger.error(f"数据列错误: 期望{name_col}和{code_col}，实际有{stock_list.columns.tolist()}")
-                return jsonify({
-                    'code': 500,
-                    'msg': '股票数据格式异常，无法搜索'
-                }), 500
-            
-            # 进行模糊匹配
-            app.logger.debug("开始过滤匹配的股票...")
-            # 转换为大小写不敏感
-            keyword_lower = keyword.lower()
-            
-            # 筛选匹配项
-            matched_stocks = []
-            
-            # 确保字符串类型比较
-            stock_list[name_col] = stock_list[name_col].astype(str)
-            stock_list[code_col] = stock_list[code_col].astype(str)
-            
-            for _, row in stock_list.iterrows():
-                name = row[name_col]
-                code = row[code_col]
-                
-                # 移除代码中的可能前缀
-                if '.' in code:
-                    code = code.split('.')[0]
-                
-                # 如果关键词在名称或代码中出现
-                if (keyword_lower in name.lower() or 
-                    keyword_lower in code.lower() or 
-                    code.startswith(keyword)):
-                    
-                    matched_stocks.append({
-                        'code': code,
-                        'name': name
-                    })
-                    
-                    # 达到限制数量后停止
-                    if len(matched_stocks) >= limit:
-                        break
-            
-            app.logger.info(f"搜索结果: 找到{matched_stocks}个匹配项")
-
-            
-            return jsonify({
-                'code': 0,
-                'data': {
-                    'stocks': matched_stocks,
-                    'total': len(matched_stocks),
-                    'keyword': keyword
-                }
-            })
-            
-        except Exception as search_error:
-            app.logger.error(f"搜索处理异常: {str(search_error)}")
-            app.logger.exception(search_error)
+        # 在进程内常驻的代码表索引上搜索，不再每次请求拉取全市场数据
+        if not symbol_index.ready:
+            app.logger.error("股票代码表尚未加载，无法搜索")
             return jsonify({
-                'code': 500,
-                'msg': f'搜索处理失败: {str(search_error)}'
-            }), 500
+                'code': 503,
+                'msg': '获取股票列表失败，请稍后再试'
+            }), 503
+        
+        start_time = time.perf_counter()
+        matched_stocks = [s.to_dict() for s in symbol_index.search(keyword, limit)]
+        app.logger.debug(f"搜索耗时: {(time.perf_counter() - start_time) * 1000:.3f}毫秒")
+        app.logger.info(f"搜索结果: 找到{len(matched_stocks)}个匹配项")
+        
+        return jsonify({
+            'code': 0,
+            'data': {
+                'stocks': matched_stocks,
+                'total': len(matched_stocks),
+                'keyword': keyword
+            }
+        })
             
     except Exception as e:
         app.logger.error(f"股票搜索接口异常: {str(e)}")
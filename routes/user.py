@@ -4,6 +4,7 @@ import requests
 from datetime import datetime, timedelta
 
 from models import db, User, UserStock
+from response_cache import USER, cached_response
 
 # 创建蓝图
 user_bp = Blueprint('user', __name__, url_prefix='/api')
@@ -134,6 +135,7 @@ def login():
 # 用户信息接口 - 获取当前登录用户的信息
 @user_bp.route('/user/info', methods=['GET'])
 @jwt_required()
+@cached_response(USER)
 def get_user_info():
     try:
         # 获取当前登录用户ID
@@ -1 +1,3 @@
+python migrations.py || exit 1
+python stream_server.py &
 gunicorn -w 4 -b 0.0.0.0:9999 app:app
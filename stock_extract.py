@@ -0,0 +1,143 @@
+# stock_extract.py
+"""
+从 OCR 识别行中提取股票（本地规则）
+
+- 6 位代码：正则匹配，且必须在 A 股代码表中；有名称的行里只认紧挨着名称的数字，
+  其余 6 位数字（成交量、成交额等数值列）不当作代码
+- 股票名称：代码表名称的多模式匹配（Aho-Corasick）
+- 同一行或相邻行里名称与代码互相印证时可信度最高
+
+结果附带置信度；置信度不足（有无法解释的代码、名称与代码冲突、
+疑似股票名却匹配不上等）时由调用方交给 LLM 兜底。
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from stock_index import Symbol, normalize_name, symbol_index
+
+MIN_CONFIDENCE = float(os.getenv("STOCK_EXTRACT_MIN_CONFIDENCE", 0.8))
+
+# 各类证据的可信度权重
+WEIGHT_CONFIRMED = 1.0  # 名称与代码互相印证
+WEIGHT_CODE_ONLY = 0.9
+WEIGHT_NAME_ONLY = 0.85
+
+CODE_RE = re.compile(r"(?<![\d.])(?:sh|sz|bj)?(\d{6})(?![\d.])", re.IGNORECASE)
+PERCENT_RE = re.compile(r"[+-]?\d+(?:\.\d+)?%")
+# 名称与代码之间只隔着空白 / 括号 / 分隔符时视为紧挨着（NFKC 后全角符号已转为半角）
+GAP_RE = re.compile(r"[\s()\[\]【】:,/|\-]*")
+# 疑似股票名：3~8 个汉字，可带 *ST / ST 前缀和 A/B 后缀
+NAME_LIKE_RE = re.compile(r"\*?(?:st)?[一-鿿]{3,8}[ab]?")
+# 行情软件界面上常见、与个股无关的词
+UI_WORDS = {
+    "自选股", "最新价", "涨跌幅", "涨跌额", "成交量", "成交额", "换手率", "总市值", "流通市值",
+    "市盈率", "市净率", "上证指数", "深证成指", "创业板指", "科创50", "沪深300", "北证50",
+    "我的自选", "全部分组", "编辑自选", "持仓股", "港股通", "沪股通", "深股通", "融资融券",
+}
+
+
+@dataclass
+class ExtractResult:
+    stocks: List[Symbol] = field(default_factory=list)
+    confidence: float = 0.0
+    confirmed: int = 0
+    code_only: int = 0
+    name_only: int = 0
+    unexplained: int = 0  # 无法解释的代码 / 名称，以及名称与代码冲突
+
+    def lines(self) -> List[str]:
+        """与 LLM 约定的输出格式一致："股票名称 股票代码" """
+        return [f"{s.name} {s.code}" for s in self.stocks]
+
+
+def _scan_line(line: str) -> Tuple[List[Tuple[int, str, bool]], List[Tuple[int, Symbol]], int]:
+    """返回 (代码命中 [(位置, 代码, 是否紧挨名称)], 名称命中 [(位置, Symbol)], 未能解释的疑似名称数)
+
+    代码在保留空白的文本上匹配（避免与相邻数字粘连），名称在去空白的文本上匹配，
+    再换算回原文位置判断两者是否相邻。
+    """
+    spaced = unicodedata.normalize("NFKC", line).lower()
+    offsets = [i for i, ch in enumerate(spaced) if not ch.isspace()]  # 去空白后的下标 -> 原文下标
+    hits = symbol_index.find_names(normalize_name(line))
+    names = [(start, sym) for start, _, sym in hits]
+    spans = [(offsets[start], offsets[end - 1] + 1) for start, end, _ in hits]
+
+    def beside(m: re.Match) -> bool:
+        return any(GAP_RE.fullmatch(spaced[e:m.start()] if e <= m.start() else spaced[m.end():s])
+                   for s, e in spans)
+
+    codes = [(m.start(), m.group(1), beside(m)) for m in CODE_RE.finditer(spaced)]
+    suspects = 0
+    if not names:
+        suspects = sum(1 for w in NAME_LIKE_RE.findall(spaced) if w not in UI_WORDS)
+    return codes, names, suspects
+
+
+def _neighbours(i: int, n: int) -> range:
+    return range(max(i - 1, 0), min(i + 2, n))
+
+
+def extract_stocks(text_lines: List[str]) -> ExtractResult:
+    """按行扫描代码与名称并配对；代码表未加载时返回置信度 0 的空结果"""
+    result = ExtractResult()
+    if not symbol_index.ready:
+        return result
+
+    scanned = [_scan_line(line) for line in text_lines]
+    n = len(text_lines)
+    near_codes = [  # 相邻三行内出现的名称所对应的代码
+        {sym.code for j in _neighbours(i, n) for _, sym in scanned[j][1]} for i in range(n)
+    ]
+
+    # 代码 -> (出现位置, Symbol, 证据类型)
+    found: Dict[str, Tuple[Tuple[int, int], Symbol, str]] = {}
+    for i, (codes, names, _) in enumerate(scanned):
+        for pos, code, beside in codes:
+            if names and not beside:
+                continue  # 有名称的行里离名称较远的数字：成交量等数值列
+            sym = symbol_index.get(code)
+            if sym is None:
+                if beside:
+                    result.unexplained += 1  # 名称旁的代码不在代码表中，多半是 OCR 识别错了
+                continue  # 否则只是碰巧 6 位的数字
+            kind = "confirmed" if code in near_codes[i] else "code"
+            if code not in found:
+                found[code] = ((i, pos), sym, kind)
+            elif kind == "confirmed":
+                found[code] = (found[code][0], sym, kind)
+
+    for i, (_, names, suspects) in enumerate(scanned):
+        for pos, sym in names:
+            found.setdefault(sym.code, ((i, pos), sym, "name"))
+        if suspects and any(PERCENT_RE.search(text_lines[j]) for j in _neighbours(i, n)):
+            result.unexplained += suspects
+
+    # 相邻行上各自落单的名称和代码互相矛盾（多半是代码某一位识别错了），两者都不采信
+    loose = [(pos[0], code, kind) for code, (pos, _, kind) in found.items() if kind != "confirmed"]
+    for i, code, kind in loose:
+        if kind != "code" or code not in found:
+            continue
+        conflicts = [c for j, c, k in loose if k == "name" and abs(j - i) <= 1 and c in found]
+        if conflicts:
+            for c in [code] + conflicts:
+                del found[c]
+            result.unexplained += 1
+
+    counts = {"confirmed": 0, "code": 0, "name": 0}
+    for _, sym, kind in sorted(found.values(), key=lambda v: v[0]):
+        result.stocks.append(sym)
+        counts[kind] += 1
+    result.confirmed, result.code_only, result.name_only = counts["confirmed"], counts["code"], counts["name"]
+
+    total = len(result.stocks) + result.unexplained
+    if total:
+        score = (WEIGHT_CONFIRMED * result.confirmed + WEIGHT_CODE_ONLY * result.code_only
+                 + WEIGHT_NAME_ONLY * result.name_only)
+        result.confidence = round(score / total, 3)
+    return result
@@ -0,0 +1,406 @@
+# stock_index.py
+"""
+A 股代码表（symbol master）
+
+进程级常驻：首次使用时加载（优先读本地快照，其次拉取上游），
+之后由后台线程定期刷新。搜索走内存中的前缀 / n-gram 索引，
+不依赖上游可用性。
+"""
+
+from __future__ import annotations
+
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import akshare as ak
+
+try:  # 拼音首字母为可选能力
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # pragma: no cover
+    lazy_pinyin = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.getenv(
+    "STOCK_INDEX_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "stock_symbols.json"),
+)
+REFRESH_INTERVAL = int(os.getenv("STOCK_INDEX_REFRESH_SECONDS", 6 * 3600))
+RETRY_INTERVAL = 300  # 刷新失败后的重试间隔（秒）
+FORCE_REFRESH_INTERVAL = 60  # 遇到未知代码时后台刷新的最小间隔（秒）
+
+
+# --------------------------------------------------------------------------- #
+# 工具函数
+# --------------------------------------------------------------------------- #
+def normalize_code(raw: str) -> str:
+    """去掉 sh/sz/bj 前缀或 .SH/.SZ 后缀，返回纯代码"""
+    code = str(raw).strip().lower()
+    if "." in code:
+        head, tail = code.split(".", 1)
+        code = tail if head in ("sh", "sz", "bj") else head
+    if code[:2] in ("sh", "sz", "bj"):
+        code = code[2:]
+    return code
+
+
+def exchange_of(code: str) -> str:
+    """根据代码段推断交易所"""
+    if code.startswith(("60", "68", "90")):
+        return "SH"
+    if code.startswith(("00", "30", "20")):
+        return "SZ"
+    if code.startswith(("4", "8", "92")):
+        return "BJ"
+    return ""
+
+
+def pinyin_initials(name: str) -> str:
+    """名称的拼音首字母（小写），如 贵州茅台 -> gzmt"""
+    if lazy_pinyin is None:
+        return ""
+    letters = lazy_pinyin(name, style=Style.FIRST_LETTER, errors="default")
+    return "".join(letters).lower().replace(" ", "")
+
+
+def normalize_name(text: str) -> str:
+    """名称匹配用的规范化：全角转半角、转小写、去空白（OCR 常在字间插空格）"""
+    return "".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+@dataclass(frozen=True)
+class Symbol:
+    code: str
+    name: str
+    exchange: str
+    initials: str
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"code": self.code, "name": self.name, "exchange": self.exchange}
+
+
+# --------------------------------------------------------------------------- #
+# 名称多模式匹配（Aho-Corasick）
+# --------------------------------------------------------------------------- #
+class NameMatcher:
+    """在一段文本中一次扫描找出所有出现的股票名称"""
+
+    def __init__(self, patterns: Dict[str, int]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[int] = [-1]  # 以该节点结尾的模式的 symbol 下标
+        self._depth: List[int] = [0]
+        self._link: List[int] = [0]  # 沿 fail 链最近的有输出节点（0 表示没有）
+        for pattern, value in patterns.items():
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(-1)
+                    self._depth.append(self._depth[node] + 1)
+                    self._link.append(0)
+                node = nxt
+            self._out[node] = value
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                fail = self._fail[nxt]
+                self._link[nxt] = fail if self._out[fail] >= 0 else self._link[fail]
+                queue.append(nxt)
+
+    def find(self, text: str) -> List[Tuple[int, int, int]]:
+        """返回不重叠的 (起点, 终点, symbol 下标)，重叠时取最左、最长"""
+        hits = []
+        node = 0
+        for end, ch in enumerate(text, 1):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            hit = node if self._out[node] >= 0 else self._link[node]
+            while hit:
+                hits.append((end - self._depth[hit], end, self._out[hit]))
+                hit = self._link[hit]
+        hits.sort(key=lambda h: (h[0], h[0] - h[1]))
+        chosen, last_end = [], 0
+        for start, end, value in hits:
+            if start >= last_end:
+                chosen.append((start, end, value))
+                last_end = end
+        return chosen
+
+
+# --------------------------------------------------------------------------- #
+# 索引快照（构建后只读，整体替换，读路径无需加锁）
+# --------------------------------------------------------------------------- #
+@dataclass
+class _Snapshot:
+    symbols: List[Symbol]
+    loaded_at: float
+    by_code: Dict[str, int] = field(default_factory=dict)
+    by_name: Dict[str, int] = field(default_factory=dict)
+    code_prefix: Dict[str, List[int]] = field(default_factory=dict)
+    initials_prefix: Dict[str, List[int]] = field(default_factory=dict)
+    name_bigram: Dict[str, List[int]] = field(default_factory=dict)
+    _matcher: Optional[NameMatcher] = field(default=None, repr=False)
+
+    @classmethod
+    def build(cls, symbols: List[Symbol], loaded_at: float | None = None) -> "_Snapshot":
+        snap = cls(symbols=symbols, loaded_at=loaded_at or time.time())
+        for i, s in enumerate(symbols):
+            snap.by_code[s.code] = i
+            snap.by_name.setdefault(s.name.lower(), i)
+            for n in range(1, len(s.code) + 1):
+                snap.code_prefix.setdefault(s.code[:n], []).append(i)
+            for n in range(1, len(s.initials) + 1):
+                snap.initials_prefix.setdefault(s.initials[:n], []).append(i)
+            name = s.name.lower()
+            for gram in {name[j:j + 2] for j in range(len(name) - 1)}:
+                snap.name_bigram.setdefault(gram, []).append(i)
+        return snap
+
+    def name_matcher(self) -> NameMatcher:
+        """按需构建（并发时重复构建一次无妨，结果相同）"""
+        if self._matcher is None:
+            patterns: Dict[str, int] = {}
+            for i, s in enumerate(self.symbols):
+                key = normalize_name(s.name)
+                if len(key) >= 2:
+                    patterns.setdefault(key, i)
+            self._matcher = NameMatcher(patterns)
+        return self._matcher
+
+    def _name_candidates(self, kw: str) -> List[int]:
+        """名称包含 kw 的候选：bigram 倒排求交后再做子串校验"""
+        if len(kw) < 2:
+            return [i for i, s in enumerate(self.symbols) if kw in s.name.lower()]
+        grams = {kw[j:j + 2] for j in range(len(kw) - 1)}
+        postings = sorted((self.name_bigram.get(g, []) for g in grams), key=len)
+        if not postings[0]:
+            return []
+        ids = set(postings[0])
+        for p in postings[1:]:
+            ids.intersection_update(p)
+            if not ids:
+                return []
+        return [i for i in ids if kw in self.symbols[i].name.lower()]
+
+    def search(self, keyword: str, limit: int) -> List[Symbol]:
+        kw = keyword.strip().lower()
+        if not kw:
+            return []
+        code_kw = normalize_code(kw)
+        # 分数越小越靠前
+        scores: Dict[int, int] = {}
+
+        def hit(ids, score):
+            for i in ids:
+                if score < scores.get(i, 99):
+                    scores[i] = score
+
+        if code_kw.isdigit():
+            if code_kw in self.by_code:
+                hit([self.by_code[code_kw]], 0)
+            hit(self.code_prefix.get(code_kw, []), 2)
+        if kw in self.by_name:
+            hit([self.by_name[kw]], 1)
+        for i in self._name_candidates(kw):
+            hit([i], 3 if self.symbols[i].name.lower().startswith(kw) else 5)
+        if kw.isascii() and kw.isalpha():
+            hit(self.initials_prefix.get(kw, []), 4)
+
+        best = heapq.nsmallest(limit, scores.items(), key=lambda kv: (kv[1], self.symbols[kv[0]].code))
+        return [self.symbols[i] for i, _ in best]
+
+
+# --------------------------------------------------------------------------- #
+# 代码表
+# --------------------------------------------------------------------------- #
+class SymbolIndex:
+    """进程级股票代码表，线程安全"""
+
+    def __init__(self, snapshot_path: str = SNAPSHOT_PATH, refresh_interval: int = REFRESH_INTERVAL):
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self._snap: Optional[_Snapshot] = None
+        self._load_lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+        self._last_forced = 0.0
+        self._forcing = False  # 后台刷新进行中
+
+    # ---- 数据源 ------------------------------------------------------------ #
+    @staticmethod
+    def _fetch_upstream() -> List[Tuple[str, str]]:
+        """从 akshare 拉取 (代码, 名称) 列表，主接口失败时用备用接口"""
+        try:
+            df = ak.stock_info_a_code_name()
+            columns = df.columns.tolist()
+            code_col = next((c for c in ["code", "代码", "股票代码", "证券代码"] if c in columns), columns[0])
+            name_col = next((c for c in ["name", "名称", "股票简称", "证券简称"] if c in columns), columns[1])
+        except Exception as exc:  # noqa: BLE001
+            logger.warning(f"stock_info_a_code_name 失败，改用 stock_zh_a_spot_em: {exc}")
+            df = ak.stock_zh_a_spot_em()
+            code_col, name_col = "代码", "名称"
+        codes = df[code_col].astype(str).map(normalize_code).tolist()
+        names = df[name_col].astype(str).str.strip().tolist()
+        return [(c, n) for c, n in zip(codes, names) if c and n]
+
+    @staticmethod
+    def _make_symbols(pairs: List[Tuple[str, str]]) -> List[Symbol]:
+        return [Symbol(code, name, exchange_of(code), pinyin_initials(name)) for code, name in pairs]
+
+    def _read_snapshot_file(self) -> Optional[_Snapshot]:
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        symbols = [Symbol(*row) for row in data.get("symbols", [])]
+        if not symbols:
+            return None
+        return _Snapshot.build(symbols, data.get("loaded_at"))
+
+    def _write_snapshot_file(self, snap: _Snapshot) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            tmp = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({
+                    "loaded_at": snap.loaded_at,
+                    "symbols": [[s.code, s.name, s.exchange, s.initials] for s in snap.symbols],
+                }, f, ensure_ascii=False)
+            os.replace(tmp, self.snapshot_path)
+        except OSError as exc:
+            logger.warning(f"写入股票代码表快照失败: {exc}")
+
+    # ---- 加载 / 刷新 -------------------------------------------------------- #
+    def refresh(self) -> bool:
+        """从上游刷新代码表，成功返回 True；失败时保留旧数据"""
+        try:
+            start = time.time()
+            pairs = self._fetch_upstream()
+            if not pairs:
+                raise ValueError("上游返回空列表")
+            snap = _Snapshot.build(self._make_symbols(pairs))
+        except Exception as exc:  # noqa: BLE001
+            logger.error(f"刷新股票代码表失败: {exc}")
+            return False
+        self._snap = snap
+        self._write_snapshot_file(snap)
+        logger.info(f"股票代码表已刷新: {len(snap.symbols)} 只, 耗时 {time.time() - start:.2f}秒")
+        return True
+
+    def _refresh_loop(self) -> None:
+        while True:
+            snap = self._snap
+            age = time.time() - snap.loaded_at if snap else self.refresh_interval
+            time.sleep(max(self.refresh_interval - age, 0))
+            if not self.refresh():
+                time.sleep(RETRY_INTERVAL)
+
+    def _ensure_loaded(self) -> Optional[_Snapshot]:
+        snap = self._snap
+        if snap is not None or self._refresher is not None:
+            # 已加载，或首次加载失败后交由后台线程重试，请求路径不再访问上游
+            return snap
+        with self._load_lock:
+            if self._snap is None and self._refresher is None:
+                self._snap = self._read_snapshot_file()
+                if self._snap is None:
+                    self.refresh()
+            if self._refresher is None:
+                # 惰性启动，保证 gunicorn fork 之后每个 worker 各自拥有刷新线程
+                self._refresher = threading.Thread(
+                    target=self._refresh_loop, name="symbol-index-refresh", daemon=True
+                )
+                self._refresher.start()
+        return self._snap
+
+    # ---- 查询 -------------------------------------------------------------- #
+    @property
+    def ready(self) -> bool:
+        return self._ensure_loaded() is not None
+
+    def search(self, keyword: str, limit: int = 10) -> List[Symbol]:
+        """按代码 / 名称 / 拼音首字母搜索，返回按相关度排序的前 limit 条"""
+        snap = self._ensure_loaded()
+        if snap is None:
+            return []
+        return snap.search(keyword, limit)
+
+    def get(self, code: str) -> Optional[Symbol]:
+        snap = self._ensure_loaded()
+        if snap is None:
+            return None
+        i = snap.by_code.get(normalize_code(code))
+        return snap.symbols[i] if i is not None else None
+
+    def find_names(self, text: str) -> List[Tuple[int, int, Symbol]]:
+        """找出文本中出现的股票名称，text 需先经 normalize_name 处理"""
+        snap = self._ensure_loaded()
+        if snap is None:
+            return []
+        return [(start, end, snap.symbols[i]) for start, end, i in snap.name_matcher().find(text)]
+
+    def resolve_names(self, codes: List[str]) -> Dict[str, str]:
+        """批量解析 代码 -> 名称，返回值只包含代码表中的代码
+
+        只查本地代码表，不在调用方的请求里访问上游；有未知代码时（如新股上市）
+        在后台刷新一次代码表（有最小间隔限制），稍后重试即可解析。
+        """
+        wanted = {normalize_code(c) for c in codes}
+        found = self._lookup_names(self._ensure_loaded(), wanted)
+        if wanted - found.keys():
+            self._force_refresh()
+        return found
+
+    @property
+    def refreshing(self) -> bool:
+        """未知代码触发的后台刷新是否正在进行"""
+        return self._forcing
+
+    @staticmethod
+    def _lookup_names(snap: Optional[_Snapshot], codes) -> Dict[str, str]:
+        if snap is None:
+            return {}
+        return {c: snap.symbols[snap.by_code[c]].name for c in codes if c in snap.by_code}
+
+    def _force_refresh(self) -> bool:
+        """启动一次后台刷新，返回是否启动（距上次不足最小间隔或正在刷新时不启动）"""
+        with self._load_lock:
+            now = time.time()
+            if self._forcing or now - self._last_forced < FORCE_REFRESH_INTERVAL:
+                return False
+            self._last_forced = now
+            self._forcing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._forcing = False
+
+        threading.Thread(target=run, name="symbol-index-force-refresh", daemon=True).start()
+        return True
+
+
+# 进程内单例
+symbol_index = SymbolIndex()
@@ -0,0 +1,328 @@
+# stream_server.py
+"""
+行情 / 新闻推送（Server-Sent Events）
+
+独立的 aiohttp 进程，单线程事件循环挂住全部长连接，不为每个客户端占用线程：
+- GET /api/stream：鉴权后按用户自选股订阅，返回 text/event-stream
+- 进程内唯一的分发器轮询上游（全市场行情快照、NewsCache 新增行），
+  与上一轮比较，只把变化通过「代码 -> 连接」索引推给订阅了该代码的连接
+- 客户端数量只影响推送的写出量，不影响上游调用次数
+
+事件：
+- quotes：自选股中发生变化的行情（连接建立时先推一次全量）
+- news：新入库的自选股新闻，字段与 /api/news 相同
+- 每 HEARTBEAT 秒一条注释行保活，同时检查自选股是否变更并重新订阅
+
+运行：python stream_server.py（默认端口 9998，由反向代理转发 /api/stream）
+单进程即可支撑数万空闲连接，需保证进程的文件描述符上限（ulimit -n）足够。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
+from aiohttp import web
+from flask_jwt_extended import decode_token
+
+import market_snapshot
+from app import app as flask_app
+from models import db, NewsCache
+from news_feed import watchlist_codes_stmt
+from response_cache import STOCKS, current_version
+
+logger = logging.getLogger(__name__)
+
+STREAM_PORT = int(os.getenv("STREAM_PORT", 9998))
+NEWS_POLL_INTERVAL = float(os.getenv("STREAM_NEWS_POLL_SECONDS", 5))
+HEARTBEAT = 20  # 保活与自选股变更检查间隔（秒）
+QUEUE_SIZE = 64  # 单连接待发送消息上限，写不出去的慢连接直接断开，由客户端重连
+NEWS_BATCH = 500
+
+
+def _event(name: str, payload: bytes, event_id: Optional[int] = None) -> bytes:
+    head = f"event: {name}\n" + (f"id: {event_id}\n" if event_id is not None else "")
+    return head.encode() + b"data: " + payload + b"\n\n"
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+# --------------------------------------------------------------------------- #
+# 连接与订阅索引
+# --------------------------------------------------------------------------- #
+class Client:
+    __slots__ = ("user_id", "codes", "version", "queue", "closed")
+
+    def __init__(self, user_id: str, codes: Set[str], version: Optional[str]):
+        self.user_id = user_id
+        self.codes = codes
+        self.version = version
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.closed = False  # 连接已结束并移出索引，之后不得再加入
+
+    def send(self, message: Optional[bytes]) -> None:
+        """入队待写出；队列满说明客户端读得太慢，断开它"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self) -> None:
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class Hub:
+    def __init__(self):
+        self.by_code: Dict[str, Set[Client]] = defaultdict(set)
+        self.by_user: Dict[str, Set[Client]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return sum(len(c) for c in self.by_user.values())
+
+    def add(self, client: Client) -> None:
+        self.by_user[client.user_id].add(client)
+        for code in client.codes:
+            self.by_code[code].add(client)
+
+    def remove(self, client: Client) -> None:
+        self._discard(self.by_user, client.user_id, client)
+        for code in client.codes:
+            self._discard(self.by_code, code, client)
+
+    def resubscribe(self, client: Client, codes: Set[str]) -> None:
+        if client.closed:
+            return
+        self.remove(client)
+        client.codes = codes
+        self.add(client)
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[Client]], key: str, client: Client) -> None:
+        clients = index.get(key)
+        if clients is not None:
+            clients.discard(client)
+            if not clients:
+                del index[key]
+
+
+# --------------------------------------------------------------------------- #
+# 分发器
+# --------------------------------------------------------------------------- #
+def _in_app(fn, *args):
+    """在线程池中带 app context 执行同步的数据库 / 存储访问"""
+    def run():
+        with flask_app.app_context():
+            try:
+                return fn(*args)
+            finally:
+                db.session.remove()
+    return asyncio.get_running_loop().run_in_executor(None, run)
+
+
+def _load_codes(user_id: str) -> Set[str]:
+    return set(db.session.scalars(watchlist_codes_stmt(user_id)))
+
+
+def _watchlist_versions(user_ids: List[str]) -> Dict[str, str]:
+    """自选股版本号（增删自选股时由 response_cache 更换），用来发现订阅变更"""
+    return {u: current_version(u, STOCKS) for u in user_ids}
+
+
+def _max_news_id() -> int:
+    return db.session.scalar(db.select(db.func.max(NewsCache.id))) or 0
+
+
+def _news_after(last_id: int) -> List[NewsCache]:
+    rows = NewsCache.query.filter(NewsCache.id > last_id).order_by(NewsCache.id).limit(NEWS_BATCH).all()
+    db.session.expunge_all()
+    return rows
+
+
+class Dispatcher:
+    def __init__(self, hub: Hub):
+        self.hub = hub
+        self.snapshot: Optional[market_snapshot.Snapshot] = None
+        self.last_news_id = 0
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self.snapshot = await asyncio.get_running_loop().run_in_executor(None, market_snapshot.get_snapshot)
+        self.last_news_id = await _in_app(_max_news_id)
+        self._tasks = [asyncio.create_task(self._loop(self.poll_quotes, market_snapshot.POLL_INTERVAL)),
+                       asyncio.create_task(self._loop(self.poll_news, NEWS_POLL_INTERVAL)),
+                       asyncio.create_task(self._loop(self.heartbeat, HEARTBEAT))]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @staticmethod
+    async def _loop(step, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await step()
+            except Exception as exc:  # noqa: BLE001
+                logger.exception(f"推送分发失败: {exc}")
+
+    # ---- 行情 ---------------------------------------------------------------- #
+    def initial_quotes(self, client: Client) -> Optional[bytes]:
+        if self.snapshot is None or not client.codes:
+            return None
+        return _event("quotes", _dumps(self.snapshot.quotes(sorted(client.codes))))
+
+    async def poll_quotes(self) -> None:
+        snap = await asyncio.get_running_loop().run_in_executor(None, market_snapshot.get_snapshot)
+        prev = self.snapshot
+        if snap is None or (prev is not None and snap.ts == prev.ts):
+            return
+        self.snapshot = snap
+        if prev is None:
+            return
+
+        # 只比较有人订阅的代码；每个变化的行情只编码一次，各连接共享
+        changed: Dict[str, bytes] = {}
+        for code in self.hub.by_code:
+            row = snap.rows.get(code)
+            if row is not None and row != prev.rows.get(code):
+                changed[code] = _dumps(snap.quote(code))
+        if not changed:
+            return
+
+        pending: Dict[Client, List[bytes]] = defaultdict(list)
+        for code, payload in changed.items():
+            for client in self.hub.by_code.get(code, ()):
+                pending[client].append(payload)
+        for client, parts in pending.items():
+            client.send(_event("quotes", b"[" + b",".join(parts) + b"]"))
+
+    # ---- 新闻 ---------------------------------------------------------------- #
+    async def poll_news(self) -> None:
+        rows = await _in_app(_news_after, self.last_news_id)
+        if not rows:
+            return
+        self.last_news_id = rows[-1].id
+        for n in rows:
+            clients = self.hub.by_code.get(n.stock_code)
+            if not clients:
+                continue
+            message = _event("news", _dumps({
+                "id": n.id,
+                "title": n.title,
+                "time": n.publish_time.strftime("%Y-%m-%d %H:%M"),
+                "code": n.stock_code,
+                "sentiment": n.sentiment,
+                "reason": n.sentiment_reason,
+            }), event_id=n.id)
+            for client in list(clients):
+                client.send(message)
+
+    # ---- 保活 / 自选股变更 ---------------------------------------------------- #
+    async def heartbeat(self) -> None:
+        users = list(self.hub.by_user)
+        versions = await _in_app(_watchlist_versions, users)
+        for user_id in users:
+            clients = self.hub.by_user.get(user_id, ())
+            stale = [c for c in clients if c.version != versions[user_id]]
+            if stale:
+                codes = await _in_app(_load_codes, user_id)
+                # 等待查询期间可能有连接断开，只处理仍然在线的
+                for client in (c for c in stale if not c.closed):
+                    client.version = versions[user_id]
+                    self.hub.resubscribe(client, codes)
+                    message = self.initial_quotes(client)
+                    if message is not None:
+                        client.send(message)
+            for client in list(clients):
+                client.send(b": ping\n\n")
+
+
+# --------------------------------------------------------------------------- #
+# HTTP
+# --------------------------------------------------------------------------- #
+def _authenticate(request: web.Request) -> Optional[str]:
+    """Authorization: Bearer <jwt>，或 ?token=（浏览器 EventSource 不能设置请求头）"""
+    auth = request.headers.get("Authorization", "")
+    token = auth[7:] if auth.startswith("Bearer ") else request.query.get("token")
+    if not token:
+        return None
+    try:
+        with flask_app.app_context():
+            return str(decode_token(token)["sub"])
+    except Exception:  # noqa: BLE001
+        return None
+
+
+async def stream(request: web.Request) -> web.StreamResponse:
+    user_id = _authenticate(request)
+    if user_id is None:
+        return web.json_response({"code": 401, "msg": "未登录或登录已过期"}, status=401)
+
+    hub: Hub = request.app["hub"]
+    dispatcher: Dispatcher = request.app["dispatcher"]
+    version = await _in_app(current_version, user_id, STOCKS)
+    client = Client(user_id, await _in_app(_load_codes, user_id), version)
+
+    resp = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # 关闭 nginx 缓冲
+    })
+    await resp.prepare(request)
+    hub.add(client)
+    try:
+        await resp.write(b"retry: 3000\n\n")
+        message = dispatcher.initial_quotes(client)
+        if message is not None:
+            await resp.write(message)
+        while True:
+            message = await client.queue.get()
+            if message is None:
+                break
+            await resp.write(message)
+    except ConnectionResetError:
+        pass
+    finally:
+        client.closed = True
+        hub.remove(client)
+    return resp
+
+
+async def stream_status(request: web.Request) -> web.Response:
+    hub: Hub = request.app["hub"]
+    return web.json_response({"code": 0, "data": {"connections": len(hub), "codes": len(hub.by_code)}})
+
+
+def create_app() -> web.Application:
+    application = web.Application()
+    application["hub"] = hub = Hub()
+    application["dispatcher"] = dispatcher = Dispatcher(hub)
+
+    async def on_startup(_):
+        await dispatcher.start()
+
+    async def on_shutdown(_):
+        for clients in list(hub.by_user.values()):
+            for client in list(clients):
+                client.close()
+        await dispatcher.stop()
+
+    application.on_startup.append(on_startup)
+    application.on_shutdown.append(on_shutdown)
+    application.router.add_get("/api/stream", stream)
+    application.router.add_get("/api/stream/status", stream_status)
+    return application
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    web.run_app(create_app(), port=STREAM_PORT)
@@ -0,0 +1,140 @@
+# tests/test_indicators.py
+"""
+技术指标引擎的正确性：
+- compute_panel + evaluate 与 pandas 的 ewm / rolling 参考实现一致
+- advance 增量推进的结果与追加 K 线后的全量重算一致
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import indicators  # noqa: E402
+from indicators import (  # noqa: E402
+    BOLL_K, BOLL_WINDOW, DEA_SPAN, EMA_FAST, EMA_SLOW, MA_WINDOWS, RSI_WINDOWS, VOL_RATIO_WINDOW,
+)
+from kline_store import COLUMNS, DAILY, KLineStore  # noqa: E402
+
+DAY = 86400
+T0 = 1_600_000_000 // DAY * DAY
+
+
+def _random_bars(rng, n):
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    volume = rng.uniform(1e5, 1e6, n)
+    return close, volume
+
+
+def _reference(close: pd.Series, volume: pd.Series) -> dict:
+    """pandas 参考实现，取最后一根的值"""
+    out = {f"ma{w}": close.rolling(w).mean() for w in MA_WINDOWS}
+    out["ema12"] = close.ewm(span=EMA_FAST, adjust=False).mean()
+    out["ema26"] = close.ewm(span=EMA_SLOW, adjust=False).mean()
+    out["macd_dif"] = out["ema12"] - out["ema26"]
+    out["macd_dea"] = out["macd_dif"].ewm(span=DEA_SPAN, adjust=False).mean()
+    out["macd_hist"] = 2 * (out["macd_dif"] - out["macd_dea"])
+    diff = close.diff()
+    for n in RSI_WINDOWS:
+        out[f"rsi{n}"] = pd.Series([_wilder_rsi(diff, n)])
+    out["boll_mid"] = close.rolling(BOLL_WINDOW).mean()
+    std = close.rolling(BOLL_WINDOW).std(ddof=0)
+    out["boll_upper"] = out["boll_mid"] + BOLL_K * std
+    out["boll_lower"] = out["boll_mid"] - BOLL_K * std
+    out["vol_ratio"] = volume / volume.shift(1).rolling(VOL_RATIO_WINDOW).mean()
+    return {k: v.iloc[-1] for k, v in out.items()}
+
+
+def _wilder_rsi(diff: pd.Series, n: int) -> float:
+    """前 n 个涨跌幅的简单平均作初值，之后按 alpha = 1/n 做 Wilder 平滑"""
+    diff = diff.iloc[1:]
+    if len(diff) < n:
+        return np.nan
+    up, down = diff.clip(lower=0), (-diff).clip(lower=0)
+    gain = pd.concat([pd.Series([up.iloc[:n].mean()]), up.iloc[n:]]).ewm(alpha=1 / n, adjust=False).mean()
+    loss = pd.concat([pd.Series([down.iloc[:n].mean()]), down.iloc[n:]]).ewm(alpha=1 / n, adjust=False).mean()
+    total = gain.iloc[-1] + loss.iloc[-1]
+    return 100 * gain.iloc[-1] / total if total > 0 else 50.0
+
+
+def _assert_state_matches(actual, expected):
+    order = np.argsort(actual.codes)
+    other = np.argsort(expected.codes)
+    np.testing.assert_array_equal(actual.codes[order], expected.codes[other])
+    np.testing.assert_array_equal(actual.t[order], expected.t[other])
+    got, want = indicators.evaluate(actual), indicators.evaluate(expected)
+    for name in want:
+        np.testing.assert_allclose(got[name][order], want[name][other], rtol=1e-9, equal_nan=True, err_msg=name)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_compute_panel_matches_pandas(seed):
+    rng = np.random.default_rng(seed)
+    width = 120
+    lengths = [width, 80, 61, 30, 20, 7, 1, 0]  # 右对齐，不足的左侧补 NaN
+    codes = [f"{600000 + i}" for i in range(len(lengths))]
+    close = np.full((len(codes), width), np.nan)
+    volume = np.full((len(codes), width), np.nan)
+    for i, n in enumerate(lengths):
+        if n:
+            close[i, width - n:], volume[i, width - n:] = _random_bars(rng, n)
+
+    s = indicators.compute_panel(codes, np.arange(len(codes)), close, volume)
+    values = indicators.evaluate(s)
+    for i, n in enumerate(lengths):
+        ref = _reference(pd.Series(close[i, width - n:]), pd.Series(volume[i, width - n:])) if n else {}
+        for name, got in values.items():
+            want = ref.get(name, np.nan)
+            np.testing.assert_allclose(got[i], want, rtol=1e-9, equal_nan=True, err_msg=f"{codes[i]} {name}")
+
+
+def _append(store, code, rng, start, n):
+    close, volume = _random_bars(rng, n)
+    values = {c: close for c in COLUMNS}
+    values["volume"] = volume
+    t = T0 + (start + np.arange(n)) * DAY
+    store.append(DAILY, code, t, values)
+
+
+def test_advance_matches_full_recompute(tmp_path):
+    rng = np.random.default_rng(2)
+    store = KLineStore(root=str(tmp_path))
+    warmup = 400  # 覆盖全部 K 线，全量重算与增量推进的递推起点相同
+    initial = {"600000": 300, "600001": 100, "600002": 5, "600003": 200, "600004": 0, "600005": 50}
+    added = {"600000": 3, "600001": 1, "600002": 40, "600003": 0, "600004": 30, "600005": 1}
+    codes = list(initial)
+    for code, n in initial.items():
+        if n:
+            _append(store, code, rng, 0, n)
+
+    s = indicators.compute_state(codes, store, warmup)
+    for code, n in added.items():
+        if n:
+            _append(store, code, rng, initial[code], n)
+    s = indicators.advance(s, store, warmup)
+
+    _assert_state_matches(s, indicators.compute_state(codes, store, warmup))
+
+
+def test_advance_refreshes_long_gaps(tmp_path):
+    rng = np.random.default_rng(3)
+    store = KLineStore(root=str(tmp_path))
+    warmup = 60
+    codes = ["600000", "600001"]
+    for code in codes:
+        _append(store, code, rng, 0, 100)
+    s = indicators.compute_state(codes, store, warmup)
+    _append(store, "600000", rng, 100, warmup + 5)  # 缺口超过 warmup：改为全量计算
+    _append(store, "600001", rng, 100, 2)
+    s = indicators.advance(s, store, warmup)
+
+    fresh = indicators.compute_state(["600000"], store, warmup)
+    row = list(s.codes).index("600000")
+    got, want = indicators.evaluate(s), indicators.evaluate(fresh)
+    for name in want:
+        np.testing.assert_allclose(got[name][row], want[name][0], rtol=1e-9, equal_nan=True, err_msg=name)
+    assert s.t[list(s.codes).index("600001")] == T0 + 101 * DAY
@@ -0,0 +1,38 @@
+# tests/test_market_snapshot.py
+"""
+交易时段判断按交易所时间（Asia/Shanghai），与服务器本地时区无关
+"""
+
+import os
+import sys
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import market_snapshot  # noqa: E402
+from market_snapshot import OFF_HOURS_INTERVAL, POLL_INTERVAL  # noqa: E402
+
+
+def _clock(utc: datetime):
+    """替换模块内的 datetime，now() 返回指定的 UTC 时刻；不带时区时模拟 UTC 主机的本地时间"""
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return utc.astimezone(tz) if tz else utc.replace(tzinfo=None)
+    return mock.patch.object(market_snapshot, "datetime", Clock)
+
+
+@pytest.mark.parametrize("utc, trading", [
+    (datetime(2026, 10, 19, 1, 30, tzinfo=timezone.utc), True),  # 周一 09:30
+    (datetime(2026, 10, 19, 6, 59, tzinfo=timezone.utc), True),  # 周一 14:59
+    (datetime(2026, 10, 19, 4, 0, tzinfo=timezone.utc), False),  # 周一 12:00 午休
+    (datetime(2026, 10, 19, 9, 30, tzinfo=timezone.utc), False),  # 周一 17:30
+    (datetime(2026, 10, 18, 2, 0, tzinfo=timezone.utc), False),  # 周日 10:00
+])
+def test_trading_time_uses_exchange_clock(utc, trading):
+    with _clock(utc):
+        assert market_snapshot.is_trading_time() is trading
+        assert market_snapshot.refresh_interval() == (POLL_INTERVAL if trading else OFF_HOURS_INTERVAL)
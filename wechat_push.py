@@ -0,0 +1,124 @@
+# wechat_push.py
+"""
+微信订阅消息推送
+
+- WeChatTokenCache：access_token 缓存在共享存储中，所有进程共用，
+  提前刷新，同一时刻只有一个进程去微信换取新 token
+- PushDispatcher：连接池复用的 HTTP Session + 有界线程池并发发送，
+  按微信频率限制限流，逐条记录发送结果
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache_utils import SharedTokenCache, shared_store
+from rate_limit import backoff_delay, get_rate_limiter
+
+TOKEN_URL = "https://api.weixin.qq.com/cgi-bin/token"
+SEND_URL = "https://api.weixin.qq.com/cgi-bin/message/subscribe/send"
+
+PUSH_WORKERS = int(os.getenv("WECHAT_PUSH_WORKERS", 16))
+PUSH_RATE = float(os.getenv("WECHAT_PUSH_RATE", 50))  # 每秒发送条数
+PUSH_RETRIES = 3
+
+TOKEN_REFRESH_AHEAD = 300  # 距过期不足 5 分钟即刷新
+TOKEN_INVALID_CODES = {40001, 40014, 42001}  # token 无效 / 过期
+RETRYABLE_CODES = {-1, 45009, 45011}  # 系统繁忙 / 频率限制
+
+
+# --------------------------------------------------------------------------- #
+# access_token 缓存
+# --------------------------------------------------------------------------- #
+class WeChatTokenCache(SharedTokenCache):
+    def __init__(self, appid: str, secret: str, session: Optional[requests.Session] = None,
+                 store=shared_store):
+        super().__init__("wechat:access_token", refresh_ahead=TOKEN_REFRESH_AHEAD, store=store)
+        self.appid = appid
+        self.secret = secret
+        self.session = session or requests.Session()
+
+    def _request(self) -> Tuple[str, int]:
+        res = self.session.get(TOKEN_URL, params={
+            "grant_type": "client_credential",
+            "appid": self.appid,
+            "secret": self.secret,
+        }, timeout=5).json()
+        token = res.get("access_token")
+        if not token:
+            raise RuntimeError(f"[WeChat] 获取 access_token 失败: {res}")
+        return token, int(res.get("expires_in", 7200))
+
+
+# --------------------------------------------------------------------------- #
+# 推送
+# --------------------------------------------------------------------------- #
+@dataclass
+class PushMessage:
+    openid: str
+    data: Dict[str, Any]
+
+
+@dataclass
+class PushResult:
+    openid: str
+    ok: bool
+    errcode: Optional[int] = None
+    errmsg: str = ""
+    attempts: int = 0
+
+
+class PushDispatcher:
+    def __init__(self, appid: str, secret: str, template_id: str,
+                 workers: int = PUSH_WORKERS, rate: float = PUSH_RATE):
+        self.template_id = template_id
+        self.workers = workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.tokens = WeChatTokenCache(appid, secret, session=self.session)
+        self.limiter = get_rate_limiter("wechat_push", rate)
+
+    def _send_one(self, msg: PushMessage) -> PushResult:
+        result = PushResult(openid=msg.openid, ok=False)
+        for attempt in range(PUSH_RETRIES):
+            result.attempts = attempt + 1
+            try:
+                token = self.tokens.get()
+                self.limiter.acquire()
+                res = self.session.post(SEND_URL, params={"access_token": token}, json={
+                    "touser": msg.openid,
+                    "template_id": self.template_id,
+                    "data": msg.data,
+                }, timeout=5).json()
+            except Exception as exc:  # noqa: BLE001
+                result.errmsg = str(exc)
+                time.sleep(backoff_delay(attempt))
+                continue
+            result.errcode = res.get("errcode", 0)
+            result.errmsg = res.get("errmsg", "")
+            if result.errcode == 0:
+                result.ok = True
+                return result
+            if result.errcode in TOKEN_INVALID_CODES:
+                self.tokens.invalidate(token)  # 下次 get() 由 single-flight 换新 token
+                continue
+            if result.errcode not in RETRYABLE_CODES:
+                return result  # 如用户未订阅（43101）等，重试无意义
+            time.sleep(backoff_delay(attempt))
+        return result
+
+    def send_many(self, messages: List[PushMessage]) -> List[PushResult]:
+        """并发发送，返回与 messages 一一对应的结果"""
+        if not messages:
+            return []
+        self.tokens.get()  # 预热 token，避免各线程同时去换
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="wechat-push") as pool:
+            return list(pool.map(self._send_one, messages))